@@ -25,52 +25,255 @@
 # SOFTWARE.
 #
 
+import os
+import re
 import subprocess
+import threading
 import time
 
-from typing import List
+from adbclient import ADBClient
+from typing import Callable, Dict, Iterator, List, Tuple
 
 
 class ADBAdapter(object):
     """
-    Provides utility functions for issuing ADB commands.
+    Provides utility functions for issuing ADB commands. When a serial is given, commands are issued to this device
+    only, otherwise to the only device connected.
+
+    When the ADB server runs, commands are sent to it directly through an :class:`adbclient.ADBClient`. Otherwise they
+    go through the ``adb`` binary, which starts the server.
     """
 
     _ADB = 'adb'
 
+    # Properties changing while Android boots, in the order they usually change.
+    _BOOT_PROPERTIES = ('init.svc.bootanim', 'dev.bootcomplete', 'sys.boot_completed')
+
+    # Runs on the device and prints the boot properties whenever they change, until the boot is complete.
+    _BOOT_LOOP = ('last=; while :; do state="$(getprop init.svc.bootanim),$(getprop dev.bootcomplete),'
+                  '$(getprop sys.boot_completed)"; if [ "$state" != "$last" ]; then echo "$state"; last="$state"; fi; '
+                  'case "$state" in running,*) ;; *,1) exit 0;; esac; sleep 0.1; done')
+
+    # Lines of ``getprop`` without arguments, e.g. "[ro.product.name]: [sargo]".
+    _PROPERTY_PATTERN = re.compile(r'^\[([^\]]*)\]: \[(.*)\]$')
+
+    _running_client = None
+
+    @staticmethod
+    def devices(long: bool=False) -> List[str]:
+        """
+        :param long: also describe the devices, see :meth:`adbclient.ADBClient.devices`.
+        """
+        return ADBAdapter._call(lambda client: client.devices(long), lambda: subprocess.check_output(
+            [ADBAdapter._ADB, 'devices'] + (['-l'] if long else [])).decode().strip().splitlines()[1:])
+
+    @staticmethod
+    def getprop(name: str, serial: str='') -> str:
+        return ADBAdapter.shell('getprop', name, serial=serial)
+
+    @staticmethod
+    def getprops(serial: str='') -> Dict[str, str]:
+        """
+        :return: all the properties of the device at once, by name.
+        """
+        properties = dict()
+        for line in ADBAdapter.shell('getprop', serial=serial).splitlines():
+            match = ADBAdapter._PROPERTY_PATTERN.match(line.strip())
+            if match:
+                properties[match.group(1)] = match.group(2)
+        return properties
+
     @staticmethod
-    def devices() -> List[str]:
-        return subprocess.check_output([ADBAdapter._ADB, 'devices']).decode().strip().splitlines()[1:]
+    def pull(*files, serial: str='') -> int:
+        return ADBAdapter._call(lambda client: client.pull(list(files[:-1]), files[-1], serial) or 0,
+                                lambda: subprocess.check_call(ADBAdapter._command(serial, 'pull', *files)))
 
     @staticmethod
-    def pull(*files) -> int:
-        return subprocess.check_call([ADBAdapter._ADB, 'pull'] + list(files))
+    def pull_files(file_paths: List[Tuple[str, str]], serial: str='') -> None:
+        """
+        :param file_paths: pairs of the remote path and the local path of each file.
+        """
+        def pull_files() -> None:
+            for remote_path, local_path in file_paths:
+                if not os.path.isdir(os.path.dirname(os.path.abspath(local_path))):
+                    os.makedirs(os.path.dirname(os.path.abspath(local_path)), exist_ok=True)
+                subprocess.check_call(ADBAdapter._command(serial, 'pull', remote_path, local_path),
+                                      stdout=subprocess.DEVNULL)
+
+        ADBAdapter._call(lambda client: client.pull_files(file_paths, serial), pull_files)
 
     @staticmethod
-    def push(*files) -> int:
-        return subprocess.check_call([ADBAdapter._ADB, 'push'] + list(files))
+    def push(*files, serial: str='') -> int:
+        return ADBAdapter._call(lambda client: client.push(list(files[:-1]), files[-1], serial) or 0,
+                                lambda: subprocess.check_call(ADBAdapter._command(serial, 'push', *files)))
+
+    @staticmethod
+    def push_files(file_paths: List[Tuple[str, str]], serial: str='') -> None:
+        """
+        :param file_paths: pairs of the local path and the remote path of each file.
+        """
+        def push_files() -> None:
+            for local_path, remote_path in file_paths:
+                subprocess.check_call(ADBAdapter._command(serial, 'push', local_path, remote_path),
+                                      stdout=subprocess.DEVNULL)
+
+        ADBAdapter._call(lambda client: client.push_files(file_paths, serial), push_files)
 
     @staticmethod
-    def reboot(option: str='') -> int:
+    def reboot(option: str='', serial: str='') -> int:
         reboot_options = ['bootloader', 'recovery', 'sideload', 'sideload-auto-reboot']
         if option and option not in reboot_options:
             raise ValueError('Invalid reboot option: {}'.format(option))
-        return subprocess.check_call([ADBAdapter._ADB, 'reboot', option])
+        return ADBAdapter._call(lambda client: client.reboot(option, serial) or 0,
+                                lambda: subprocess.check_call(ADBAdapter._command(serial, 'reboot', option)))
 
     @staticmethod
-    def shell(*args) -> str:
-        return subprocess.check_output([ADBAdapter._ADB, 'shell'] + list(args)).decode().strip()
+    def serials() -> List[str]:
+        # Lines are made of the serial and the state of the device, separated by a tab.
+        return [device.split()[0] for device in ADBAdapter.devices() if device.strip()]
 
     @staticmethod
-    def wait_for_boot_completed() -> None:
-        ADBAdapter.wait_for_device()
-        while ADBAdapter.shell('getprop', 'sys.boot_completed') != '1':
+    def shell(*args, serial: str='') -> str:
+        def shell(client: ADBClient) -> str:
+            exit_code, output, _ = client.shell(' '.join(args), serial)
+            if exit_code:
+                raise subprocess.CalledProcessError(exit_code, ADBAdapter._command(serial, 'shell', *args), output)
+            return output.decode().strip()
+
+        def shell_binary() -> str:
+            return subprocess.check_output(ADBAdapter._command(serial, 'shell', *args)).decode().strip()
+
+        # An interactive shell needs the binary.
+        if not args:
+            return shell_binary()
+        return ADBAdapter._call(shell, shell_binary)
+
+    @staticmethod
+    def wait_for_boot_completed(serial: str='', timeout_sec: float=0) -> List[Tuple[str, float]]:
+        """
+        Wait for a device to boot. The boot properties are followed by a single loop running on the device, rather than
+        by querying them over and over.
+
+        :param timeout_sec: time after which :class:`TimeoutError` is raised, or 0 to wait forever.
+        :return: the timeline of the boot: the phases (the device showing up, then the changes of the boot properties)
+                 and when they were reached, in seconds after the call.
+        """
+        start_time = time.time()
+        deadline = start_time + timeout_sec if timeout_sec else 0
+        timeline = list()
+        values = dict()
+        while True:
+            ADBAdapter.wait_for_device(serial, ADBAdapter._remaining_sec(deadline))
+            if not timeline:
+                timeline.append(('device', time.time() - start_time))
+
+            # The connection may drop while the device boots (e.g. when adbd restarts), the loop is then run again.
+            for line in ADBAdapter._shell_lines(ADBAdapter._BOOT_LOOP, serial, ADBAdapter._remaining_sec(deadline)):
+                for name, value in zip(ADBAdapter._BOOT_PROPERTIES, line.strip().split(',')):
+                    if value and value != values.get(name):
+                        timeline.append(('{}={}'.format(name, value), time.time() - start_time))
+                    values[name] = value
+            if values.get('sys.boot_completed') == '1' and values.get('init.svc.bootanim') != 'running':
+                return timeline
             time.sleep(1)
 
     @staticmethod
-    def wait_for_device() -> int:
-        return subprocess.check_call([ADBAdapter._ADB, 'wait-for-device'])
+    def wait_for_device(serial: str='', timeout_sec: float=0) -> int:
+        """
+        :param timeout_sec: time after which :class:`TimeoutError` is raised, or 0 to wait forever.
+        """
+        return ADBAdapter._call(lambda client: client.wait_for_device(serial, timeout_sec=timeout_sec) or 0,
+                                lambda: ADBAdapter._check_call_with_timeout(
+                                    ADBAdapter._command(serial, 'wait-for-device'), timeout_sec))
+
+    @staticmethod
+    def wait_for_shutdown(serial: str='', timeout_sec: float=0) -> int:
+        """
+        Wait for a device to be no longer available to ADB, e.g. after being asked to reboot.
+
+        :param timeout_sec: time after which :class:`TimeoutError` is raised, or 0 to wait forever.
+        """
+        return ADBAdapter._call(lambda client: client.wait_for_disconnect(serial, timeout_sec) or 0,
+                                lambda: ADBAdapter._check_call_with_timeout(
+                                    ADBAdapter._command(serial, 'wait-for-disconnect'), timeout_sec))
+
+    @staticmethod
+    def _call(client_call: Callable[[ADBClient], object], binary_call: Callable[[], object]) -> object:
+        # Go through the binary only when the server does not run: it starts the server for the next calls.
+        client = ADBAdapter._client()
+        if client:
+            try:
+                return client_call(client)
+            except ConnectionRefusedError:
+                ADBAdapter._forget_client()
+        return binary_call()
+
+    @staticmethod
+    def _check_call_with_timeout(cmd: List[str], timeout_sec: float) -> int:
+        try:
+            return subprocess.check_call(cmd, timeout=timeout_sec or None)
+        except subprocess.TimeoutExpired:
+            raise TimeoutError('"{}" took longer than {:.0f}s'.format(' '.join(cmd), timeout_sec))
+
+    @staticmethod
+    def _client() -> ADBClient:
+        # The server is only probed until it is found running, then the client is kept until a connection is refused.
+        if ADBAdapter._running_client is None:
+            client = ADBClient()
+            if client.is_running():
+                ADBAdapter._running_client = client
+        return ADBAdapter._running_client
+
+    @staticmethod
+    def _forget_client() -> None:
+        ADBAdapter._running_client = None
+
+    @staticmethod
+    def _remaining_sec(deadline: float) -> float:
+        # Return 0 when there is no deadline.
+        if not deadline:
+            return 0
+        if time.time() >= deadline:
+            raise TimeoutError('Timed out waiting for the device')
+        return deadline - time.time()
+
+    @staticmethod
+    def _shell_lines(command: str, serial: str, timeout_sec: float) -> Iterator[str]:
+        # Yield the output of a command as it comes. The output simply ends if the device goes away.
+        client = ADBAdapter._client()
+        if client:
+            try:
+                yield from client.shell_lines(command, serial, timeout_sec)
+                return
+            except ConnectionRefusedError:
+                ADBAdapter._forget_client()
+            except (ConnectionError, RuntimeError):
+                return
+
+        # The process is killed once the time is up.
+        process = subprocess.Popen(ADBAdapter._command(serial, 'shell', command), stdout=subprocess.PIPE)
+        timed_out = threading.Event()
+
+        def kill() -> None:
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(timeout_sec, kill) if timeout_sec else None
+        if timer:
+            timer.start()
+        try:
+            for line in process.stdout:
+                yield line.decode(errors='replace')
+        finally:
+            if timer:
+                timer.cancel()
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+        if timed_out.is_set():
+            raise TimeoutError('Timed out waiting for the device')
 
     @staticmethod
-    def wait_for_shutdown() -> None:
-        ADBAdapter.shell()
+    def _command(serial: str, *args: str) -> List[str]:
+        return [ADBAdapter._ADB] + (['-s', serial] if serial else []) + list(args)
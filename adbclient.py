@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import os
+import socket
+import stat
+import struct
+import time
+
+from typing import Dict, Iterator, List, Tuple
+
+
+class ADBClient(object):
+    """
+    Talk to the ADB server directly through its socket (the "smart socket" protocol), rather than through the ``adb``
+    binary. This spares a process per command, so a command costs about one round trip to the server.
+
+    Each request opens a connection to the server, which is cheap on the loopback interface and lets several commands
+    run at the same time from different threads. The list of devices is followed through ``host:track-devices``, which
+    pushes the changes instead of being polled.
+
+    See ``packages/modules/adb/SERVICES.TXT``, ``SYNC.TXT`` and ``shell_protocol.h`` for the protocol.
+    """
+
+    DEFAULT_PORT = 5037
+
+    _SHELL_STDOUT = 1
+    _SHELL_STDERR = 2
+    _SHELL_EXIT = 3
+    _SHELL_PACKET_HEADER_FORMAT = '<BI'
+    _SHELL_PACKET_HEADER_SIZE = struct.calcsize(_SHELL_PACKET_HEADER_FORMAT)
+
+    _SYNC_HEADER_FORMAT = '<4sI'
+    _SYNC_HEADER_SIZE = struct.calcsize(_SYNC_HEADER_FORMAT)
+    _SYNC_STAT_FORMAT = '<III'
+    _SYNC_DENT_FORMAT = '<IIII'
+    _SYNC_MAX_DATA_SIZE = 64 * 1024
+
+    def __init__(self, host: str='127.0.0.1', port: int=0, timeout_sec: float=60) -> None:
+        self._host = host
+        self._port = port or int(os.environ.get('ANDROID_ADB_SERVER_PORT', ADBClient.DEFAULT_PORT))
+        self._timeout_sec = timeout_sec
+
+    def devices(self, long: bool=False) -> List[str]:
+        """
+        :param long: also describe the devices, like ``adb devices -l``.
+        :return: lines made of the serial and the state of each device, separated by a tab, like ``adb devices``.
+                 Descriptions follow as "name:value" fields, separated by spaces.
+        """
+        with self._connect() as server_socket:
+            ADBClient._request(server_socket, 'host:devices-l' if long else 'host:devices')
+            return ADBClient._read_string(server_socket).strip().splitlines()
+
+    def is_running(self) -> bool:
+        try:
+            with self._connect():
+                return True
+        except ConnectionRefusedError:
+            return False
+
+    def pull(self, remote_paths: List[str], local_path: str, serial: str='') -> None:
+        """
+        Copy files or directories from the device, like ``adb pull``.
+        """
+        with self._transport(serial, 'sync:') as device_socket:
+            into_directory = os.path.isdir(local_path)
+            for remote_path in remote_paths:
+                mode, _, _ = ADBClient._sync_stat(device_socket, remote_path)
+                if not mode:
+                    raise FileNotFoundError('Remote path "{}" does not exist'.format(remote_path))
+                destination = os.path.join(local_path, os.path.basename(remote_path.rstrip('/'))) if into_directory \
+                    else local_path
+                for relative_path in ADBClient._sync_walk(device_socket, remote_path, mode):
+                    file_path = os.path.join(destination, relative_path) if relative_path else destination
+                    if not os.path.isdir(os.path.dirname(os.path.abspath(file_path))):
+                        os.makedirs(os.path.dirname(os.path.abspath(file_path)))
+                    ADBClient._sync_receive(device_socket, '/'.join(filter(None, (remote_path.rstrip('/'),
+                                                                                  relative_path))), file_path)
+            ADBClient._sync_quit(device_socket)
+
+    def pull_files(self, file_paths: List[Tuple[str, str]], serial: str='') -> None:
+        """
+        Copy files from the device through a single connection.
+
+        :param file_paths: pairs of the remote path and the local path of each file.
+        """
+        with self._transport(serial, 'sync:') as device_socket:
+            for remote_path, local_path in file_paths:
+                if not os.path.isdir(os.path.dirname(os.path.abspath(local_path))):
+                    os.makedirs(os.path.dirname(os.path.abspath(local_path)), exist_ok=True)
+                ADBClient._sync_receive(device_socket, remote_path, local_path)
+            ADBClient._sync_quit(device_socket)
+
+    def push(self, local_paths: List[str], remote_path: str, serial: str='') -> None:
+        """
+        Copy files or directories to the device, like ``adb push``. Missing directories are created by the device.
+        """
+        with self._transport(serial, 'sync:') as device_socket:
+            mode, _, _ = ADBClient._sync_stat(device_socket, remote_path)
+            into_directory = stat.S_ISDIR(mode)
+            for local_path in local_paths:
+                destination = '/'.join((remote_path.rstrip('/'), os.path.basename(local_path.rstrip('/')))) \
+                    if into_directory else remote_path
+                if not os.path.isdir(local_path):
+                    ADBClient._sync_send(device_socket, local_path, destination)
+                    continue
+                for directory, _, file_names in os.walk(local_path):
+                    for file_name in sorted(file_names):
+                        file_path = os.path.join(directory, file_name)
+                        ADBClient._sync_send(device_socket, file_path, '/'.join(
+                            [destination] + os.path.relpath(file_path, local_path).split(os.sep)))
+            ADBClient._sync_quit(device_socket)
+
+    def push_files(self, file_paths: List[Tuple[str, str]], serial: str='') -> None:
+        """
+        Copy files to the device through a single connection.
+
+        :param file_paths: pairs of the local path and the remote path of each file.
+        """
+        with self._transport(serial, 'sync:') as device_socket:
+            for local_path, remote_path in file_paths:
+                ADBClient._sync_send(device_socket, local_path, remote_path)
+            ADBClient._sync_quit(device_socket)
+
+    def reboot(self, option: str='', serial: str='') -> None:
+        with self._transport(serial, 'reboot:{}'.format(option)) as device_socket:
+            # The device acknowledges by closing the connection.
+            while device_socket.recv(4096):
+                pass
+
+    def shell(self, command: str, serial: str='', timeout_sec: float=0) -> Tuple[int, bytes, bytes]:
+        """
+        :param timeout_sec: time after which :class:`TimeoutError` is raised, or 0 to wait forever. Commands may print
+                            nothing for long (e.g. while installing a package), the timeout of the client does not apply.
+        :return: the exit code, the standard output and the error output of the command.
+        """
+        deadline = time.time() + timeout_sec if timeout_sec else 0
+        output = {ADBClient._SHELL_STDOUT: bytearray(), ADBClient._SHELL_STDERR: bytearray()}
+        with self._transport(serial, 'shell,v2,raw:{}'.format(command), None) as device_socket:
+            while True:
+                packet_id, size = struct.unpack(ADBClient._SHELL_PACKET_HEADER_FORMAT, ADBClient._receive(
+                    device_socket, ADBClient._SHELL_PACKET_HEADER_SIZE, deadline))
+                data = ADBClient._receive(device_socket, size, deadline)
+                if packet_id == ADBClient._SHELL_EXIT:
+                    return data[0], bytes(output[ADBClient._SHELL_STDOUT]), bytes(output[ADBClient._SHELL_STDERR])
+                if packet_id in output:
+                    output[packet_id].extend(data)
+
+    def shell_lines(self, command: str, serial: str='', timeout_sec: float=0) -> Iterator[str]:
+        """
+        Run a command and yield the lines of its standard output as they come, for commands running for long.
+
+        :param timeout_sec: time after which :class:`TimeoutError` is raised, or 0 to wait forever.
+        """
+        deadline = time.time() + timeout_sec if timeout_sec else 0
+        with self._transport(serial, 'shell,v2,raw:{}'.format(command), None) as device_socket:
+            output = bytearray()
+            while True:
+                packet_id, size = struct.unpack(ADBClient._SHELL_PACKET_HEADER_FORMAT, ADBClient._receive(
+                    device_socket, ADBClient._SHELL_PACKET_HEADER_SIZE, deadline))
+                data = ADBClient._receive(device_socket, size, deadline)
+                if packet_id == ADBClient._SHELL_EXIT:
+                    if output:
+                        yield output.decode(errors='replace')
+                    return
+                if packet_id == ADBClient._SHELL_STDOUT:
+                    output.extend(data)
+                    lines = output.split(b'\n')
+                    output = lines.pop()
+                    for line in lines:
+                        yield line.decode(errors='replace')
+
+    def track_devices(self, timeout_sec: float=0) -> Iterator[Dict[str, str]]:
+        """
+        :param timeout_sec: time after which :class:`TimeoutError` is raised, or 0 to follow the devices forever.
+        :return: the state of each device by serial, then again every time it changes.
+        """
+        deadline = time.time() + timeout_sec if timeout_sec else 0
+        with self._connect(None) as server_socket:
+            ADBClient._request(server_socket, 'host:track-devices')
+            while True:
+                size = int(ADBClient._receive(server_socket, 4, deadline), 16)
+                yield dict(line.split('\t', 1) for line in ADBClient._receive(
+                    server_socket, size, deadline).decode().splitlines() if '\t' in line)
+
+    def wait_for_device(self, serial: str='', state: str='device', timeout_sec: float=0) -> None:
+        """
+        Wait for a device (or any device if no serial is given) to be in a state.
+        """
+        for devices in self.track_devices(timeout_sec):
+            if (devices.get(serial) if serial else next(iter(devices.values()), None)) == state:
+                return
+
+    def wait_for_disconnect(self, serial: str='', timeout_sec: float=0) -> None:
+        """
+        Wait for a device (or all the devices if no serial is given) to be no longer available.
+        """
+        for devices in self.track_devices(timeout_sec):
+            if (devices.get(serial) != 'device') if serial else ('device' not in devices.values()):
+                return
+
+    def _connect(self, timeout_sec: float=-1) -> socket.socket:
+        return socket.create_connection((self._host, self._port),
+                                        self._timeout_sec if timeout_sec == -1 else timeout_sec)
+
+    @staticmethod
+    def _read_string(server_socket: socket.socket) -> str:
+        # Strings are prefixed by their length, as 4 hexadecimal digits.
+        return ADBClient._receive(server_socket, int(ADBClient._receive(server_socket, 4), 16)).decode()
+
+    @staticmethod
+    def _receive(device_socket: socket.socket, size: int, deadline: float=0) -> bytes:
+        # Without a deadline, the timeout of the socket applies to each read.
+        data = bytearray()
+        while len(data) < size:
+            if deadline:
+                if time.time() >= deadline:
+                    raise TimeoutError('Timed out waiting for the ADB server')
+                device_socket.settimeout(deadline - time.time())
+            try:
+                buffer = device_socket.recv(size - len(data))
+            except socket.timeout:
+                raise TimeoutError('Timed out waiting for the ADB server')
+            if not buffer:
+                raise ConnectionError('The ADB server closed the connection')
+            data.extend(buffer)
+        return bytes(data)
+
+    @staticmethod
+    def _request(server_socket: socket.socket, request: str) -> None:
+        server_socket.sendall('{:04x}{}'.format(len(request.encode()), request).encode())
+        status = ADBClient._receive(server_socket, 4)
+        if status == b'FAIL':
+            raise RuntimeError('ADB server: {}'.format(ADBClient._read_string(server_socket)))
+        if status != b'OKAY':
+            raise ConnectionError('Unexpected response from the ADB server: {}'.format(status))
+
+    @staticmethod
+    def _sync_quit(device_socket: socket.socket) -> None:
+        device_socket.sendall(struct.pack(ADBClient._SYNC_HEADER_FORMAT, b'QUIT', 0))
+
+    @staticmethod
+    def _sync_receive(device_socket: socket.socket, remote_path: str, local_path: str) -> None:
+        ADBClient._sync_request(device_socket, b'RECV', remote_path.encode())
+        with open(local_path, 'wb') as local_file:
+            while True:
+                response_id, size = ADBClient._sync_response(device_socket)
+                if response_id == b'DONE':
+                    return
+                if response_id != b'DATA':
+                    raise ConnectionError('Unexpected sync response: {}'.format(response_id))
+                local_file.write(ADBClient._receive(device_socket, size))
+
+    @staticmethod
+    def _sync_request(device_socket: socket.socket, request_id: bytes, data: bytes) -> None:
+        device_socket.sendall(struct.pack(ADBClient._SYNC_HEADER_FORMAT, request_id, len(data)) + data)
+
+    @staticmethod
+    def _sync_response(device_socket: socket.socket) -> Tuple[bytes, int]:
+        response_id, size = struct.unpack(ADBClient._SYNC_HEADER_FORMAT,
+                                          ADBClient._receive(device_socket, ADBClient._SYNC_HEADER_SIZE))
+        if response_id == b'FAIL':
+            raise RuntimeError('ADB sync: {}'.format(ADBClient._receive(device_socket, size).decode()))
+        return response_id, size
+
+    @staticmethod
+    def _sync_send(device_socket: socket.socket, local_path: str, remote_path: str) -> None:
+        local_stat = os.stat(local_path)
+        ADBClient._sync_request(device_socket, b'SEND', '{},{}'.format(remote_path, local_stat.st_mode).encode())
+        with open(local_path, 'rb') as local_file:
+            for buffer in iter(lambda: local_file.read(ADBClient._SYNC_MAX_DATA_SIZE), b''):
+                ADBClient._sync_request(device_socket, b'DATA', buffer)
+        device_socket.sendall(struct.pack(ADBClient._SYNC_HEADER_FORMAT, b'DONE', int(local_stat.st_mtime)))
+        ADBClient._sync_response(device_socket)
+
+    @staticmethod
+    def _sync_stat(device_socket: socket.socket, remote_path: str) -> Tuple[int, int, int]:
+        # Return the mode, size and modification time of a remote file, with a mode of 0 if it does not exist.
+        ADBClient._sync_request(device_socket, b'STAT', remote_path.encode())
+        response = ADBClient._receive(device_socket, 4 + struct.calcsize(ADBClient._SYNC_STAT_FORMAT))
+        return struct.unpack(ADBClient._SYNC_STAT_FORMAT, response[4:])
+
+    @staticmethod
+    def _sync_walk(device_socket: socket.socket, remote_path: str, mode: int) -> List[str]:
+        # Return the paths of the regular files under a remote path, relative to it (an empty path for a file).
+        if not stat.S_ISDIR(mode):
+            return ['']
+        ADBClient._sync_request(device_socket, b'LIST', remote_path.encode())
+        entries = list()
+        while True:
+            response = ADBClient._receive(device_socket, 4 + struct.calcsize(ADBClient._SYNC_DENT_FORMAT))
+            entry_mode, _, _, name_size = struct.unpack(ADBClient._SYNC_DENT_FORMAT, response[4:])
+            if response[:4] == b'DONE':
+                break
+            name = ADBClient._receive(device_socket, name_size).decode()
+            if name not in ('.', '..'):
+                entries.append((name, entry_mode))
+
+        relative_paths = list()
+        for name, entry_mode in sorted(entries):
+            if stat.S_ISDIR(entry_mode):
+                relative_paths.extend('/'.join((name, path)) for path in ADBClient._sync_walk(
+                    device_socket, '/'.join((remote_path.rstrip('/'), name)), entry_mode))
+            elif stat.S_ISREG(entry_mode):
+                relative_paths.append(name)
+        return relative_paths
+
+    def _transport(self, serial: str, service: str, timeout_sec: float=-1) -> socket.socket:
+        # Switch the connection to the device, then open a service on it.
+        server_socket = self._connect(timeout_sec)
+        try:
+            ADBClient._request(server_socket, 'host:transport:{}'.format(serial) if serial else 'host:transport-any')
+            ADBClient._request(server_socket, service)
+        except BaseException:
+            server_socket.close()
+            raise
+        return server_socket
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import concurrent.futures
+import json
+import os
+import shlex
+import subprocess
+import threading
+import time
+
+from adb import ADBAdapter
+from cache import ArtifactCache
+from commandline import DirectorySyncCommandLineInterface
+from configuration import Configuration
+from sanity import SanityChecks
+from typing import Callable, Dict, List, Tuple
+
+
+class FileHashCache(object):
+    """
+    Remember the content hashes of local files, so that files which did not change (same size and modification time)
+    are not hashed again.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._changed = False
+        self._entries = None
+        self._lock = threading.Lock()
+        self._path = path
+
+    def hash_file(self, file_path: str) -> str:
+        file_path = os.path.realpath(file_path)
+        file_stat = os.stat(file_path)
+        with self._lock:
+            entry = self._load().get(file_path)
+        if entry and entry[:2] == [file_stat.st_size, file_stat.st_mtime_ns]:
+            return entry[2]
+
+        file_hash = ArtifactCache.hash_file(file_path)
+        with self._lock:
+            self._entries[file_path] = [file_stat.st_size, file_stat.st_mtime_ns, file_hash]
+            self._changed = True
+        return file_hash
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._changed:
+                return
+            # Entries of files which no longer exist are dropped.
+            entries = dict((path, entry) for path, entry in self._entries.items() if os.path.isfile(path))
+            if not os.path.isdir(os.path.dirname(self._path)):
+                os.makedirs(os.path.dirname(self._path))
+            with open(self._path + '.tmp', 'w') as cache_file:
+                json.dump(entries, cache_file, sort_keys=True)
+            os.replace(self._path + '.tmp', self._path)
+            self._changed = False
+
+    def _load(self) -> Dict[str, list]:
+        # Must be called with the lock held.
+        if self._entries is None:
+            try:
+                with open(self._path) as cache_file:
+                    self._entries = json.load(cache_file)
+            except FileNotFoundError:
+                self._entries = dict()
+        return self._entries
+
+
+class DirectorySync(object):
+    """
+    Synchronize a local directory and a directory of a device, transferring only the files whose content differs. It
+    is the quick way of trying out a rebuilt ``system`` directory without flashing the whole image again.
+
+    Local files are hashed in parallel, their hashes being cached (see :class:`FileHashCache`). The files of the device
+    are hashed on the device by a single shell command. The files to transfer are then spread over several streams,
+    each being a connection to the ADB server. Files which only exist on the destination are left alone.
+    """
+
+    # Prints the symbolic links of the directory as "link  ./path" lines, then the SHA-256 and the path of its files as
+    # "hash  ./path" lines. Files which cannot be read are left out (and sha256sum exits with an error).
+    _REMOTE_HASH_COMMAND = ("cd {} 2>/dev/null || exit 0; find . -type l -exec printf 'link  %s\\n' {{}} +; "
+                            "find . -type f -exec sha256sum {{}} +")
+    _REMOTE_LINK = 'link'
+
+    def __init__(self, hash_cache: FileHashCache, max_streams: int=4, serial: str='') -> None:
+        self._hash_cache = hash_cache
+        self._max_streams = max(max_streams, 1)
+        self._serial = serial
+
+    @staticmethod
+    def description(report: Dict[str, float]) -> str:
+        description = list()
+        description.append('Files: {} ({} transferred)'.format(report['files'], report['transferred_files']))
+        if report['skipped_links']:
+            description.append('Skipped: {} symbolic links'.format(report['skipped_links']))
+        description.append('Transferred: {}'.format(ArtifactCache.human_readable_size(report['transferred_bytes'])))
+        description.append('Saved: {}'.format(ArtifactCache.human_readable_size(report['saved_bytes'])))
+        description.append('Duration: {:.1f}s'.format(report['seconds']))
+        description.append('=' * max(map(len, description)))
+        description.insert(0, description[-1])
+
+        return '\n'.join(description)
+
+    def pull(self, remote_path: str, local_path: str) -> Dict[str, float]:
+        """
+        :return: a report of the files, bytes transferred and bytes saved, and the duration.
+        """
+        start_time = time.time()
+        remote_hashes, skipped_links = self._remote_hashes(remote_path)
+        local_hashes, _ = self._local_hashes(local_path)
+
+        file_paths = list()
+        saved_bytes = 0
+        for relative_path in sorted(remote_hashes):
+            if local_hashes.get(relative_path, ('', 0))[0] == remote_hashes[relative_path]:
+                saved_bytes += local_hashes[relative_path][1]
+            else:
+                file_paths.append((DirectorySync._remote_file_path(remote_path, relative_path),
+                                   os.path.join(local_path, *relative_path.split('/'))))
+        self._transfer(ADBAdapter.pull_files, file_paths, dict())
+
+        return {
+            'files': len(remote_hashes),
+            'saved_bytes': saved_bytes,
+            'seconds': time.time() - start_time,
+            'skipped_links': skipped_links,
+            'transferred_bytes': sum(os.path.getsize(local_file_path) for _, local_file_path in file_paths),
+            'transferred_files': len(file_paths)
+        }
+
+    def push(self, local_path: str, remote_path: str) -> Dict[str, float]:
+        """
+        :return: a report of the files, bytes transferred and bytes saved, and the duration.
+        """
+        start_time = time.time()
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            remote_hashes_future = executor.submit(self._remote_hashes, remote_path)
+            local_hashes, skipped_links = self._local_hashes(local_path)
+            remote_hashes, _ = remote_hashes_future.result()
+
+        file_paths = list()
+        sizes = dict()
+        saved_bytes = 0
+        for relative_path in sorted(local_hashes):
+            file_hash, size = local_hashes[relative_path]
+            if remote_hashes.get(relative_path) == file_hash:
+                saved_bytes += size
+            else:
+                file_paths.append((os.path.join(local_path, *relative_path.split('/')),
+                                   DirectorySync._remote_file_path(remote_path, relative_path)))
+                sizes[file_paths[-1]] = size
+        self._transfer(ADBAdapter.push_files, file_paths, sizes)
+
+        return {
+            'files': len(local_hashes),
+            'saved_bytes': saved_bytes,
+            'seconds': time.time() - start_time,
+            'skipped_links': skipped_links,
+            'transferred_bytes': sum(sizes.values()),
+            'transferred_files': len(file_paths)
+        }
+
+    def _local_hashes(self, local_path: str) -> Tuple[Dict[str, Tuple[str, int]], int]:
+        # Return the hash and size of the files by path relative to the directory, with "/" as separator, and the number
+        # of symbolic links, which are skipped.
+        relative_paths = list()
+        links = 0
+        for directory, directory_names, file_names in os.walk(local_path):
+            links += sum(1 for name in directory_names if os.path.islink(os.path.join(directory, name)))
+            for file_name in file_names:
+                file_path = os.path.join(directory, file_name)
+                if os.path.islink(file_path):
+                    links += 1
+                elif os.path.isfile(file_path):
+                    relative_paths.append(os.path.relpath(file_path, local_path))
+
+        # Hashing releases the GIL, so threads hash files in parallel.
+        with concurrent.futures.ThreadPoolExecutor(os.cpu_count()) as executor:
+            hashes = list(executor.map(self._hash_cache.hash_file,
+                                       [os.path.join(local_path, path) for path in relative_paths]))
+        self._hash_cache.save()
+
+        return dict((relative_path.replace(os.sep, '/'),
+                     (file_hash, os.path.getsize(os.path.join(local_path, relative_path))))
+                    for relative_path, file_hash in zip(relative_paths, hashes)), links
+
+    def _remote_hashes(self, remote_path: str) -> Tuple[Dict[str, str], int]:
+        # Return the hash of the files by path relative to the directory, or nothing if it does not exist, and the number
+        # of symbolic links, which are skipped. The files which could not be hashed are left out.
+        try:
+            output = ADBAdapter.shell(DirectorySync._REMOTE_HASH_COMMAND.format(shlex.quote(remote_path)),
+                                      serial=self._serial)
+        except subprocess.CalledProcessError as error:
+            output = error.output.decode(errors='replace')
+        remote_hashes = dict()
+        links = 0
+        for line in output.splitlines():
+            file_hash, _, file_path = line.partition('  ')
+            if not file_path.startswith('./'):
+                continue
+            if file_hash == DirectorySync._REMOTE_LINK:
+                links += 1
+            else:
+                remote_hashes[file_path[2:]] = file_hash
+        return remote_hashes, links
+
+    @staticmethod
+    def _remote_file_path(remote_path: str, relative_path: str) -> str:
+        return '{}/{}'.format(remote_path.rstrip('/'), relative_path)
+
+    def _transfer(self, transfer: Callable[[List[Tuple[str, str]], str], None], file_paths: List[Tuple[str, str]],
+                  sizes: Dict[Tuple[str, str], int]) -> None:
+        # Spread the files over the streams so that they carry about as many bytes each, largest files first. Files of
+        # unknown size count as one byte, so that they are spread evenly.
+        streams = [list() for _ in range(min(self._max_streams, len(file_paths)))]
+        stream_sizes = [0] * len(streams)
+        for pair in sorted(file_paths, key=lambda pair: sizes.get(pair, 1), reverse=True):
+            stream_index = stream_sizes.index(min(stream_sizes))
+            streams[stream_index].append(pair)
+            stream_sizes[stream_index] += sizes.get(pair, 1)
+
+        with concurrent.futures.ThreadPoolExecutor(max(len(streams), 1)) as executor:
+            for future in [executor.submit(transfer, stream, self._serial) for stream in streams]:
+                future.result()
+
+
+def main() -> None:
+    SanityChecks.run()
+
+    configuration = Configuration()
+    cli = DirectorySyncCommandLineInterface(configuration)
+    directory_sync = DirectorySync(FileHashCache(configuration.adb_hash_cache_path()), cli.max_streams(),
+                                   cli.serial())
+    if cli.pull():
+        report = directory_sync.pull(cli.remote_path(), cli.local_path())
+    else:
+        report = directory_sync.push(cli.local_path(), cli.remote_path())
+    print(DirectorySync.description(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -26,15 +26,21 @@
 #
 
 import contexts
+import glob
+import logs
 import os
 import subprocess
 import sys
 
 from aospspec import AOSPSpec
 from aosptree import AOSPTree
+from cache import ArtifactCache
 from commandline import AOSPBuildCommandLineInterface
 from configuration import Configuration
+from modules import ModuleIndex
+from planner import BuildPlanner
 from sanity import SanityChecks
+from typing import Dict, List
 
 
 class AOSPBuild(object):
@@ -43,7 +49,24 @@ class AOSPBuild(object):
     conjunction with :class:`AOSPSpec`.
     """
 
-    def __init__(self, make_target: str, num_cores: int=os.cpu_count()) -> None:
+    _FINGERPRINT_FILE_NAME_FORMAT = 'fingerprint-{}'
+
+    # Environment variables read by the build system. Variables changing on every run (e.g. the job number of a CI) must
+    # not be part of the fingerprint, or builds would never be skipped.
+    _FINGERPRINT_VARIABLES_PREFIXES = ('ANDROID_', 'CCACHE_', 'DIST_DIR', 'OUT_DIR', 'TARGET_', 'USE_CCACHE')
+
+    # Images built for the device, relative to the product output directory. Cached along with the dist outputs.
+    _IMAGES_GLOB = '*.img'
+    _SIGNED_INFIX = '-signed_'
+
+    # Print the value of a variable of the build system, as set up by the buildspec file.
+    _DUMPVAR_COMMAND = ['build/soong/soong_ui.bash', '--dumpvar-mode']
+
+    def __init__(self, make_target: str, num_cores: int=os.cpu_count(), artifact_cache: ArtifactCache=None,
+                 incremental: bool=False, force: bool=False) -> None:
+        self._artifact_cache = artifact_cache
+        self._force = force
+        self._incremental = incremental
         self._make_target = make_target
         self._num_cores = num_cores
 
@@ -51,23 +74,74 @@ class AOSPBuild(object):
         return AOSPBuild.description(self._make_target, self._num_cores)
 
     def build(self, configuration: Configuration, aosp_tree: AOSPTree) -> None:
-        with contexts.set_cwd(aosp_tree.path()):
+        with contexts.set_cwd(aosp_tree.path()) as context:
             # Setup CCache.
-            if not os.path.exists(configuration.ccache_path()):
-                os.mkdir(configuration.ccache_path())
-            if len(next(os.walk(configuration.ccache_path()))[-1]) == 0:  # If there are no files, CCache is not set up.
-                subprocess.check_call([configuration.ccache_binary_path(), '-M', '50G'])
+            ccache_path = context.path(configuration.ccache_path())
+            if not os.path.exists(ccache_path):
+                os.mkdir(ccache_path)
+            if len(next(os.walk(ccache_path))[-1]) == 0:  # If there are no files, CCache is not set up.
+                subprocess.check_call([configuration.ccache_binary_path(), '-M', '50G'], **context.kwargs())
 
-            # Setup environment then build.
             environment_variables = {
                 'CCACHE_DIR': configuration.ccache_path(),
                 'USE_CCACHE_DIR': str(1 if configuration.ccache_path() else 0)
             }
-            build_command = ['make', self._make_target, '-j', str(self._num_cores)]
+
+            # Skip the build entirely if nothing changed since the last successful one.
+            project_revisions = aosp_tree.project_revisions()
+            local_changes = aosp_tree.local_changes(self._num_cores)
+            buildspec = AOSPSpec.buildspec(aosp_tree)
+            fingerprint = self._fingerprint(context, project_revisions, local_changes, buildspec,
+                                            environment_variables)
+            fingerprint_path = aosp_tree.state_path(AOSPBuild._FINGERPRINT_FILE_NAME_FORMAT.format(self._make_target))
+            if not self._force and AOSPBuild._read_fingerprint(fingerprint_path) == fingerprint:
+                print('Nothing changed since the last build of "{}" (use -f/--force to build anyway)'.format(
+                    self._make_target))
+                return
+
+            # Restore the outputs if this exact tree state has already been built.
+            cache_key = self._cache_key(configuration, project_revisions, local_changes, buildspec)
+            if cache_key:
+                if self._artifact_cache.lookup(cache_key):
+                    AOSPBuild._forget_fingerprints(aosp_tree)
+                    restored_size = self._artifact_cache.restore(cache_key, aosp_tree.path())
+                    print('Restored {} of outputs from the artifact cache'.format(
+                        ArtifactCache.human_readable_size(restored_size)))
+                    AOSPBuild._write_fingerprint(fingerprint_path, fingerprint)
+                    return
+                self._artifact_cache.record_miss()
+
+            # Only build the modules that changed since the last build, if asked to.
+            make_goals = [self._make_target]
+            if self._incremental:
+                make_goals = BuildPlanner(aosp_tree).plan(self._make_target)
+                if not make_goals:
+                    print('Nothing changed since the last build')
+                    return
+                print('Make goals: {}'.format(' '.join(make_goals)))
+
+            # Setup environment then build.
+            build_command = ['make'] + make_goals + ['-j', str(self._num_cores)]
+            # Whatever the goals, the outputs change: the fingerprints of the targets built before no longer hold.
+            AOSPBuild._forget_fingerprints(aosp_tree)
             with contexts.set_variables(environment_variables):
                 # If NDK_ROOT is defined, the build system will try to build it (and fail).
-                with contexts.unset_variable('NDK_ROOT'):
-                    subprocess.check_call(build_command)
+                with contexts.unset_variable('NDK_ROOT') as build_context:
+                    logs.check_call(build_command, 'make', **build_context.kwargs())
+
+            # Goals planned by -i/--incremental are a subset of the target: the target itself has not been built.
+            if make_goals == [self._make_target]:
+                AOSPBuild._write_fingerprint(fingerprint_path, fingerprint)
+            BuildPlanner(aosp_tree).record(self._make_target, project_revisions, local_changes)
+            module_info_path = ModuleIndex.find(aosp_tree.path())
+            if module_info_path:
+                ModuleIndex.update(module_info_path)
+            if cache_key and make_goals == [self._make_target]:
+                outputs = self._outputs(configuration, context, AOSPSpec.from_aosp_tree(aosp_tree).product())
+                if outputs:
+                    self._artifact_cache.store(cache_key, aosp_tree.path(), outputs)
+                else:
+                    print('No images were found in the product output directory: the build is not cached')
 
     @staticmethod
     def description(make_target: str, num_cores: int) -> str:
@@ -79,6 +153,81 @@ class AOSPBuild(object):
 
         return '\n'.join(description)
 
+    def _cache_key(self, configuration: Configuration, project_revisions: Dict[str, str],
+                   local_changes: Dict[str, List[str]], buildspec: str) -> str:
+        # The key covers the commits of all the projects, the build rules, the target and the vendor prebuilts (which
+        # are versioned by the directory the vendors path resolves to). Local changes are not part of the key, so the
+        # cache is not used at all when there are some.
+        if self._artifact_cache is None or local_changes:
+            return ''
+
+        vendors_path = os.path.realpath(configuration.vendors_path())
+        return ArtifactCache.key('\n'.join('{} {}'.format(path, project_revisions[path])
+                                           for path in sorted(project_revisions)),
+                                 buildspec, self._make_target,
+                                 '{} {}'.format(vendors_path, os.stat(vendors_path).st_mtime_ns))
+
+    def _fingerprint(self, context: contexts.ExecutionContext, project_revisions: Dict[str, str],
+                     local_changes: Dict[str, List[str]], buildspec: str, environment_variables: Dict[str, str]) -> str:
+        # Locally modified files are identified by their size and modification time rather than by their content, which
+        # is cheap and good enough for telling whether they changed since the last build.
+        local_files = list()
+        for project_path in sorted(local_changes):
+            for status_line in local_changes[project_path]:
+                file_path = os.path.join(project_path, status_line[3:].split(' -> ').pop().strip('"'))
+                try:
+                    file_stat = os.stat(context.path(file_path))
+                    local_files.append('{} {} {} {}'.format(status_line[:2], file_path, file_stat.st_size,
+                                                            file_stat.st_mtime_ns))
+                except FileNotFoundError:
+                    local_files.append('{} {}'.format(status_line[:2], file_path))
+
+        environment = dict((name, value) for name, value in context.env().items()
+                           if name.startswith(AOSPBuild._FINGERPRINT_VARIABLES_PREFIXES))
+        environment.update(environment_variables)
+
+        return ArtifactCache.key('\n'.join('{} {}'.format(path, project_revisions[path])
+                                           for path in sorted(project_revisions)),
+                                 '\n'.join(local_files), buildspec,
+                                 '\n'.join('{}={}'.format(name, environment[name]) for name in sorted(environment)),
+                                 self._make_target)
+
+    @staticmethod
+    def _forget_fingerprints(aosp_tree: AOSPTree) -> None:
+        for fingerprint_path in glob.glob(aosp_tree.state_path(AOSPBuild._FINGERPRINT_FILE_NAME_FORMAT.format('*'))):
+            os.remove(fingerprint_path)
+
+    @staticmethod
+    def _outputs(configuration: Configuration, context: contexts.ExecutionContext, product: str) -> List[str]:
+        # Paths relative to the root of the tree, which is the working directory of the context. The outputs are the
+        # images of the product and its archives in the dist directory, which also holds the archives of other products
+        # and the files signed from them (named "product-signed_*").
+        product_out = subprocess.check_output(AOSPBuild._DUMPVAR_COMMAND + ['PRODUCT_OUT'],
+                                              **context.kwargs()).decode().strip()
+        images = glob.glob(os.path.join(context.path(product_out), AOSPBuild._IMAGES_GLOB))
+        if not images:
+            return list()
+        outputs = list(images)
+        for directory, _, file_names in os.walk(context.path(configuration.dist_path())):
+            outputs.extend(os.path.join(directory, name) for name in file_names
+                           if name.startswith('{}-'.format(product)) and AOSPBuild._SIGNED_INFIX not in name)
+        return sorted(os.path.relpath(output, context.cwd()) for output in outputs)
+
+    @staticmethod
+    def _read_fingerprint(fingerprint_path: str) -> str:
+        try:
+            with open(fingerprint_path) as fingerprint_file:
+                return fingerprint_file.read().strip()
+        except FileNotFoundError:
+            return ''
+
+    @staticmethod
+    def _write_fingerprint(fingerprint_path: str, fingerprint: str) -> None:
+        if not os.path.isdir(os.path.dirname(fingerprint_path)):
+            os.makedirs(os.path.dirname(fingerprint_path))
+        with open(fingerprint_path, 'w') as fingerprint_file:
+            fingerprint_file.write(fingerprint)
+
 
 def main() -> None:
     SanityChecks.run()
@@ -87,12 +236,15 @@ def main() -> None:
     cli = AOSPBuildCommandLineInterface(configuration)
     aosp_tree = AOSPTree(cli.path())
     aosp_spec = AOSPSpec.from_aosp_tree(aosp_tree)
-    aosp_build = AOSPBuild(cli.make_target(), cli.num_cores())
+    artifact_cache = None if cli.no_cache() else ArtifactCache(configuration.artifact_cache_path(), 'build')
+    aosp_build = AOSPBuild(cli.make_target(), cli.num_cores(), artifact_cache, cli.incremental(), cli.force())
     print(aosp_tree)
     print(aosp_spec)
     print(aosp_build)
     if cli.press_enter():
-        aosp_build.build(configuration, aosp_tree)
+        with logs.recording(configuration.logs_path(), '{}_aospbuild'.format(configuration.default_name()),
+                            configuration.logs_sample_interval_sec()):
+            aosp_build.build(configuration, aosp_tree)
     else:
         sys.exit(os.EX_USAGE)  # Set an error code for canceling chained commands.
 
@@ -50,6 +50,18 @@ class AOSPSpec(object):
     def __str__(self) -> str:
         return AOSPSpec.description(self._product, self._variant)
 
+    @staticmethod
+    def buildspec(aosp_tree: AOSPTree) -> str:
+        """
+        Read the buildspec file the tree is currently set up with.
+
+        :param aosp_tree: an instance of an AOSP tree.
+        :return: the content of the buildspec file.
+        """
+        with contexts.set_cwd(aosp_tree.path()) as context:
+            with open(context.path(AOSPSpec._BUILDSPEC_FILE_NAME)) as buildspec_file:
+                return buildspec_file.read()
+
     @staticmethod
     def description(product: str, variant: str) -> str:
         description = list()
@@ -68,22 +80,20 @@ class AOSPSpec(object):
         :param aosp_tree: an instance of an AOSP tree.
         :return: a new instance of an :class:`AOSPSpec`.
         """
-        with contexts.set_cwd(aosp_tree.path()):
-            with open(AOSPSpec._BUILDSPEC_FILE_NAME) as buildspec_file:
-                buildspec_content = buildspec_file.readlines()
-
-            product = ''
-            variant = ''
-            for line in buildspec_content:
-                if not line.strip().startswith('#'):
-                    name, value = (item.strip() for item in line.strip().split(':='))
-                    if name == 'TARGET_PRODUCT':
-                        product = value
-                    elif name == 'TARGET_BUILD_VARIANT':
-                        variant = value
-
-                    if product and variant:
-                        return AOSPSpec(product, variant)
+        buildspec_content = AOSPSpec.buildspec(aosp_tree).splitlines()
+
+        product = ''
+        variant = ''
+        for line in buildspec_content:
+            if not line.strip().startswith('#'):
+                name, value = (item.strip() for item in line.strip().split(':='))
+                if name == 'TARGET_PRODUCT':
+                    product = value
+                elif name == 'TARGET_BUILD_VARIANT':
+                    variant = value
+
+                if product and variant:
+                    return AOSPSpec(product, variant)
 
         raise ValueError('Invalid buildspec file')
 
@@ -101,13 +111,13 @@ class AOSPSpec(object):
         :param configuration: the configuration.
         :param aosp_tree: an AOSP tree instance.
         """
-        with contexts.set_cwd(aosp_tree.path()):
-            if not os.path.isdir(configuration.buildspec_path()):
-                os.makedirs(configuration.buildspec_path())
+        with contexts.set_cwd(aosp_tree.path()) as context:
+            if not os.path.isdir(context.path(configuration.buildspec_path())):
+                os.makedirs(context.path(configuration.buildspec_path()))
 
             buildspec_file_name = AOSPSpec._BUILDSPEC_FILE_NAME_FORMAT.format(self._product, self._variant)
             buildspec_file_path = os.path.join(configuration.buildspec_path(), buildspec_file_name)
-            if not os.path.isfile(buildspec_file_path):
+            if not os.path.isfile(context.path(buildspec_file_path)):
 
                 buildspec_vars = {
                     'TARGET_PRODUCT': self._product,
@@ -117,13 +127,13 @@ class AOSPSpec(object):
                 buildspec_content = '# Auto-generated by {}.\n'.format(os.path.basename(__file__))
                 buildspec_content += '\n'.join(['{}:={}'.format(name, value) for name, value in buildspec_vars.items()])
 
-                with open(buildspec_file_path, 'x') as buildspec_file:
+                with open(context.path(buildspec_file_path), 'x') as buildspec_file:
                     buildspec_file.write(buildspec_content)
 
-            if os.path.isfile(AOSPSpec._BUILDSPEC_FILE_NAME):
-                os.remove(AOSPSpec._BUILDSPEC_FILE_NAME)
+            if os.path.isfile(context.path(AOSPSpec._BUILDSPEC_FILE_NAME)):
+                os.remove(context.path(AOSPSpec._BUILDSPEC_FILE_NAME))
 
-            os.symlink(buildspec_file_path, AOSPSpec._BUILDSPEC_FILE_NAME)
+            os.symlink(buildspec_file_path, context.path(AOSPSpec._BUILDSPEC_FILE_NAME))
 
 
 def main() -> None:
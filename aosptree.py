@@ -26,7 +26,9 @@
 #
 
 import contexts
+import logs
 import os
+import subprocess
 import sys
 import xml.etree.ElementTree
 
@@ -35,6 +37,7 @@ from configuration import Configuration
 from manifest import LocalManifest
 from repo import RepoAdapter
 from sanity import SanityChecks
+from typing import Dict, List
 
 
 class AOSPTree(object):
@@ -44,8 +47,12 @@ class AOSPTree(object):
     building the sources.
     """
 
+    # Where the tools keep their own state about the tree. It is under the output directory so that it is removed along
+    # with the built files.
+    _STATE_DIRECTORY = 'out/aosp-tools'
+
     def __init__(self, path: str) -> None:
-        path = os.path.abspath(path)
+        path = contexts.current().path(path)
         if not os.path.isfile(os.path.join(path, 'build/make/core/main.mk')):
             raise EnvironmentError('Not an AOSP tree: "{}"'.format(path))
 
@@ -59,29 +66,62 @@ class AOSPTree(object):
     @staticmethod
     def clone(configuration: Configuration, path: str, revision: str, local_manifest: LocalManifest,
               num_cores: int) -> 'AOSPTree':
+        path = contexts.current().path(path)
         os.mkdir(path)
+        AOSPTree.init(configuration, path, revision)
+        return AOSPTree.sync(configuration, path, local_manifest, num_cores)
 
+    @staticmethod
+    def init(configuration: Configuration, path: str, revision: str) -> None:
+        """
+        First half of :meth:`clone`: run ``repo init`` in an existing directory. The local manifest is not needed yet,
+        so it can be fetched meanwhile.
+        """
         with contexts.set_cwd(path):
             with contexts.set_variable('REPO_TRACE', str(1 if configuration.repo_trace() else 0)):
-                # Repo init.
                 RepoAdapter.init(configuration.repository_manifest().get_remote_url(), revision,
                                  configuration.repo_groups(), configuration.repo_depth())
 
+    @staticmethod
+    def sync(configuration: Configuration, path: str, local_manifest: LocalManifest, num_cores: int) -> 'AOSPTree':
+        """
+        Second half of :meth:`clone`: add the local manifest to a directory initialized by :meth:`init`, then run
+        ``repo sync``. It can be run again on an existing tree.
+        """
+        with contexts.set_cwd(path) as context:
+            with contexts.set_variable('REPO_TRACE', str(1 if configuration.repo_trace() else 0)):
                 # Fetch local manifest.
-                local_manifest_path = os.path.join(RepoAdapter.INSTALL_DIRECTORY,
-                                                   configuration.local_manifest_directory())
-                os.mkdir(local_manifest_path)
+                local_manifest_path = context.path(os.path.join(RepoAdapter.INSTALL_DIRECTORY,
+                                                                configuration.local_manifest_directory()))
+                os.makedirs(local_manifest_path, exist_ok=True)
                 local_manifest.to_file(os.path.join(local_manifest_path, configuration.local_manifest_file()))
 
                 # Repo sync.
                 RepoAdapter.sync(num_cores, configuration.repo_only_current_branch(), configuration.repo_no_tags())
 
-            if not os.path.isdir(os.path.dirname(configuration.vendors_link())):
-                os.makedirs(os.path.dirname(configuration.vendors_link()))
-            os.symlink(configuration.vendors_path(), configuration.vendors_link())
+            vendors_link = context.path(configuration.vendors_link())
+            if not os.path.isdir(os.path.dirname(vendors_link)):
+                os.makedirs(os.path.dirname(vendors_link))
+            if not os.path.lexists(vendors_link):
+                os.symlink(configuration.vendors_path(), vendors_link)
 
             return AOSPTree(path)
 
+    def changed_files(self, project_path: str, old_revision: str, new_revision: str) -> List[str]:
+        """
+        List the files of a project which differ between two commits. Both commits must be available locally.
+
+        :param project_path: path of the project, relative to the root of the tree.
+        :param old_revision: hash of the first commit.
+        :param new_revision: hash of the second commit.
+        :return: the paths of the files, relative to the root of the tree.
+        """
+        git_diff_command = ['git', 'diff', '--name-only', old_revision, new_revision]
+        changed_files = subprocess.check_output(git_diff_command, cwd=os.path.join(self._path, project_path),
+                                                env=contexts.current().env())
+
+        return [os.path.join(project_path, line) for line in changed_files.decode().splitlines() if line]
+
     @staticmethod
     def description(path: str, revision: str) -> str:
         description = list()
@@ -92,12 +132,48 @@ class AOSPTree(object):
 
         return '\n'.join(description)
 
+    def local_changes(self, num_jobs: int=os.cpu_count()) -> Dict[str, List[str]]:
+        """
+        List the uncommitted changes (including untracked files) of the projects of the tree.
+
+        :param num_jobs: number of projects to inspect in parallel.
+        :return: a dictionary containing the paths of the modified projects as keys, and the lines output by
+                 ``git status --porcelain`` as values. Projects without changes are not listed.
+        """
+        with contexts.set_cwd(self._path):
+            status = RepoAdapter.forall('git status --porcelain', num_jobs, print_projects=True)
+
+        local_changes = dict()
+        project_path = ''
+        for line in status.splitlines():
+            if line.startswith('project '):
+                project_path = line[len('project '):].strip().rstrip('/')
+            elif line.strip() and project_path:
+                local_changes.setdefault(project_path, list()).append(line)
+
+        return local_changes
+
     def path(self) -> str:
         return self._path
 
+    def project_revisions(self) -> Dict[str, str]:
+        """
+        Read the commits the projects of the tree are currently on.
+
+        :return: a dictionary containing the paths of the projects as keys, and the hashes of their commits as values.
+        """
+        with contexts.set_cwd(self._path):
+            xml_root = xml.etree.ElementTree.fromstring(RepoAdapter.manifest(revisions_as_hashes=True))
+
+        return {project.attrib.get('path', project.attrib['name']): project.attrib['revision']
+                for project in xml_root.findall('project')}
+
     def revision(self) -> str:
         return self._revision
 
+    def state_path(self, name: str) -> str:
+        return os.path.join(self._path, AOSPTree._STATE_DIRECTORY, name)
+
     @staticmethod
     def _find_revision() -> str:
         xml_root = xml.etree.ElementTree.fromstring(RepoAdapter.manifest())
@@ -115,7 +191,9 @@ def main() -> None:
             local_manifest = LocalManifest.from_string(cli.local_manifest())
         else:
             local_manifest = LocalManifest.empty()
-        AOSPTree.clone(configuration, cli.path(), cli.release(), local_manifest, cli.num_cores())
+        with logs.recording(configuration.logs_path(), '{}_aosptree'.format(configuration.default_name()),
+                            configuration.logs_sample_interval_sec()):
+            AOSPTree.clone(configuration, cli.path(), cli.release(), local_manifest, cli.num_cores())
     else:
         sys.exit(os.EX_USAGE)  # Set an error code for canceling chained commands.
 
@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import base64
+import concurrent.futures
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+from commandline import AVBCommandLineInterface
+from configuration import Configuration
+from sanity import SanityChecks
+from typing import Dict, List, Tuple
+
+
+class AVBKey(object):
+    """
+    An :class:`AVBKey` is an RSA private key in PEM format (PKCS #1 or PKCS #8), used for signing vbmeta images the way
+    ``avbtool`` does: PKCS #1 v1.5 signatures of SHA-256 or SHA-512 hashes.
+    """
+
+    # DER encoded DigestInfo prefixes, see RFC 8017.
+    _DIGEST_INFO_PREFIXES = {
+        'sha256': bytes.fromhex('3031300d060960864801650304020105000420'),
+        'sha512': bytes.fromhex('3051300d060960864801650304020305000440')
+    }
+
+    def __init__(self, modulus: int, private_exponent: int) -> None:
+        self._modulus = modulus
+        self._private_exponent = private_exponent
+
+    def algorithm_type(self, hash_name: str) -> int:
+        """
+        :return: the AVB algorithm type for this key and the given hash (``sha256`` or ``sha512``).
+        """
+        algorithm_name = '{}_RSA{}'.format(hash_name.upper(), self.num_bits())
+        for algorithm_type, (name, _) in VBMetaImage.ALGORITHMS.items():
+            if name == algorithm_name:
+                return algorithm_type
+        raise ValueError('Unsupported key size for AVB: {} bits'.format(self.num_bits()))
+
+    def encode_public_key(self) -> bytes:
+        # Format of ``AvbRSAPublicKeyHeader``: the modulus along with precomputed values for Montgomery multiplication.
+        n0inv = 2 ** 32 - AVBKey._modular_inverse(self._modulus % 2 ** 32, 2 ** 32)
+        rr = 2 ** (2 * self._modulus.bit_length()) % self._modulus
+        return struct.pack('>II', self.num_bits(), n0inv) + self._modulus.to_bytes(self.num_bits() // 8, 'big') + \
+            rr.to_bytes(self.num_bits() // 8, 'big')
+
+    @staticmethod
+    def from_pem(key_path: str) -> 'AVBKey':
+        with open(key_path) as key_file:
+            lines = key_file.read().strip().splitlines()
+        der = base64.b64decode(''.join(line for line in lines if not line.startswith('-----')))
+
+        # RSAPrivateKey is a sequence of integers: version, modulus, public exponent, private exponent... PKCS #8 wraps
+        # it in an octet string, after the version and the algorithm identifier.
+        _, start, end = AVBKey._read_der(der, 0)
+        _, start, end = AVBKey._read_der(der, start)  # Version.
+        tag, _, _ = AVBKey._read_der(der, end)
+        if tag == 0x30:
+            _, _, end = AVBKey._read_der(der, end)  # Algorithm identifier.
+            _, start, _ = AVBKey._read_der(der, end)  # Octet string.
+            _, start, _ = AVBKey._read_der(der, start)
+            _, start, end = AVBKey._read_der(der, start)
+        integers = list()
+        for _ in range(3):
+            _, start, end = AVBKey._read_der(der, end)
+            integers.append(int.from_bytes(der[start:end], 'big'))
+        return AVBKey(integers[0], integers[2])
+
+    def num_bits(self) -> int:
+        return (self._modulus.bit_length() + 7) // 8 * 8
+
+    def sign(self, hash_name: str, digest: bytes) -> bytes:
+        digest_info = AVBKey._DIGEST_INFO_PREFIXES[hash_name] + digest
+        padded = b'\x00\x01' + b'\xff' * (self.num_bits() // 8 - len(digest_info) - 3) + b'\x00' + digest_info
+        signature = pow(int.from_bytes(padded, 'big'), self._private_exponent, self._modulus)
+        return signature.to_bytes(self.num_bits() // 8, 'big')
+
+    @staticmethod
+    def _modular_inverse(value: int, modulus: int) -> int:
+        # Extended Euclidean algorithm.
+        old_remainder, remainder = value, modulus
+        old_coefficient, coefficient = 1, 0
+        while remainder:
+            quotient = old_remainder // remainder
+            old_remainder, remainder = remainder, old_remainder - quotient * remainder
+            old_coefficient, coefficient = coefficient, old_coefficient - quotient * coefficient
+        return old_coefficient % modulus
+
+    @staticmethod
+    def _read_der(der: bytes, offset: int) -> Tuple[int, int, int]:
+        # Return the tag of the element at the offset, and where its value starts and ends.
+        tag = der[offset]
+        length = der[offset + 1]
+        offset += 2
+        if length & 0x80:
+            num_length_bytes = length & 0x7f
+            length = int.from_bytes(der[offset:offset + num_length_bytes], 'big')
+            offset += num_length_bytes
+        return tag, offset, offset + length
+
+
+class HashTree(object):
+    """
+    A :class:`HashTree` is the dm-verity hash tree of an image, as generated by ``avbtool``: the salted hashes of every
+    block of the image, then the hashes of every block of these hashes, and so on until they fit in a block. Levels are
+    stored from the top one to the bottom one.
+
+    The image is memory-mapped, and its blocks are hashed by several processes.
+    """
+
+    # Number of blocks hashed by a process at a time.
+    _CHUNK_BLOCKS = 64 * 1024
+
+    _SPARSE_MAGIC = b'\x3a\xff\x26\xed'
+
+    def __init__(self, image_path: str, block_size: int=4096, hash_algorithm: str='sha256', salt: bytes=b'') -> None:
+        self._block_size = block_size
+        self._hash_algorithm = hash_algorithm
+        self._image_path = image_path
+        self._salt = salt
+        self._image_size = os.path.getsize(image_path)
+        if self._image_size % block_size:
+            raise ValueError('The size of "{}" is not a multiple of {}'.format(image_path, block_size))
+        if self._image_size <= block_size:
+            raise ValueError('"{}" is too small for a hash tree'.format(image_path))
+        with open(image_path, 'rb') as image_file:
+            if image_file.read(len(HashTree._SPARSE_MAGIC)) == HashTree._SPARSE_MAGIC:
+                raise ValueError('"{}" is a sparse image, convert it with simg2img first'.format(image_path))
+
+    def block_size(self) -> int:
+        return self._block_size
+
+    def generate(self, max_processes: int=0) -> Tuple[bytes, bytes]:
+        """
+        :param max_processes: number of processes hashing the image, 0 for one per core.
+        :return: the root digest and the hash tree.
+        """
+        digest_size = sum(HashTree._digest_size(self._hash_algorithm))
+        level_offsets, tree_size = HashTree.level_offsets(self._image_size, self._block_size, digest_size)
+        tree = bytearray(tree_size)
+
+        # The bottom level is the expensive one, its chunks are hashed in parallel. The other levels are at least
+        # block size / digest size times smaller.
+        num_blocks = self._image_size // self._block_size
+        with concurrent.futures.ProcessPoolExecutor(max_processes or os.cpu_count()) as executor:
+            chunks = [(first_block, min(first_block + HashTree._CHUNK_BLOCKS, num_blocks))
+                      for first_block in range(0, num_blocks, HashTree._CHUNK_BLOCKS)]
+            digests = executor.map(_hash_image_blocks, [self._image_path] * len(chunks), [self._block_size] * len(chunks),
+                                   [self._hash_algorithm] * len(chunks), [self._salt] * len(chunks),
+                                   [first_block for first_block, _ in chunks], [last_block for _, last_block in chunks])
+            level_offset = level_offsets[0]
+            for chunk_digests in digests:
+                tree[level_offset:level_offset + len(chunk_digests)] = chunk_digests
+                level_offset += len(chunk_digests)
+
+        level_size = HashTree._round_up(num_blocks * digest_size, self._block_size)
+        for level_number in range(1, len(level_offsets)):
+            level = memoryview(tree)[level_offsets[level_number - 1]:level_offsets[level_number - 1] + level_size]
+            digests = HashTree._hash_blocks(level, self._block_size, self._hash_algorithm, self._salt)
+            tree[level_offsets[level_number]:level_offsets[level_number] + len(digests)] = digests
+            level_size = HashTree._round_up(len(digests), self._block_size)
+
+        top_level_offset = level_offsets[-1]
+        root_digest = hashlib.new(self._hash_algorithm, self._salt)
+        root_digest.update(tree[top_level_offset:top_level_offset + level_size])
+        return root_digest.digest(), bytes(tree)
+
+    def hash_algorithm(self) -> str:
+        return self._hash_algorithm
+
+    def image_size(self) -> int:
+        return self._image_size
+
+    @staticmethod
+    def level_offsets(image_size: int, block_size: int, digest_size: int) -> Tuple[List[int], int]:
+        """
+        :return: the offset of each level in the tree, from the bottom one to the top one, and the size of the tree.
+        """
+        level_sizes = list()
+        size = image_size
+        while size > block_size:
+            size = HashTree._round_up((size + block_size - 1) // block_size * digest_size, block_size)
+            level_sizes.append(size)
+        return [sum(level_sizes[level_number + 1:]) for level_number in range(len(level_sizes))], sum(level_sizes)
+
+    def salt(self) -> bytes:
+        return self._salt
+
+    @staticmethod
+    def _digest_size(hash_algorithm: str) -> Tuple[int, int]:
+        # Digests are padded with zeros to the next power of two (e.g. 20 bytes SHA-1 digests take 32 bytes).
+        digest_size = hashlib.new(hash_algorithm).digest_size
+        return digest_size, 2 ** (digest_size - 1).bit_length() - digest_size
+
+    @staticmethod
+    def _hash_blocks(data: memoryview, block_size: int, hash_algorithm: str, salt: bytes) -> bytes:
+        # Salted hash of each block, the last one being padded with zeros if needed.
+        salted_hash = hashlib.new(hash_algorithm, salt)
+        digest_padding = bytes(HashTree._digest_size(hash_algorithm)[1])
+        digests = list()
+        for offset in range(0, len(data), block_size):
+            block_hash = salted_hash.copy()
+            block = data[offset:offset + block_size]
+            block_hash.update(block)
+            if len(block) < block_size:
+                block_hash.update(bytes(block_size - len(block)))
+            digests.append(block_hash.digest())
+            digests.append(digest_padding)
+        return b''.join(digests)
+
+    @staticmethod
+    def _round_up(size: int, multiple: int) -> int:
+        return (size + multiple - 1) // multiple * multiple
+
+
+class VBMetaImage(object):
+    """
+    A :class:`VBMetaImage` is the content of a vbmeta image of Android Verified Boot: a header, an authentication block
+    (hash and signature of the header and auxiliary block) and an auxiliary block (descriptors and public key). See
+    ``libavb/avb_vbmeta_image.h`` in the AVB repository.
+    """
+
+    FOOTER_SIZE = 64
+    HEADER_SIZE = 256
+    MAGIC = b'AVB0'
+    RELEASE_STRING = 'aosp-tools'
+
+    # Hash algorithm of each AVB algorithm type, NONE (0) meaning the image is not signed.
+    ALGORITHMS = {
+        0: ('NONE', None),
+        1: ('SHA256_RSA2048', 'sha256'),
+        2: ('SHA256_RSA4096', 'sha256'),
+        3: ('SHA256_RSA8192', 'sha256'),
+        4: ('SHA512_RSA2048', 'sha512'),
+        5: ('SHA512_RSA4096', 'sha512'),
+        6: ('SHA512_RSA8192', 'sha512')
+    }
+
+    # Big-endian, without the reserved bytes ending the header.
+    _HEADER_FORMAT = '>4sIIQQIQQQQQQQQQQQII48s'
+
+    # Blocks are padded to a multiple of this size.
+    _BLOCK_ALIGNMENT = 64
+
+    # ``AvbFooter``, ending an image which embeds its vbmeta image, without the reserved bytes ending it.
+    _FOOTER_FORMAT = '>4sIIQQQ'
+    _FOOTER_MAGIC = b'AVBf'
+
+    # Fixed-size part of ``AvbHashtreeDescriptor``, followed by the partition name, the salt and the root digest.
+    _HASHTREE_DESCRIPTOR_FORMAT = '>QQIQQQIIIQQ32sIIII60s'
+    _HASHTREE_DESCRIPTOR_TAG = 1
+
+    def __init__(self, data: bytes) -> None:
+        if len(data) < VBMetaImage.HEADER_SIZE or data[:4] != VBMetaImage.MAGIC:
+            raise ValueError('Not a vbmeta image')
+
+        (_, self._required_major, self._required_minor, self._authentication_size, self._auxiliary_size,
+         self._algorithm_type, self._hash_offset, self._hash_size, self._signature_offset, self._signature_size,
+         self._public_key_offset, self._public_key_size, _, _, self._descriptors_offset, self._descriptors_size,
+         self._rollback_index, self._flags, self._rollback_index_location, release_string) = struct.unpack_from(
+            VBMetaImage._HEADER_FORMAT, data)
+        if self._algorithm_type not in VBMetaImage.ALGORITHMS:
+            raise ValueError('Unknown AVB algorithm type {}'.format(self._algorithm_type))
+        if len(data) < VBMetaImage.HEADER_SIZE + self._authentication_size + self._auxiliary_size:
+            raise ValueError('Truncated vbmeta image')
+
+        self._data = data
+        self._release_string = release_string.rstrip(b'\0').decode(errors='replace')
+
+    def algorithm(self) -> str:
+        return VBMetaImage.ALGORITHMS[self._algorithm_type][0]
+
+    @staticmethod
+    def build(descriptors: List[bytes], key: AVBKey=None, hash_name: str='sha256', rollback_index: int=0,
+              flags: int=0) -> bytes:
+        """
+        Build a vbmeta image the way ``avbtool make_vbmeta_image`` does.
+
+        :param descriptors: encoded descriptors, see :meth:`hashtree_descriptor`.
+        :param key: key for signing the image, None for not signing it.
+        :param hash_name: hash of the signature, ``sha256`` or ``sha512``.
+        :param rollback_index: rollback index of the image.
+        :param flags: AVB flags (e.g. 2 for disabling verification).
+        :return: the image.
+        """
+        algorithm_type = key.algorithm_type(hash_name) if key else 0
+        public_key = key.encode_public_key() if key else b''
+        descriptors = b''.join(descriptors)
+        auxiliary_block = VBMetaImage._pad(descriptors + public_key)
+        hash_size = hashlib.new(hash_name).digest_size if key else 0
+        signature_size = key.num_bits() // 8 if key else 0
+        authentication_size = VBMetaImage._round_up(hash_size + signature_size, VBMetaImage._BLOCK_ALIGNMENT)
+
+        header = struct.pack(VBMetaImage._HEADER_FORMAT, VBMetaImage.MAGIC, 1, 0, authentication_size,
+                             len(auxiliary_block), algorithm_type, 0, hash_size, hash_size, signature_size,
+                             len(descriptors), len(public_key), len(descriptors) + len(public_key), 0, 0,
+                             len(descriptors), rollback_index, flags, 0, VBMetaImage.RELEASE_STRING.encode())
+        header += bytes(VBMetaImage.HEADER_SIZE - len(header))
+
+        authentication_block = b''
+        if key:
+            digest = hashlib.new(hash_name, header + auxiliary_block).digest()
+            authentication_block = VBMetaImage._pad(digest + key.sign(hash_name, digest))
+        return header + authentication_block + auxiliary_block
+
+    @staticmethod
+    def hashtree_descriptor(partition_name: str, hash_tree: HashTree, root_digest: bytes, tree_offset: int,
+                            tree_size: int) -> bytes:
+        """
+        Encode an ``AvbHashtreeDescriptor`` (without forward error correction).
+
+        :param partition_name: name of the partition the image is flashed on.
+        :param hash_tree: hash tree of the image.
+        :param root_digest: root digest of the hash tree.
+        :param tree_offset: offset of the hash tree in the partition.
+        :param tree_size: size of the hash tree.
+        :return: the descriptor.
+        """
+        variable_part = partition_name.encode() + hash_tree.salt() + root_digest
+        num_bytes_following = struct.calcsize(VBMetaImage._HASHTREE_DESCRIPTOR_FORMAT) - 16 + len(variable_part)
+        padding_size = VBMetaImage._round_up(num_bytes_following, 8) - num_bytes_following
+        return struct.pack(VBMetaImage._HASHTREE_DESCRIPTOR_FORMAT, VBMetaImage._HASHTREE_DESCRIPTOR_TAG,
+                           num_bytes_following + padding_size, 1, hash_tree.image_size(), tree_offset, tree_size,
+                           hash_tree.block_size(), hash_tree.block_size(), 0, 0, 0,
+                           hash_tree.hash_algorithm().encode(), len(partition_name.encode()), len(hash_tree.salt()),
+                           len(root_digest), 0, b'') + variable_part + bytes(padding_size)
+
+    @staticmethod
+    def footer(original_image_size: int, vbmeta_offset: int, vbmeta_size: int) -> bytes:
+        """
+        Encode an ``AvbFooter``, the last bytes of an image which embeds its vbmeta image.
+
+        :param original_image_size: size of the image before the hash tree and the vbmeta image were appended.
+        :param vbmeta_offset: offset of the vbmeta image in the image.
+        :param vbmeta_size: size of the vbmeta image.
+        :return: the footer.
+        """
+        footer = struct.pack(VBMetaImage._FOOTER_FORMAT, VBMetaImage._FOOTER_MAGIC, 1, 0, original_image_size,
+                             vbmeta_offset, vbmeta_size)
+        return footer + bytes(VBMetaImage.FOOTER_SIZE - len(footer))
+
+    def flags(self) -> int:
+        return self._flags
+
+    @staticmethod
+    def has_footer(image_path: str) -> bool:
+        with open(image_path, 'rb') as image_file:
+            image_file.seek(0, os.SEEK_END)
+            if image_file.tell() < VBMetaImage.FOOTER_SIZE:
+                return False
+            image_file.seek(-VBMetaImage.FOOTER_SIZE, os.SEEK_END)
+            return image_file.read(len(VBMetaImage._FOOTER_MAGIC)) == VBMetaImage._FOOTER_MAGIC
+
+    def is_hash_valid(self) -> bool:
+        """
+        :return: whether the hash of the authentication block matches the header and the auxiliary block. It does not
+                 check the signature of the hash, which requires the public key to be trusted anyway.
+        """
+        hash_name = VBMetaImage.ALGORITHMS[self._algorithm_type][1]
+        if hash_name is None:
+            return False
+        digest = hashlib.new(hash_name)
+        digest.update(self._data[:VBMetaImage.HEADER_SIZE])
+        digest.update(self._auxiliary_block())
+        authentication_block = self._data[VBMetaImage.HEADER_SIZE:VBMetaImage.HEADER_SIZE + self._authentication_size]
+        return digest.digest() == authentication_block[self._hash_offset:self._hash_offset + self._hash_size]
+
+    def public_key(self) -> bytes:
+        return self._auxiliary_block()[self._public_key_offset:self._public_key_offset + self._public_key_size]
+
+    def release_string(self) -> str:
+        return self._release_string
+
+    def rollback_index(self) -> int:
+        return self._rollback_index
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            'algorithm': self.algorithm(),
+            'flags': self._flags,
+            'hash_valid': self.is_hash_valid(),
+            'public_key_sha1': hashlib.sha1(self.public_key()).hexdigest(),
+            'release_string': self._release_string,
+            'rollback_index': self._rollback_index
+        }
+
+    def _auxiliary_block(self) -> bytes:
+        auxiliary_offset = VBMetaImage.HEADER_SIZE + self._authentication_size
+        return self._data[auxiliary_offset:auxiliary_offset + self._auxiliary_size]
+
+    @staticmethod
+    def _pad(block: bytes) -> bytes:
+        return block + bytes(VBMetaImage._round_up(len(block), VBMetaImage._BLOCK_ALIGNMENT) - len(block))
+
+    @staticmethod
+    def _round_up(size: int, multiple: int) -> int:
+        return (size + multiple - 1) // multiple * multiple
+
+
+def _hash_image_blocks(image_path: str, block_size: int, hash_algorithm: str, salt: bytes, first_block: int,
+                       last_block: int) -> bytes:
+    # Run in the processes of the pool of :meth:`HashTree.generate`, hence a module-level function.
+    with open(image_path, 'rb') as image_file:
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as image:
+            with memoryview(image) as image_view:
+                return HashTree._hash_blocks(image_view[first_block * block_size:last_block * block_size], block_size,
+                                             hash_algorithm, salt)
+
+
+def benchmark(configuration: Configuration, size_gib: int, max_processes: int=0) -> None:
+    """
+    Compare the generation of the hash tree of a synthetic image with ``avbtool add_hashtree_footer``, using ``avbtool``
+    from the AVB repository.
+
+    :param size_gib: size of the synthetic image in GiB.
+    :param max_processes: number of processes hashing the image, 0 for one per core.
+    """
+    salt = os.urandom(32)
+    with tempfile.TemporaryDirectory() as temp_directory:
+        # Blocks must differ, or the test would not be representative of the hashing of a real image.
+        image_path = os.path.join(temp_directory, 'system.img')
+        random_chunk = os.urandom(1024 * 1024)
+        with open(image_path, 'wb') as image_file:
+            for chunk_number in range(size_gib * 1024):
+                image_file.write(struct.pack('>Q', chunk_number) + random_chunk[8:])
+
+        start_time = time.time()
+        root_digest, tree = HashTree(image_path, salt=salt).generate(max_processes)
+        duration = time.time() - start_time
+        print('avb.py: {:.1f}s, root digest {}'.format(duration, root_digest.hex()))
+
+        with configuration.repository_avb().std_context(False, False):
+            configuration.repository_avb().clone(temp_directory, 'avb')
+        partition_size = HashTree._round_up(os.path.getsize(image_path) + len(tree) + 1024 * 1024, 4096)
+        avbtool_path = os.path.join(temp_directory, 'avb', 'avbtool.py')
+        start_time = time.time()
+        subprocess.check_call([sys.executable, avbtool_path, 'add_hashtree_footer', '--image', image_path,
+                               '--partition_name', 'system', '--partition_size', str(partition_size),
+                               '--hash_algorithm', 'sha256', '--salt', salt.hex(), '--do_not_generate_fec'])
+        avbtool_duration = time.time() - start_time
+        image_info = subprocess.check_output([sys.executable, avbtool_path, 'info_image', '--image', image_path])
+        avbtool_root_digest = [line.split(':', 1)[1].strip() for line in image_info.decode().splitlines()
+                               if line.strip().startswith('Root Digest:')][0]
+        print('avbtool: {:.1f}s, root digest {}'.format(avbtool_duration, avbtool_root_digest))
+        print('Speedup: {:.1f}x, root digests {}'.format(avbtool_duration / duration,
+                                                          'match' if avbtool_root_digest == root_digest.hex()
+                                                          else 'DIFFER'))
+
+
+def main() -> None:
+    SanityChecks.run()
+
+    configuration = Configuration()
+    cli = AVBCommandLineInterface(configuration)
+    if cli.benchmark_size():
+        benchmark(configuration, cli.benchmark_size(), cli.max_processes())
+        return
+
+    # The hash tree then the vbmeta image are appended to the image, and a footer tells where they are, like avbtool
+    # does. Appending them again would describe the previous ones: the image must be the original one.
+    if VBMetaImage.has_footer(cli.image_path()):
+        raise ValueError('"{}" already ends with an AVB footer, start again from the original image'.format(
+            cli.image_path()))
+    hash_tree = HashTree(cli.image_path(), hash_algorithm=cli.hash_algorithm(), salt=cli.salt() or os.urandom(32))
+    start_time = time.time()
+    root_digest, tree = hash_tree.generate(cli.max_processes())
+    print('Hash tree generated in {:.1f}s, root digest {}'.format(time.time() - start_time, root_digest.hex()))
+
+    descriptor = VBMetaImage.hashtree_descriptor(cli.partition_name(), hash_tree, root_digest, hash_tree.image_size(),
+                                                 len(tree))
+    key = AVBKey.from_pem(cli.key_path()) if cli.key_path() else None
+    vbmeta = VBMetaImage.build([descriptor], key, rollback_index=cli.rollback_index())
+    vbmeta_offset = hash_tree.image_size() + len(tree)
+    with open(cli.image_path(), 'ab') as image_file:
+        image_file.write(tree)
+        image_file.write(vbmeta)
+        # The footer ends the last block.
+        image_file.write(bytes(-(len(vbmeta) + VBMetaImage.FOOTER_SIZE) % hash_tree.block_size()))
+        image_file.write(VBMetaImage.footer(hash_tree.image_size(), vbmeta_offset, len(vbmeta)))
+    with open(cli.output_path(), 'wb') as vbmeta_file:
+        vbmeta_file.write(vbmeta)
+    print('Wrote "{}" ({})'.format(cli.output_path(), VBMetaImage.ALGORITHMS[key.algorithm_type('sha256')][0]
+                                   if key else 'not signed'))
+
+
+if __name__ == '__main__':
+    main()
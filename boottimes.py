@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import collections
+import datetime
+import json
+import os
+import threading
+
+from commandline import BootTimesCommandLineInterface
+from configuration import Configuration
+from sanity import SanityChecks
+from typing import Dict, List, Tuple
+
+
+class BootTimes(object):
+    """
+    Record how long devices take to boot after being flashed, phase by phase (see
+    :meth:`adb.ADBAdapter.wait_for_boot_completed`), along with the build they boot. Averaged by build, the timelines
+    make boot time regressions show up as numbers.
+
+    The records are appended as JSON lines to a single file.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+
+    def add(self, serial: str, fingerprint: str, timeline: List[Tuple[str, float]]) -> None:
+        """
+        :param fingerprint: fingerprint of the build the device booted (``ro.build.fingerprint``).
+        :param timeline: the phases of the boot and when they were reached, in seconds.
+        """
+        record = {
+            'date': datetime.datetime.now().isoformat(),
+            'fingerprint': fingerprint,
+            'serial': serial,
+            'timeline': [[phase, round(seconds, 3)] for phase, seconds in timeline]
+        }
+        with BootTimes._lock:
+            if not os.path.isdir(os.path.dirname(self._path)):
+                os.makedirs(os.path.dirname(self._path))
+            with open(self._path, 'a') as boot_times_file:
+                boot_times_file.write(json.dumps(record, sort_keys=True) + '\n')
+
+    @staticmethod
+    def description(records: List[Dict[str, object]]) -> str:
+        # Builds are listed in the order they were first booted, each phase being compared to the previous build.
+        timelines = collections.OrderedDict()
+        for record in records:
+            timelines.setdefault(record['fingerprint'], list()).append(dict(record['timeline']))
+
+        description = list()
+        previous_means = dict()
+        for fingerprint, build_timelines in timelines.items():
+            description.append('{} ({} boot(s))'.format(fingerprint, len(build_timelines)))
+            phases = list()
+            for timeline in build_timelines:
+                phases.extend(phase for phase in timeline if phase not in phases)
+            means = dict()
+            for phase in phases:
+                seconds = [timeline[phase] for timeline in build_timelines if phase in timeline]
+                means[phase] = sum(seconds) / len(seconds)
+                difference = '({:+.1f}s)'.format(means[phase] - previous_means[phase]) if phase in previous_means \
+                    else ''
+                description.append('  {:32} {:7.1f}s {}'.format(phase, means[phase], difference).rstrip())
+            previous_means = means
+        description.append('=' * max(map(len, description or [''])))
+        description.insert(0, description[-1])
+
+        return '\n'.join(description)
+
+    def records(self, serial: str='') -> List[Dict[str, object]]:
+        """
+        :param serial: only return the boots of this device, if not empty.
+        :return: the records, oldest first.
+        """
+        try:
+            with open(self._path) as boot_times_file:
+                records = [json.loads(line) for line in boot_times_file if line.strip()]
+        except FileNotFoundError:
+            return list()
+        return [record for record in records if not serial or record['serial'] == serial]
+
+
+def main() -> None:
+    SanityChecks.run()
+
+    configuration = Configuration()
+    cli = BootTimesCommandLineInterface(configuration)
+    print(BootTimes.description(BootTimes(configuration.flash_boot_times_path()).records(cli.serial())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from commandline import ArtifactCacheCommandLineInterface
+from configuration import Configuration
+from sanity import SanityChecks
+from typing import Dict, List
+
+
+class ArtifactCache(object):
+    """
+    An :class:`ArtifactCache` is a content-addressed store of files. A set of files is stored under a key (usually a
+    hash of everything the files were generated from) as an entry listing the files' relative paths and content hashes.
+    The contents themselves are stored once per hash, so identical files across entries only take space once.
+
+    Caches are split into namespaces (e.g. one for the build outputs, one for the signed files) sharing the same store.
+    """
+
+    _BUFFER_SIZE = 1024 * 1024
+    _ENTRIES_DIRECTORY = 'entries'
+    _OBJECTS_DIRECTORY = 'objects'
+    _STATISTICS_LOCK_FILE_NAME = 'statistics.lock'
+    _STATISTICS_FILE_NAME = 'statistics.json'
+
+    def __init__(self, path: str, namespace: str) -> None:
+        self._path = path
+        self._namespace = namespace
+
+    @staticmethod
+    def description(statistics: Dict[str, Dict[str, int]], stored_size: int, physical_size: int) -> str:
+        description = list()
+        for namespace in sorted(statistics):
+            namespace_statistics = statistics[namespace]
+            description.append('{}: {} hit(s), {} miss(es), {} saved'.format(
+                namespace, namespace_statistics.get('hits', 0), namespace_statistics.get('misses', 0),
+                ArtifactCache.human_readable_size(namespace_statistics.get('bytes_saved', 0))))
+        description.append('Stored: {} in {} on disk'.format(ArtifactCache.human_readable_size(stored_size),
+                                                            ArtifactCache.human_readable_size(physical_size)))
+        description.append('#' * max(map(len, description)))
+        description.insert(0, description[-1])
+
+        return '\n'.join(description)
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file_object:
+            for buffer in iter(lambda: file_object.read(ArtifactCache._BUFFER_SIZE), b''):
+                digest.update(buffer)
+        return digest.hexdigest()
+
+    @staticmethod
+    def human_readable_size(size: int) -> str:
+        for unit in ['B', 'KiB', 'MiB', 'GiB']:
+            if abs(size) < 1024:
+                return '{:.1f} {}'.format(size, unit)
+            size /= 1024
+        return '{:.1f} TiB'.format(size)
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        """
+        Compute a key out of the provided parts. The same parts in the same order always give the same key.
+
+        :param parts: strings describing what the cached files are generated from.
+        :return: the key.
+        """
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update('{}:'.format(len(part)).encode())
+            digest.update(part.encode())
+        return digest.hexdigest()
+
+    def lookup(self, key: str) -> bool:
+        return os.path.isfile(self._entry_path(key))
+
+    def report(self) -> str:
+        stored_size = 0
+        for entry_path in glob.glob(os.path.join(self._path, ArtifactCache._ENTRIES_DIRECTORY, '*', '*.json')):
+            with open(entry_path) as entry_file:
+                stored_size += sum(item['size'] for item in json.load(entry_file).values())
+        physical_size = 0
+        for directory, _, file_names in os.walk(os.path.join(self._path, ArtifactCache._OBJECTS_DIRECTORY)):
+            physical_size += sum(os.path.getsize(os.path.join(directory, name)) for name in file_names)
+
+        return ArtifactCache.description(self._read_statistics(), stored_size, physical_size)
+
+    def restore(self, key: str, destination: str) -> int:
+        """
+        Copy the files of an entry back to where they were stored from. Existing files are overwritten.
+
+        :param key: key of the entry.
+        :param destination: directory the relative paths of the entry are relative to.
+        :return: the number of bytes restored.
+        """
+        with open(self._entry_path(key)) as entry_file:
+            entry = json.load(entry_file)
+
+        restored_size = 0
+        for relative_path, item in sorted(entry.items()):
+            file_path = os.path.join(destination, relative_path)
+            if not os.path.isdir(os.path.dirname(file_path)):
+                os.makedirs(os.path.dirname(file_path))
+            shutil.copyfile(self._object_path(item['hash']), file_path)
+            restored_size += item['size']
+
+        self._update_statistics(hits=1, bytes_saved=restored_size)
+        return restored_size
+
+    def record_miss(self) -> None:
+        self._update_statistics(misses=1)
+
+    def store(self, key: str, source: str, relative_paths: List[str]) -> None:
+        """
+        Store files under a key. Contents already in the store are not copied again.
+
+        :param key: key of the entry.
+        :param source: directory the relative paths are relative to.
+        :param relative_paths: paths of the files to store.
+        """
+        entry = dict()
+        for relative_path in relative_paths:
+            file_path = os.path.join(source, relative_path)
+            file_hash = ArtifactCache.hash_file(file_path)
+            object_path = self._object_path(file_hash)
+            if not os.path.isfile(object_path):
+                self._write_atomically(object_path, lambda temp_path: shutil.copyfile(file_path, temp_path))
+            entry[relative_path] = {'hash': file_hash, 'size': os.path.getsize(file_path)}
+
+        self._write_atomically(self._entry_path(key), lambda temp_path: ArtifactCache._dump(entry, temp_path))
+
+    @staticmethod
+    def _dump(content: dict, path: str) -> None:
+        with open(path, 'w') as json_file:
+            json.dump(content, json_file, indent=2, sort_keys=True)
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self._path, ArtifactCache._ENTRIES_DIRECTORY, self._namespace, '{}.json'.format(key))
+
+    def _object_path(self, file_hash: str) -> str:
+        return os.path.join(self._path, ArtifactCache._OBJECTS_DIRECTORY, file_hash[:2], file_hash[2:])
+
+    def _read_statistics(self) -> Dict[str, Dict[str, int]]:
+        try:
+            with open(os.path.join(self._path, ArtifactCache._STATISTICS_FILE_NAME)) as statistics_file:
+                return json.load(statistics_file)
+        except FileNotFoundError:
+            return dict()
+
+    def _update_statistics(self, **increments: int) -> None:
+        # The statistics are updated concurrently by several processes (e.g. the daemon, the pool of the batch signing).
+        # The lock is held from the read to the replace, so that no update is lost.
+        if not os.path.isdir(self._path):
+            os.makedirs(self._path, exist_ok=True)
+        with open(os.path.join(self._path, ArtifactCache._STATISTICS_LOCK_FILE_NAME), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                statistics = self._read_statistics()
+                namespace_statistics = statistics.setdefault(self._namespace, dict())
+                for name, increment in increments.items():
+                    namespace_statistics[name] = namespace_statistics.get(name, 0) + increment
+                self._write_atomically(os.path.join(self._path, ArtifactCache._STATISTICS_FILE_NAME),
+                                       lambda temp_path: ArtifactCache._dump(statistics, temp_path))
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _write_atomically(path: str, write) -> None:
+        # Write to a temporary file in the same directory then rename it, so that concurrent readers never see a
+        # partially written file.
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        os.close(file_descriptor)
+        try:
+            write(temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+def main() -> None:
+    SanityChecks.run()
+
+    configuration = Configuration()
+    ArtifactCacheCommandLineInterface(configuration)
+    print(ArtifactCache(configuration.artifact_cache_path(), '').report())
+
+
+if __name__ == '__main__':
+    main()
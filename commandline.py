@@ -29,8 +29,10 @@ import argparse
 import os
 import re
 import sys
+import zipfile
 
 from configuration import Configuration
+from typing import List
 
 
 class CommandLineInterface(object):
@@ -57,6 +59,16 @@ class AOSPBuildCommandLineInterface(CommandLineInterface):
                             help='number of cores to use; 0 for all cores',
                             default=configuration.default_num_cores(),
                             type=int)
+        parser.add_argument('-f', '--force',
+                            help='build even if nothing changed since the last successful build',
+                            action='store_true')
+        parser.add_argument('-i', '--incremental',
+                            help='only build the modules which changed since the last successful build, and the images '
+                                 'they are installed in',
+                            action='store_true')
+        parser.add_argument('-n', '--no-cache',
+                            help='do not restore the outputs from the artifact cache nor store them into it',
+                            action='store_true')
         parser.add_argument('-w', '--path',
                             help='path to the AOSP tree',
                             default=configuration.default_path())
@@ -74,9 +86,18 @@ class AOSPBuildCommandLineInterface(CommandLineInterface):
         if not os.path.exists(self.path()):
             parser.error('Path "{}" does not exist'.format(self.path()))
 
+    def force(self) -> bool:
+        return self._args.force
+
+    def incremental(self) -> bool:
+        return self._args.incremental
+
     def make_target(self) -> str:
         return self._args.target
 
+    def no_cache(self) -> bool:
+        return self._args.no_cache
+
     def num_cores(self) -> int:
         if self._args.cores == 0:  # Resolve the real number of available cores.
             return os.cpu_count()
@@ -214,12 +235,307 @@ class AOSPTreeCommandLineInterface(CommandLineInterface):
         return self._args.yes
 
 
+class AVBCommandLineInterface(CommandLineInterface):
+    def __init__(self, configuration: Configuration) -> None:
+        parser = argparse.ArgumentParser(description='Generate the dm-verity hash tree of an image and a vbmeta image '
+                                                     'describing it, and append both to the image with an AVB footer',
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+        # Optional arguments.
+        parser.add_argument('-a', '--hash-algorithm',
+                            help='hash algorithm of the hash tree',
+                            default='sha256',
+                            choices=['sha1', 'sha256'])
+        parser.add_argument('-b', '--benchmark',
+                            help='instead, compare with avbtool on a synthetic image of this size',
+                            default=0,
+                            type=int,
+                            dest='benchmark_size',
+                            metavar='GIB')
+        parser.add_argument('-i', '--image',
+                            help='path to the original image (without an AVB footer), the hash tree and the vbmeta '
+                                 'image are appended to it',
+                            default=configuration.default_flash_system_path())
+        parser.add_argument('-j', '--jobs',
+                            help='number of processes hashing the image (0 for one per core)',
+                            default=0,
+                            type=int)
+        parser.add_argument('-k', '--key',
+                            help='path to the private key (PEM) for signing the vbmeta image, which is not signed '
+                                 'otherwise',
+                            default=argparse.SUPPRESS)
+        parser.add_argument('-o', '--output',
+                            help='path to the vbmeta image to generate',
+                            default=configuration.default_flash_vbmeta_path())
+        parser.add_argument('-p', '--partition-name',
+                            help='name of the partition the image is flashed on',
+                            default='system')
+        parser.add_argument('-r', '--rollback-index',
+                            help='rollback index of the vbmeta image',
+                            default=0,
+                            type=int)
+        parser.add_argument('-s', '--salt',
+                            help='salt of the hash tree, in hexadecimal (random if not provided)',
+                            default=argparse.SUPPRESS)
+
+        # Parse and sanity checks.
+        self._args = parser.parse_args()
+        if self.benchmark_size() < 0:
+            parser.error('-b/--benchmark must be greater than or equal to zero')
+        if not self.benchmark_size() and not os.path.isfile(self.image_path()):
+            parser.error('File "{}" does not exist'.format(self.image_path()))
+        if self.key_path() and not os.path.isfile(self.key_path()):
+            parser.error('File "{}" does not exist'.format(self.key_path()))
+        if self.max_processes() < 0:
+            parser.error('-j/--jobs must be greater than or equal to zero')
+        try:
+            self.salt()
+        except ValueError:
+            parser.error('-s/--salt must be hexadecimal')
+
+    def benchmark_size(self) -> int:
+        return self._args.benchmark_size
+
+    def hash_algorithm(self) -> str:
+        return self._args.hash_algorithm
+
+    def image_path(self) -> str:
+        return self._args.image
+
+    def key_path(self) -> str:
+        return getattr(self._args, 'key', '')
+
+    def max_processes(self) -> int:
+        return self._args.jobs
+
+    def output_path(self) -> str:
+        return self._args.output
+
+    def partition_name(self) -> str:
+        return self._args.partition_name
+
+    def rollback_index(self) -> int:
+        return self._args.rollback_index
+
+    def salt(self) -> bytes:
+        return bytes.fromhex(getattr(self._args, 'salt', ''))
+
+
+class ArtifactCacheCommandLineInterface(CommandLineInterface):
+    def __init__(self, configuration: Configuration) -> None:
+        parser = argparse.ArgumentParser(description='Report the usage of the artifact cache located in "{}"'.format(
+                                             configuration.artifact_cache_path()),
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+        # Parse.
+        self._args = parser.parse_args()
+
+
+class BootTimesCommandLineInterface(CommandLineInterface):
+    def __init__(self, configuration: Configuration) -> None:
+        parser = argparse.ArgumentParser(description='Report how long the devices took to boot the builds flashed on '
+                                                     'them, as recorded in "{}"'.format(
+                                                         configuration.flash_boot_times_path()),
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+        # Optional arguments.
+        parser.add_argument('-d', '--device',
+                            help='only report the boots of this device',
+                            default='',
+                            dest='serial',
+                            metavar='SERIAL')
+
+        # Parse.
+        self._args = parser.parse_args()
+
+    def serial(self) -> str:
+        return self._args.serial
+
+
+class DaemonCommandLineInterface(CommandLineInterface):
+    FOLLOW = 'follow'
+    LIST = 'list'
+    SERVE = 'serve'
+
+    def __init__(self, configuration: Configuration) -> None:
+        parser = argparse.ArgumentParser(description='Run the build daemon, or submit jobs to it and follow them. Jobs '
+                                                     'on the same AOSP tree run one after the other, jobs on different '
+                                                     'trees run in parallel',
+                                         epilog='Additional arguments for a job go after "--" (e.g. "-- -t droid" for '
+                                                'a build, "-- -k KEY" for signing)',
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+        # Required arguments.
+        parser.add_argument('action',
+                            help='run the daemon, list its jobs, follow the output of a job, or submit a job',
+                            choices=[DaemonCommandLineInterface.SERVE, DaemonCommandLineInterface.LIST,
+                                     DaemonCommandLineInterface.FOLLOW, 'build', 'sign', 'sync'])
+
+        # Optional arguments.
+        parser.add_argument('-c', '--cores',
+                            help='number of cores to use for the job; 0 for a share of the budget of the daemon, split '
+                                 'between the trees with jobs',
+                            default=configuration.default_num_cores(),
+                            type=int)
+        parser.add_argument('-d', '--detach',
+                            help='submit the job without following its output',
+                            action='store_true')
+        parser.add_argument('-i', '--id',
+                            help='identifier of the job to follow',
+                            default=0,
+                            type=int)
+        parser.add_argument('-w', '--path',
+                            help='path to the AOSP tree',
+                            default=configuration.default_path())
+        # Parse and sanity checks. The arguments after "--" are passed to the job.
+        arguments = sys.argv[1:]
+        separator_index = arguments.index('--') if '--' in arguments else len(arguments)
+        self._job_arguments = arguments[separator_index + 1:]
+        self._args = parser.parse_args(arguments[:separator_index])
+        if self.num_cores() < 0:
+            parser.error('-c/--cores must be greater than or equal to zero')
+        if self.action() == DaemonCommandLineInterface.FOLLOW and self.job_id() <= 0:
+            parser.error('-i/--id is required for following a job')
+        if not os.path.exists(self.path()):
+            parser.error('Path "{}" does not exist'.format(self.path()))
+
+    def action(self) -> str:
+        return self._args.action
+
+    def arguments(self) -> List[str]:
+        return self._job_arguments
+
+    def detach(self) -> bool:
+        return self._args.detach
+
+    def job_id(self) -> int:
+        return self._args.id
+
+    def num_cores(self) -> int:
+        return self._args.cores
+
+    def path(self) -> str:
+        return os.path.realpath(self._args.path)
+
+
+class DeviceInventoryCommandLineInterface(CommandLineInterface):
+    def __init__(self, configuration: Configuration) -> None:
+        parser = argparse.ArgumentParser(description='List the devices attached, either booted or in the bootloader, or '
+                                                     'describe one of them',
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+        # Optional arguments.
+        parser.add_argument('-d', '--device',
+                            help='describe this device, with all its properties or bootloader variables',
+                            default='',
+                            dest='serial',
+                            metavar='SERIAL')
+        parser.add_argument('-p', '--product',
+                            help='only list the devices of this product',
+                            default='')
+        parser.add_argument('-s', '--state',
+                            help='only list the devices in this state (e.g. "device" or "fastboot")',
+                            default='')
+
+        # Parse and sanity checks.
+        self._args = parser.parse_args()
+        if self.serial() and (self.product() or self.state()):
+            parser.error('-d/--device cannot be combined with -p/--product or -s/--state')
+
+    def product(self) -> str:
+        return self._args.product
+
+    def serial(self) -> str:
+        return self._args.serial
+
+    def state(self) -> str:
+        return self._args.state
+
+
+class DirectorySyncCommandLineInterface(CommandLineInterface):
+    def __init__(self, configuration: Configuration) -> None:
+        parser = argparse.ArgumentParser(description='Synchronize a local directory and a directory of a device, only '
+                                                     'transferring the files which differ',
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+        # Required arguments.
+        required_group = parser.add_argument_group('required arguments')
+        required_group.add_argument('-l', '--local',
+                                    help='path to the local directory',
+                                    required=True)
+        required_group.add_argument('-r', '--remote',
+                                    help='path to the directory of the device',
+                                    required=True)
+
+        # Optional arguments.
+        parser.add_argument('-d', '--device',
+                            help='serial of the device',
+                            default='',
+                            dest='serial',
+                            metavar='SERIAL')
+        parser.add_argument('-j', '--jobs',
+                            help='number of files transferred at the same time',
+                            default=configuration.adb_sync_streams(),
+                            type=int)
+        parser.add_argument('--pull',
+                            help='copy the files of the device to the local directory rather than the opposite',
+                            action='store_true')
+
+        # Parse and sanity checks.
+        self._args = parser.parse_args()
+        if not self.pull() and not os.path.isdir(self.local_path()):
+            parser.error('Directory "{}" does not exist'.format(self.local_path()))
+        if self.max_streams() <= 0:
+            parser.error('-j/--jobs must be greater than zero')
+
+    def local_path(self) -> str:
+        return os.path.realpath(self._args.local)
+
+    def max_streams(self) -> int:
+        return self._args.jobs
+
+    def pull(self) -> bool:
+        return self._args.pull
+
+    def remote_path(self) -> str:
+        return self._args.remote
+
+    def serial(self) -> str:
+        return self._args.serial
+
+
 class FlasherCommandLineInterface(CommandLineInterface):
     def __init__(self, configuration: Configuration) -> None:
         parser = argparse.ArgumentParser(description='Flash a generic system image',
                                          formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
         # Optional arguments.
+        parser.add_argument('-a', '--all',
+                            help='flash all the devices attached, several at the same time',
+                            action='store_true')
+        parser.add_argument('-d', '--device',
+                            help='serial of a device to flash (can be repeated, the devices are flashed at the same '
+                                 'time)',
+                            action='append',
+                            default=list(),
+                            dest='serials',
+                            metavar='SERIAL')
+        parser.add_argument('-f', '--force',
+                            help='flash all the partitions, even those already holding their image',
+                            action='store_true')
+        parser.add_argument('-j', '--jobs',
+                            help='maximum number of devices flashed at the same time',
+                            default=configuration.flash_max_devices(),
+                            type=int)
+        parser.add_argument('-m', '--max-download-size',
+                            help='sparse the images larger than this many bytes ahead of time into files of at most '
+                                 'this many bytes, the smallest maximum download size of the devices (0 to let fastboot '
+                                 'do it per device)',
+                            default=0,
+                            type=lambda value: int(value, 0))
+        parser.add_argument('-p', '--product',
+                            help='with -a/--all, only flash the devices of this product',
+                            default='')
         parser.add_argument('-s', '--system',
                             help='path to the system image',
                             default=configuration.default_flash_system_path())
@@ -229,13 +545,50 @@ class FlasherCommandLineInterface(CommandLineInterface):
         parser.add_argument('-y', '--yes',
                             help='automatically continue when prompted',
                             action='store_true')
+        parser.add_argument('-z', '--zip',
+                            help='path to an archive of images (e.g. "*-signed_img-*.zip"), to flash all the images it '
+                                 'holds straight out of it instead of -s/--system and -v/--vbmeta',
+                            default='')
 
         # Parse and sanity checks.
         self._args = parser.parse_args()
-        if not os.path.exists(self.system_image_path()):
-            parser.error('Path "{}" does not exist'.format(self.system_image_path()))
-        if not os.path.exists(self.vbmeta_image_path()):
-            parser.error('Path "{}" does not exist'.format(self.vbmeta_image_path()))
+        if self.image_archive_path():
+            if not zipfile.is_zipfile(self.image_archive_path()):
+                parser.error('Path "{}" is not a zip archive'.format(self.image_archive_path()))
+        else:
+            if not os.path.exists(self.system_image_path()):
+                parser.error('Path "{}" does not exist'.format(self.system_image_path()))
+            if not os.path.exists(self.vbmeta_image_path()):
+                parser.error('Path "{}" does not exist'.format(self.vbmeta_image_path()))
+        if self.all() and self.serials():
+            parser.error('-a/--all and -d/--device are mutually exclusive')
+        if self.product() and not self.all():
+            parser.error('-p/--product requires -a/--all')
+        if self.max_devices() <= 0:
+            parser.error('-j/--jobs must be greater than zero')
+        if self.max_download_size() < 0:
+            parser.error('-m/--max-download-size must not be negative')
+
+    def all(self) -> bool:
+        return self._args.all
+
+    def force(self) -> bool:
+        return self._args.force
+
+    def image_archive_path(self) -> str:
+        return os.path.realpath(self._args.zip) if self._args.zip else ''
+
+    def max_devices(self) -> int:
+        return self._args.jobs
+
+    def max_download_size(self) -> int:
+        return self._args.max_download_size
+
+    def product(self) -> str:
+        return self._args.product
+
+    def serials(self) -> List[str]:
+        return self._args.serials
 
     def system_image_path(self) -> str:
         return os.path.realpath(self._args.system)
@@ -282,6 +635,304 @@ class LocalManifestCommandLineInterface(CommandLineInterface):
         return self._args.specific
 
 
+class LogsCommandLineInterface(CommandLineInterface):
+    def __init__(self, configuration: Configuration) -> None:
+        parser = argparse.ArgumentParser(description='List the runs whose logs are in "{}", or show where a run '
+                                                     'failed'.format(configuration.logs_path()),
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+        # Optional arguments.
+        parser.add_argument('-a', '--all',
+                            help='show all the failing edges (or errors) instead of the first one',
+                            action='store_true')
+        parser.add_argument('-c', '--context',
+                            help='number of lines to show before and after a failure',
+                            default=10,
+                            type=int)
+        parser.add_argument('-n', '--count',
+                            help='number of runs to list, most recent last',
+                            default=20,
+                            type=int)
+        parser.add_argument('-r', '--run',
+                            help='name of the run to show the failure of',
+                            default=argparse.SUPPRESS)
+        parser.add_argument('-s', '--stage',
+                            help='only show the failure of this stage of the run',
+                            default=argparse.SUPPRESS)
+
+        # Parse and sanity checks.
+        self._args = parser.parse_args()
+        if self.context() < 0:
+            parser.error('-c/--context must be greater than or equal to zero')
+        if self.count() <= 0:
+            parser.error('-n/--count must be greater than zero')
+        if self.run() and not os.path.isdir(os.path.join(configuration.logs_path(), self.run())):
+            parser.error('Run "{}" does not exist'.format(self.run()))
+
+    def all(self) -> bool:
+        return self._args.all
+
+    def context(self) -> int:
+        return self._args.context
+
+    def count(self) -> int:
+        return self._args.count
+
+    def run(self) -> str:
+        return getattr(self._args, 'run', '')
+
+    def stage(self) -> str:
+        return getattr(self._args, 'stage', '')
+
+
+class ModuleIndexCommandLineInterface(CommandLineInterface):
+    def __init__(self, configuration: Configuration) -> None:
+        parser = argparse.ArgumentParser(description='Query the modules of a built AOSP tree',
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+        # Required arguments.
+        query_group = parser.add_mutually_exclusive_group(required=True)
+        query_group.add_argument('-i', '--installed',
+                                 help='list the files installed by a module',
+                                 default=argparse.SUPPRESS,
+                                 dest='module')
+        query_group.add_argument('-o', '--owner',
+                                 help='list the modules owning a path: an installed file, a path on the device or a '
+                                      'source file (relative to the root of the tree or absolute)',
+                                 default=argparse.SUPPRESS,
+                                 metavar='PATH')
+
+        # Optional arguments.
+        parser.add_argument('-w', '--path',
+                            help='path to the AOSP tree',
+                            default=configuration.default_path())
+
+        # Parse and sanity checks.
+        self._args = parser.parse_args()
+        if not os.path.exists(self.path()):
+            parser.error('Path "{}" does not exist'.format(self.path()))
+
+    def module(self) -> str:
+        return getattr(self._args, 'module', '')
+
+    def owner(self) -> str:
+        return getattr(self._args, 'owner', '')
+
+    def path(self) -> str:
+        return os.path.realpath(self._args.path)
+
+
+class OTAStoreCommandLineInterface(CommandLineInterface):
+    def __init__(self, configuration: Configuration) -> None:
+        parser = argparse.ArgumentParser(description='List the signed target files retained in "{}" for generating '
+                                                     'incremental OTAs, most recent first'.format(
+                                                         configuration.ota_store_path()),
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+        # Optional arguments.
+        parser.add_argument('-p', '--product',
+                            help='only list the releases of this product',
+                            default=argparse.SUPPRESS)
+
+        # Parse.
+        self._args = parser.parse_args()
+
+    def product(self) -> str:
+        return getattr(self._args, 'product', '')
+
+
+class PayloadCommandLineInterface(CommandLineInterface):
+    def __init__(self, configuration: Configuration) -> None:
+        parser = argparse.ArgumentParser(description='Report the partitions and operations of the payload of A/B OTA '
+                                                     'files, without extracting them',
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+        # Required arguments.
+        required_group = parser.add_argument_group('required arguments')
+        required_group.add_argument('-o', '--ota',
+                                    help='path to an OTA file (can be repeated)',
+                                    required=True,
+                                    action='append',
+                                    dest='ota_paths',
+                                    metavar='PATH')
+
+        # Parse and sanity checks.
+        self._args = parser.parse_args()
+        for ota_path in self.ota_paths():
+            if not os.path.isfile(ota_path):
+                parser.error('File "{}" does not exist'.format(ota_path))
+
+    def ota_paths(self) -> List[str]:
+        return self._args.ota_paths
+
+
+class PipelineCommandLineInterface(CommandLineInterface):
+    def __init__(self, configuration: Configuration, stages: List[str]) -> None:
+        parser = argparse.ArgumentParser(description='Fetch the local manifest, clone, setup, build and sign an AOSP tree '
+                                                     'then flash it, in one go. Stages already done are skipped',
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+        # Required arguments.
+        required_group = parser.add_argument_group('required arguments')
+        required_group.add_argument('-r', '--release',
+                                    help='Android release tag (e.g. android-10.0.0_r30)',
+                                    required=True,
+                                    default=argparse.SUPPRESS)
+
+        # Optional arguments.
+        parser.add_argument('-a', '--all',
+                            help='flash all the devices attached, several at the same time (requires -k/--key)',
+                            action='store_true')
+        parser.add_argument('-c', '--cores',
+                            help='number of cores to use; 0 for all cores',
+                            default=configuration.default_num_cores(),
+                            type=int)
+        parser.add_argument('-d', '--device',
+                            help='serial of a device to flash (can be repeated, requires -k/--key)',
+                            action='append',
+                            default=list(),
+                            dest='serials',
+                            metavar='SERIAL')
+        parser.add_argument('-f', '--force',
+                            help='run this stage even if it is up to date (can be repeated)',
+                            action='append',
+                            choices=stages,
+                            default=list(),
+                            dest='forced_stages',
+                            metavar='STAGE')
+        parser.add_argument('-g', '--generic',
+                            help='generic Git ref of the local manifest',
+                            default=configuration.default_generic_ref())
+        parser.add_argument('-k', '--key',
+                            help='path to the key to use for signing; the tree is not signed nor flashed without it',
+                            default='')
+        parser.add_argument('-m', '--manifest-revision',
+                            help='local manifest Git ref (will copy -s/--specific if not provided)',
+                            default=argparse.SUPPRESS)
+        parser.add_argument('-n', '--no-cache',
+                            help='do not restore the outputs and signed files from the artifact cache nor store them '
+                                 'into it',
+                            action='store_true')
+        parser.add_argument('-p', '--product',
+                            help='name of the target product',
+                            default=configuration.default_product())
+        parser.add_argument('-s', '--specific',
+                            help='specific Git ref of the local manifest',
+                            default=configuration.default_specific_ref())
+        parser.add_argument('-t', '--target',
+                            help='makefile target to build',
+                            default=configuration.default_make_target())
+        parser.add_argument('-u', '--variant',
+                            help='build variant',
+                            choices=configuration.variants(),
+                            default=configuration.default_variant())
+        parser.add_argument('-w', '--path',
+                            help='path to the AOSP tree, cloned if it does not exist',
+                            default=configuration.default_path())
+        parser.add_argument('-y', '--yes',
+                            help='automatically continue when prompted',
+                            action='store_true')
+
+        # Parse and sanity checks. The release and the Git refs are checked by the stages using them, as they are not
+        # needed when the tree is up to date.
+        self._args = parser.parse_args()
+        if self.num_cores() < 0:
+            parser.error('-c/--cores must be greater than or equal to zero')
+        if not os.path.exists(os.path.dirname(self.path())):
+            parser.error('Path "{}" does not exist'.format(os.path.dirname(self.path())))
+        if self.key_path() and not os.path.exists(self.key_path()):
+            parser.error('Path "{}" does not exist'.format(self.key_path()))
+        if self.all() and self.serials():
+            parser.error('-a/--all and -d/--device are mutually exclusive')
+        if (self.all() or self.serials()) and not self.key_path():
+            parser.error('-a/--all and -d/--device require -k/--key')
+
+    def all(self) -> bool:
+        return self._args.all
+
+    def forced_stages(self) -> List[str]:
+        return self._args.forced_stages
+
+    def generic_ref(self) -> str:
+        return self._args.generic
+
+    def key_path(self) -> str:
+        return os.path.realpath(self._args.key) if self._args.key else ''
+
+    def make_target(self) -> str:
+        return self._args.target
+
+    def no_cache(self) -> bool:
+        return self._args.no_cache
+
+    def num_cores(self) -> int:
+        if self._args.cores == 0:  # Resolve the real number of available cores.
+            return os.cpu_count()
+        return self._args.cores
+
+    def path(self) -> str:
+        return os.path.realpath(self._args.path)
+
+    def product(self) -> str:
+        return self._args.product
+
+    def ref(self) -> str:
+        try:
+            return self._args.manifest_revision
+        except AttributeError:
+            return self.specific_ref()
+
+    def release(self) -> str:
+        return self._args.release
+
+    def serials(self) -> List[str]:
+        return self._args.serials
+
+    def specific_ref(self) -> str:
+        return self._args.specific
+
+    def variant(self) -> str:
+        return self._args.variant
+
+    def _continue_when_prompted(self) -> bool:
+        return self._args.yes
+
+
+class ProfilerCommandLineInterface(CommandLineInterface):
+    def __init__(self, configuration: Configuration) -> None:
+        parser = argparse.ArgumentParser(description='Report the resources used by the stages of a run whose logs are in '
+                                                     '"{}"'.format(configuration.logs_path()),
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+        # Required arguments.
+        parser.add_argument('-r', '--run',
+                            help='name of the run to report the resources of',
+                            required=True)
+
+        # Optional arguments.
+        parser.add_argument('-H', '--html',
+                            help='also write the report as HTML to this file',
+                            default=argparse.SUPPRESS,
+                            dest='html_path')
+        parser.add_argument('-s', '--stage',
+                            help='only report the resources of this stage of the run',
+                            default=argparse.SUPPRESS)
+
+        # Parse and sanity checks.
+        self._args = parser.parse_args()
+        if not os.path.isdir(os.path.join(configuration.logs_path(), self.run())):
+            parser.error('Run "{}" does not exist'.format(self.run()))
+
+    def html_path(self) -> str:
+        return getattr(self._args, 'html_path', '')
+
+    def run(self) -> str:
+        return self._args.run
+
+    def stage(self) -> str:
+        return getattr(self._args, 'stage', '')
+
+
 class SignerCommandLineInterface(CommandLineInterface):
     def __init__(self, configuration: Configuration) -> None:
         parser = argparse.ArgumentParser(description='Sign a target file and generate image and OTA files',
@@ -295,6 +946,43 @@ class SignerCommandLineInterface(CommandLineInterface):
                                     default=argparse.SUPPRESS)
 
         # Optional arguments.
+        parser.add_argument('-a', '--all',
+                            help='sign all the target files of the dist directory, several at the same time',
+                            action='store_true')
+        parser.add_argument('-b', '--base',
+                            help='also generate an incremental OTA file from this release of the OTA store (can be '
+                                 'repeated)',
+                            action='append',
+                            default=list(),
+                            dest='base_releases',
+                            metavar='RELEASE')
+        parser.add_argument('-j', '--jobs',
+                            help='maximum number of files generated at the same time (0 for no limit)',
+                            default=0,
+                            type=int)
+        parser.add_argument('-l', '--latest',
+                            help='also generate incremental OTA files from the N most recent releases of the OTA store',
+                            default=0,
+                            type=int,
+                            metavar='N')
+        parser.add_argument('-n', '--no-cache',
+                            help='do not reuse the signed files from the artifact cache nor store them into it',
+                            action='store_true')
+        parser.add_argument('--no-verify',
+                            help='do not verify the signed files',
+                            action='store_true')
+        parser.add_argument('-p', '--processes',
+                            help='maximum number of target files signed at the same time with -a/--all or '
+                                 '-t/--target-files (0 for sizing it to the cores and memory of the host)',
+                            default=0,
+                            type=int)
+        parser.add_argument('-t', '--target-files',
+                            help='sign this target file (relative to the root of the tree or absolute), several at the '
+                                 'same time if repeated',
+                            action='append',
+                            default=list(),
+                            dest='target_file_paths',
+                            metavar='PATH')
         parser.add_argument('-w', '--path',
                             help='path to the AOSP tree',
                             default=configuration.default_path())
@@ -305,9 +993,104 @@ class SignerCommandLineInterface(CommandLineInterface):
             parser.error('Path "{}" does not exist'.format(self.key_path()))
         if not os.path.exists(self.path()):
             parser.error('Path "{}" does not exist'.format(self.path()))
+        if self.latest_bases() < 0:
+            parser.error('-l/--latest must be greater than or equal to zero')
+        if self.max_jobs() < 0:
+            parser.error('-j/--jobs must be greater than or equal to zero')
+        if self.max_processes() < 0:
+            parser.error('-p/--processes must be greater than or equal to zero')
+        if self.all() and self.target_file_paths():
+            parser.error('-a/--all and -t/--target-files are mutually exclusive')
+
+    def all(self) -> bool:
+        return self._args.all
+
+    def base_releases(self) -> List[str]:
+        return self._args.base_releases
 
     def key_path(self) -> str:
         return os.path.realpath(self._args.key)
 
+    def latest_bases(self) -> int:
+        return self._args.latest
+
+    def max_jobs(self) -> int:
+        return self._args.jobs
+
+    def max_processes(self) -> int:
+        return self._args.processes
+
+    def no_cache(self) -> bool:
+        return self._args.no_cache
+
+    def no_verify(self) -> bool:
+        return self._args.no_verify
+
     def path(self) -> str:
         return os.path.realpath(self._args.path)
+
+    def target_file_paths(self) -> List[str]:
+        return self._args.target_file_paths
+
+
+class SparseImageCommandLineInterface(CommandLineInterface):
+    def __init__(self, configuration: Configuration) -> None:
+        parser = argparse.ArgumentParser(description='Convert a raw image into sparse images fitting the maximum download '
+                                                     'size of a device',
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+        # Required arguments.
+        required_group = parser.add_argument_group('required arguments')
+        required_group.add_argument('-i', '--image',
+                                    help='path to the raw image',
+                                    required=True)
+
+        # Optional arguments.
+        parser.add_argument('-b', '--block-size',
+                            help='size of the blocks in bytes',
+                            default=4096,
+                            type=int)
+        parser.add_argument('-c', '--check',
+                            help='check that the sparse images give back the raw image',
+                            action='store_true')
+        parser.add_argument('-d', '--device',
+                            help='serial of the device (in the bootloader) to get the maximum download size of',
+                            default='',
+                            dest='serial',
+                            metavar='SERIAL')
+        parser.add_argument('-m', '--max-size',
+                            help='maximum size of each sparse image in bytes (asked to the device if 0)',
+                            default=0,
+                            type=lambda value: int(value, 0))
+        parser.add_argument('-o', '--output',
+                            help='prefix of the paths of the sparse images (defaults to the path to the raw image)',
+                            default='')
+
+        # Parse and sanity checks.
+        self._args = parser.parse_args()
+        if not os.path.isfile(self.image_path()):
+            parser.error('File "{}" does not exist'.format(self.image_path()))
+        if self.block_size() <= 0 or self.block_size() % 4:
+            parser.error('-b/--block-size must be a positive multiple of 4')
+        if self.max_size() < 0:
+            parser.error('-m/--max-size must not be negative')
+        if self.max_size() and self.serial():
+            parser.error('-d/--device and -m/--max-size are mutually exclusive')
+
+    def block_size(self) -> int:
+        return self._args.block_size
+
+    def check(self) -> bool:
+        return self._args.check
+
+    def image_path(self) -> str:
+        return os.path.realpath(self._args.image)
+
+    def max_size(self) -> int:
+        return self._args.max_size
+
+    def output_prefix(self) -> str:
+        return os.path.realpath(self._args.output) if self._args.output else self.image_path()
+
+    def serial(self) -> str:
+        return self._args.serial
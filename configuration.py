@@ -38,12 +38,18 @@ class Configuration(configparser.ConfigParser):
     Read the default configuration file, and optionally the additional overriding configuration files if any.
     """
 
+    _SECTION_ADB = 'ADB'
     _SECTION_AOSP_FILES = 'AOSPFiles'
+    _SECTION_ARTIFACT_CACHE = 'ArtifactCache'
     _SECTION_COMMAND_LINE_DEFAULTS = 'CommandLineDefaults'
     _SECTION_CCACHE = 'CCache'
+    _SECTION_DAEMON = 'Daemon'
+    _SECTION_FLASH = 'Flash'
     _SECTION_GIT = 'Git'
     _SECTION_GOOGLE_SOURCE = 'GoogleSource'
     _SECTION_LOCAL_MANIFEST = 'LocalManifest'
+    _SECTION_LOGS = 'Logs'
+    _SECTION_OTA_STORE = 'OTAStore'
     _SECTION_REPO = 'Repo'
     _SECTION_REPOSITORY_AVB = 'RepositoryAvb'
     _SECTION_REPOSITORY_BUILD = 'RepositoryBuild'
@@ -54,6 +60,9 @@ class Configuration(configparser.ConfigParser):
     _SECTION_VENDORS = 'Vendors'
 
     _OPTION_BINARY_PATH = 'BinaryPath'
+    _OPTION_BOOT_TIMEOUT_SEC = 'BootTimeoutSec'
+    _OPTION_BOOT_TIMES = 'BootTimes'
+    _OPTION_BUILD_MEMORY = 'BuildMemory'
     _OPTION_BUILDSPEC_PATH = 'BuildspecPath'
     _OPTION_DEPTH = 'Depth'
     _OPTION_DIST_PATH = 'DistPath'
@@ -61,11 +70,16 @@ class Configuration(configparser.ConfigParser):
     _OPTION_FLASH_VBMETA_IMAGE_PATH = 'FlashVBMetaImagePath'
     _OPTION_GENERIC_REF = 'GenericRef'
     _OPTION_GROUPS = 'Groups'
+    _OPTION_HASH_CACHE = 'HashCache'
     _OPTION_HOST_BIN_PATH = 'HostBinPath'
     _OPTION_LINK = 'Link'
     _OPTION_LIST = 'List'
+    _OPTION_LOGS = 'Logs'
     _OPTION_TEMPLATE_NAME = 'TemplateName'
     _OPTION_MAKE_TARGET = 'MakeTarget'
+    _OPTION_MAX_CORES = 'MaxCores'
+    _OPTION_MAX_DEVICES = 'MaxDevices'
+    _OPTION_MAX_MEMORY = 'MaxMemory'
     _OPTION_NAME = 'Name'
     _OPTION_NAME_FORMAT = 'NameFormat'
     _OPTION_NO_TAGS = 'NoTags'
@@ -74,8 +88,15 @@ class Configuration(configparser.ConfigParser):
     _OPTION_PATH = 'Path'
     _OPTION_PRODUCT = 'Product'
     _OPTION_PROTOCOL = 'Protocol'
+    _OPTION_REGISTRY = 'Registry'
     _OPTION_RELEASE_TOOLS = 'ReleaseTools'
+    _OPTION_RETAINED = 'Retained'
+    _OPTION_SAMPLE_INTERVAL_SEC = 'SampleIntervalSec'
+    _OPTION_SIGN_MEMORY = 'SignMemory'
+    _OPTION_SOCKET = 'Socket'
     _OPTION_SPECIFIC_REF = 'SpecificRef'
+    _OPTION_SYNC_MEMORY = 'SyncMemory'
+    _OPTION_SYNC_STREAMS = 'SyncStreams'
     _OPTION_TRACE = 'Trace'
     _OPTION_VARIANT = 'Variant'
     _OPTION_VERIFY_TIMEOUT_SEC = 'VerifyTimeoutSec'
@@ -137,15 +158,35 @@ class Configuration(configparser.ConfigParser):
         name = self.get(Configuration._SECTION_REPOSITORY_MANIFEST, Configuration._OPTION_NAME)
         self._repository_manifest = Repository(protocol, user, url, path, name)
 
+        self._adb_hash_cache_path = self.get(Configuration._SECTION_ADB, Configuration._OPTION_HASH_CACHE)
+        self._adb_sync_streams = self.getint(Configuration._SECTION_ADB, Configuration._OPTION_SYNC_STREAMS)
+        self._artifact_cache_path = self.get(Configuration._SECTION_ARTIFACT_CACHE, Configuration._OPTION_PATH)
         self._buildspec_path = self.get(Configuration._SECTION_AOSP_FILES, Configuration._OPTION_BUILDSPEC_PATH)
         self._ccache_bin_path = self.get(Configuration._SECTION_CCACHE, Configuration._OPTION_BINARY_PATH)
         self._ccache_path = self.get(Configuration._SECTION_CCACHE, Configuration._OPTION_PATH)
+        self._daemon_build_memory = self.getint(Configuration._SECTION_DAEMON, Configuration._OPTION_BUILD_MEMORY)
+        self._daemon_logs_path = self.get(Configuration._SECTION_DAEMON, Configuration._OPTION_LOGS)
+        self._daemon_max_cores = self.getint(Configuration._SECTION_DAEMON, Configuration._OPTION_MAX_CORES)
+        self._daemon_max_memory = self.getint(Configuration._SECTION_DAEMON, Configuration._OPTION_MAX_MEMORY)
+        self._daemon_sign_memory = self.getint(Configuration._SECTION_DAEMON, Configuration._OPTION_SIGN_MEMORY)
+        self._daemon_socket_path = self.get(Configuration._SECTION_DAEMON, Configuration._OPTION_SOCKET)
+        self._daemon_sync_memory = self.getint(Configuration._SECTION_DAEMON, Configuration._OPTION_SYNC_MEMORY)
         self._dist_path = self.get(Configuration._SECTION_AOSP_FILES, Configuration._OPTION_DIST_PATH)
+        self._flash_boot_timeout_sec = self.getfloat(Configuration._SECTION_FLASH,
+                                                     Configuration._OPTION_BOOT_TIMEOUT_SEC)
+        self._flash_boot_times_path = self.get(Configuration._SECTION_FLASH, Configuration._OPTION_BOOT_TIMES)
+        self._flash_max_devices = self.getint(Configuration._SECTION_FLASH, Configuration._OPTION_MAX_DEVICES)
+        self._flash_registry_path = self.get(Configuration._SECTION_FLASH, Configuration._OPTION_REGISTRY)
         self._host_bin_path = self.get(Configuration._SECTION_AOSP_FILES, Configuration._OPTION_HOST_BIN_PATH)
         self._local_manifest_dir = self.get(Configuration._SECTION_LOCAL_MANIFEST, Configuration._OPTION_PATH)
         self._local_manifest_file = self.get(Configuration._SECTION_LOCAL_MANIFEST, Configuration._OPTION_NAME)
         self._local_manifest_template_file = self.get(Configuration._SECTION_LOCAL_MANIFEST,
                                                       Configuration._OPTION_TEMPLATE_NAME)
+        self._logs_path = self.get(Configuration._SECTION_LOGS, Configuration._OPTION_PATH)
+        self._logs_sample_interval_sec = self.getfloat(Configuration._SECTION_LOGS,
+                                                       Configuration._OPTION_SAMPLE_INTERVAL_SEC)
+        self._ota_store_path = self.get(Configuration._SECTION_OTA_STORE, Configuration._OPTION_PATH)
+        self._ota_store_retained = self.getint(Configuration._SECTION_OTA_STORE, Configuration._OPTION_RETAINED)
         self._release_tools_path = self.get(Configuration._SECTION_AOSP_FILES, Configuration._OPTION_RELEASE_TOOLS)
         self._repo_depth = self.getint(Configuration._SECTION_REPO, Configuration._OPTION_DEPTH)
         self._repo_groups = self.get(Configuration._SECTION_REPO, Configuration._OPTION_GROUPS).split()
@@ -160,6 +201,15 @@ class Configuration(configparser.ConfigParser):
         self._verify_timeout_sec = self.getint(Configuration._SECTION_SIGNING_INFO,
                                                Configuration._OPTION_VERIFY_TIMEOUT_SEC)
 
+    def adb_hash_cache_path(self) -> str:
+        return self._adb_hash_cache_path
+
+    def adb_sync_streams(self) -> int:
+        return self._adb_sync_streams
+
+    def artifact_cache_path(self) -> str:
+        return self._artifact_cache_path
+
     def buildspec_path(self) -> str:
         return self._buildspec_path
 
@@ -169,6 +219,27 @@ class Configuration(configparser.ConfigParser):
     def ccache_path(self) -> str:
         return self._ccache_path
 
+    def daemon_build_memory(self) -> int:
+        return self._daemon_build_memory
+
+    def daemon_logs_path(self) -> str:
+        return self._daemon_logs_path
+
+    def daemon_max_cores(self) -> int:
+        return self._daemon_max_cores
+
+    def daemon_max_memory(self) -> int:
+        return self._daemon_max_memory
+
+    def daemon_sign_memory(self) -> int:
+        return self._daemon_sign_memory
+
+    def daemon_socket_path(self) -> str:
+        return self._daemon_socket_path
+
+    def daemon_sync_memory(self) -> int:
+        return self._daemon_sync_memory
+
     def default_flash_system_path(self) -> str:
         return self._default_flash_system_path
 
@@ -202,6 +273,18 @@ class Configuration(configparser.ConfigParser):
     def dist_path(self) -> str:
         return self._dist_path
 
+    def flash_boot_timeout_sec(self) -> float:
+        return self._flash_boot_timeout_sec
+
+    def flash_boot_times_path(self) -> str:
+        return self._flash_boot_times_path
+
+    def flash_max_devices(self) -> int:
+        return self._flash_max_devices
+
+    def flash_registry_path(self) -> str:
+        return self._flash_registry_path
+
     def host_bin_path(self) -> str:
         return self._host_bin_path
 
@@ -214,6 +297,18 @@ class Configuration(configparser.ConfigParser):
     def local_manifest_template_file(self) -> str:
         return self._local_manifest_template_file
 
+    def logs_path(self) -> str:
+        return self._logs_path
+
+    def logs_sample_interval_sec(self) -> float:
+        return self._logs_sample_interval_sec
+
+    def ota_store_path(self) -> str:
+        return self._ota_store_path
+
+    def ota_store_retained(self) -> int:
+        return self._ota_store_retained
+
     def release_tools_path(self) -> str:
         return self._release_tools_path
 
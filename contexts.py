@@ -28,58 +28,134 @@
 import contextlib
 import os
 import sys
+import threading
 
 from typing import Dict, List
 
 
+class ExecutionContext(object):
+    """
+    A working directory and environment variables to run commands with, overlaid on the ones of the process rather than
+    changing them: ``os.chdir`` and ``os.environ`` are shared by all the threads of the process. Commands get them
+    through :meth:`kwargs` (``cwd=`` and ``env=``), relative paths are resolved with :meth:`path`.
+
+    Contexts do not change, deriving a context (e.g. :meth:`with_cwd`) gives a new one. The context managers of this
+    module derive the context of the current thread, see :func:`current`.
+    """
+
+    def __init__(self, cwd: str='', variables: Dict[str, str]=None) -> None:
+        """
+        :param cwd: the working directory, or empty for the one of the process.
+        :param variables: the variables set (or unset, when None) on top of the environment of the process.
+        """
+        self._cwd = cwd
+        self._variables = dict(variables or dict())
+
+    def cwd(self) -> str:
+        return self._cwd or os.getcwd()
+
+    def env(self) -> Dict[str, str]:
+        environment = dict(os.environ)
+        for variable, value in self._variables.items():
+            if value is None:
+                environment.pop(variable, None)
+            else:
+                environment[variable] = value
+        return environment
+
+    def getenv(self, variable: str, default: str=None) -> str:
+        if variable in self._variables:
+            return default if self._variables[variable] is None else self._variables[variable]
+        return os.environ.get(variable, default)
+
+    def kwargs(self) -> Dict[str, object]:
+        """
+        :return: the keyword arguments running a command of :mod:`subprocess` in this context.
+        """
+        return {'cwd': self.cwd(), 'env': self.env()}
+
+    def path(self, path: str) -> str:
+        """
+        :return: the absolute path of a path relative to the working directory (absolute paths are left as is).
+        """
+        return os.path.normpath(os.path.join(self.cwd(), path))
+
+    def with_cwd(self, cwd: str) -> 'ExecutionContext':
+        return ExecutionContext(self.path(cwd), self._variables)
+
+    def with_variables(self, variables: Dict[str, str]) -> 'ExecutionContext':
+        return ExecutionContext(self._cwd, dict(self._variables, **variables))
+
+    def without_variables(self, variables: List[str]) -> 'ExecutionContext':
+        return ExecutionContext(self._cwd, dict(self._variables, **dict.fromkeys(variables)))
+
+
+_current = threading.local()
+
+
+@contextlib.contextmanager
+def attached(context: ExecutionContext) -> ExecutionContext:
+    """
+    Make an existing :class:`ExecutionContext` the one of the current thread for the context scope only. It is meant for
+    passing the context of a thread on to the threads it starts (see :func:`current`).
+
+    :param context: the context.
+    :return: the context.
+    """
+    previous_context = getattr(_current, 'context', None)
+    _current.context = context
+    try:
+        yield context
+    finally:
+        _current.context = previous_context
+
+
+def current() -> ExecutionContext:
+    """
+    :return: the :class:`ExecutionContext` of the current thread, the one of the process if none was set.
+    """
+    return getattr(_current, 'context', None) or ExecutionContext()
+
+
 @contextlib.contextmanager
-def set_variable(variable: str, value: str) -> None:
+def set_variable(variable: str, value: str) -> ExecutionContext:
     """
     Add the provided variable to the environment for the context scope only. If the variable is already defined, it will
     be overwritten.
 
     :param variable: name of the variable to set.
     :param value: value for the variable. When leaving the context, the value of the variable is restored.
+    :return: the context of the current thread within the scope.
     """
-    with set_variables({variable: value}):
-        yield
+    with set_variables({variable: value}) as context:
+        yield context
 
 
 @contextlib.contextmanager
-def set_variables(variables: Dict[str, str]) -> None:
+def set_variables(variables: Dict[str, str]) -> ExecutionContext:
     """
     Add the provided variables to the environment for the context scope only. If some variables are already defined,
-    they will be overwritten.
+    they will be overwritten. It applies to the commands run in the :class:`ExecutionContext` of the current thread, the
+    environment of the process is left untouched.
 
     :param variables: a dictionary containing the variables' names as keys, and their new values as values. When leaving
                       the context, the values of the variables are restored.
+    :return: the context of the current thread within the scope.
     """
-    previous_variables = dict()
-    for variable in variables:
-        previous_variables[variable] = os.environ.get(variable)
-    try:
-        for variable, value in variables.items():
-            os.environ[variable] = value
-        yield
-    finally:
-        for variable in variables:
-            # None means the variable was not defined at all. If an exception arises in the try block, the variable
-            # could not be in the environment, so we have to check for that as well.
-            if variable in os.environ and previous_variables[variable] is None:
-                del os.environ[variable]
-            else:
-                os.environ[variable] = previous_variables[variable]
+    with attached(current().with_variables(variables)) as context:
+        yield context
 
 
 @contextlib.contextmanager
-def append_to_path(path: str) -> None:
+def append_to_path(path: str) -> ExecutionContext:
     """
     Add the provided path to the PATH for the context scope only.
 
     :param path: the directory to add to the PATH. When leaving the context, the directory is removed from the PATH.
+    :return: the context of the current thread within the scope.
     """
-    with set_variable('PATH', '{}:{}'.format(os.environ.get('PATH'), path)):
-        yield
+    with set_variable('PATH', '{}:{}'.format(current().getenv('PATH'), path)) as context:
+        yield context
 
 
 @contextlib.contextmanager
@@ -91,55 +167,46 @@ def open_local(*args, **kwargs) -> None:
     :param args: arguments passed to the built-in ``open``.
     :param kwargs: keywords arguments passed to the built-in ``open``.
     """
-    with set_cwd(os.path.dirname(os.path.realpath(sys.argv[0]))):
-        with open(*args, **kwargs) as file_object:
-            yield file_object
+    local_path = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), args[0])
+    with open(local_path, *args[1:], **kwargs) as file_object:
+        yield file_object
 
 
 @contextlib.contextmanager
-def set_cwd(cwd: str) -> None:
+def set_cwd(cwd: str) -> ExecutionContext:
     """
-    Change the current working directory for the context scope only.
+    Change the current working directory for the context scope only. It applies to the :class:`ExecutionContext` of the
+    current thread, the working directory of the process is left untouched: relative paths must be resolved with
+    :meth:`ExecutionContext.path`.
 
     :param cwd: new working directory. When leaving the context, the working directory is restored to what it was.
+    :return: the context of the current thread within the scope.
     """
-    previous_cwd = os.getcwd()
-    try:
-        os.chdir(cwd)
-        yield
-    finally:
-        os.chdir(previous_cwd)
+    with attached(current().with_cwd(cwd)) as context:
+        yield context
 
 
 @contextlib.contextmanager
-def unset_variable(variable: str) -> None:
+def unset_variable(variable: str) -> ExecutionContext:
     """
     Unset the provided variable for the context scope only. It has no effect if the variable is not already defined.
 
     :param variable: name of the variable to unset. When leaving the context, the variable is restored.
+    :return: the context of the current thread within the scope.
     """
-    with unset_variables([variable]):
-        yield
+    with unset_variables([variable]) as context:
+        yield context
 
 
 @contextlib.contextmanager
-def unset_variables(variables: List[str]) -> None:
+def unset_variables(variables: List[str]) -> ExecutionContext:
     """
     Unset the provided variables for the context scope only. It has no effect on variables which are not already
     defined.
 
     :param variables: list of the variables to unset. When leaving the context, the variables are restored to what they
                       were.
+    :return: the context of the current thread within the scope.
     """
-    previous_variables = dict()
-    for variable in variables:
-        previous_variables[variable] = os.environ.get(variable)
-    try:
-        for variable in variables:
-            if previous_variables[variable] is not None:  # None means the variable was not defined at all.
-                del os.environ[variable]
-        yield
-    finally:
-        for variable in variables:
-            if previous_variables[variable] is not None:
-                os.environ[variable] = previous_variables[variable]
+    with attached(current().without_variables(variables)) as context:
+        yield context
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import contextlib
+import itertools
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+from commandline import DaemonCommandLineInterface
+from configuration import Configuration
+from repo import RepoAdapter
+from sanity import SanityChecks
+from typing import Dict, Iterator, List
+
+
+class _ResourcePool(object):
+    """
+    Cores and memory (in GiB) shared by all the jobs of the host. Jobs wait until the resources they need are free.
+    """
+
+    def __init__(self, cores: int, memory: int) -> None:
+        self._available_cores = cores
+        self._available_memory = memory
+        self._condition = threading.Condition()
+        self._cores = cores
+        self._memory = memory
+
+    @contextlib.contextmanager
+    def reserve(self, cores: int, memory: int) -> None:
+        # A job cannot need more than the whole host.
+        cores = min(cores, self._cores)
+        memory = min(memory, self._memory)
+        with self._condition:
+            self._condition.wait_for(lambda: self._available_cores >= cores and self._available_memory >= memory)
+            self._available_cores -= cores
+            self._available_memory -= memory
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._available_cores += cores
+                self._available_memory += memory
+                self._condition.notify_all()
+
+
+class Job(object):
+    """
+    A :class:`Job` is a command run on an AOSP tree on behalf of a client of the :class:`BuildDaemon`. Its output is
+    written to a log file which clients can follow while the job runs.
+    """
+
+    BUILD = 'build'
+    SIGN = 'sign'
+    SYNC = 'sync'
+    KINDS = [BUILD, SIGN, SYNC]
+
+    STATE_FAILED = 'failed'
+    STATE_QUEUED = 'queued'
+    STATE_RUNNING = 'running'
+    STATE_SUCCEEDED = 'succeeded'
+
+    def __init__(self, job_id: int, kind: str, tree_path: str, arguments: List[str], cores: int, memory: int,
+                 log_path: str) -> None:
+        self._arguments = arguments
+        self._condition = threading.Condition()
+        self._cores = cores
+        self._end_time = 0
+        self._id = job_id
+        self._kind = kind
+        self._log_path = log_path
+        self._memory = memory
+        self._process = None
+        self._return_code = None
+        self._start_time = 0
+        self._state = Job.STATE_QUEUED
+        self._tree_path = tree_path
+
+        open(self._log_path, 'w').close()
+
+    def arguments(self) -> List[str]:
+        return self._arguments
+
+    def cores(self) -> int:
+        return self._cores
+
+    def fail(self, error: str) -> None:
+        """
+        Mark the job as failed without it having run to completion (e.g. its command could not be made).
+        """
+        with open(self._log_path, 'a') as log_file:
+            log_file.write('{}\n'.format(error))
+        with self._condition:
+            self._end_time = time.time()
+            self._return_code = -1
+            self._state = Job.STATE_FAILED
+            self._condition.notify_all()
+
+    def follow(self) -> Iterator[str]:
+        """
+        Read the output of the job, waiting for new lines until the job is done.
+        """
+        with open(self._log_path, 'rb') as log_file:
+            line = b''
+            while True:
+                line += log_file.readline()
+                if line.endswith(b'\n'):
+                    yield line.decode(errors='replace')
+                    line = b''
+                    continue
+
+                # End of the file: everything has been read if the job is done, otherwise wait for more.
+                with self._condition:
+                    if self.is_done():
+                        line += log_file.read()
+                        if line:
+                            yield line.decode(errors='replace')
+                        return
+                    self._condition.wait(1)
+
+    def id(self) -> int:
+        return self._id
+
+    def is_done(self) -> bool:
+        return self._state in [Job.STATE_FAILED, Job.STATE_SUCCEEDED]
+
+    def kind(self) -> str:
+        return self._kind
+
+    def memory(self) -> int:
+        return self._memory
+
+    def return_code(self) -> int:
+        return self._return_code
+
+    def run(self, command: List[str]) -> None:
+        with self._condition:
+            self._start_time = time.time()
+            self._state = Job.STATE_RUNNING
+        with open(self._log_path, 'a') as log_file:
+            log_file.write('$ {}\n'.format(' '.join(command)))
+            log_file.flush()
+            try:
+                self._process = subprocess.Popen(command, cwd=self._tree_path, stdin=subprocess.DEVNULL,
+                                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                for line in self._process.stdout:
+                    log_file.write(line.decode(errors='replace'))
+                    log_file.flush()
+                    with self._condition:
+                        self._condition.notify_all()
+                return_code = self._process.wait()
+            except OSError as error:
+                log_file.write('{}\n'.format(error))
+                return_code = -1
+        with self._condition:
+            self._end_time = time.time()
+            self._return_code = return_code
+            self._state = Job.STATE_SUCCEEDED if return_code == 0 else Job.STATE_FAILED
+            self._condition.notify_all()
+
+    def state(self) -> str:
+        return self._state
+
+    def terminate(self) -> None:
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+
+    def to_dict(self) -> Dict[str, object]:
+        duration = (self._end_time or time.time()) - self._start_time if self._start_time else 0
+        return {
+            'id': self._id,
+            'kind': self._kind,
+            'tree': self._tree_path,
+            'arguments': self._arguments,
+            'cores': self._cores,
+            'memory': self._memory,
+            'state': self._state,
+            'return_code': self._return_code,
+            'duration': round(duration, 1)
+        }
+
+    def tree_path(self) -> str:
+        return self._tree_path
+
+
+class BuildDaemon(object):
+    """
+    A :class:`BuildDaemon` runs build, sign and sync jobs submitted by clients through a local Unix socket. Jobs on the
+    same AOSP tree run one after the other, in the order they were submitted. Jobs on different trees run in parallel,
+    as long as the cores and memory they need fit in the budget of the host.
+
+    The protocol is one JSON request per connection, answered by JSON lines (see :class:`BuildDaemonClient`).
+    """
+
+    def __init__(self, configuration: Configuration) -> None:
+        self._configuration = configuration
+        self._job_ids = itertools.count(1)
+        self._jobs = dict()
+        self._lock = threading.Lock()
+        self._queues = dict()
+        self._resources = _ResourcePool(BuildDaemon._max_cores(configuration), BuildDaemon._max_memory(configuration))
+
+    def job(self, job_id: int) -> Job:
+        with self._lock:
+            if job_id not in self._jobs:
+                raise ValueError('Invalid job: {}'.format(job_id))
+            return self._jobs[job_id]
+
+    def jobs(self) -> List[Job]:
+        with self._lock:
+            return [self._jobs[job_id] for job_id in sorted(self._jobs)]
+
+    def serve(self) -> None:
+        daemon = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                try:
+                    request = json.loads(self.rfile.readline().decode())
+                    for response in daemon._handle(request):
+                        self.wfile.write((json.dumps(response) + '\n').encode())
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The client went away, the job keeps running.
+                except (KeyError, ValueError) as error:
+                    self.wfile.write((json.dumps({'event': 'error', 'message': str(error)}) + '\n').encode())
+
+        socket_path = self._configuration.daemon_socket_path()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        if not os.path.isdir(self._configuration.daemon_logs_path()):
+            os.makedirs(self._configuration.daemon_logs_path())
+
+        server = socketserver.ThreadingUnixStreamServer(socket_path, RequestHandler)
+        server.daemon_threads = True
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.remove(socket_path)
+            for job in self.jobs():
+                job.terminate()
+
+    def submit(self, kind: str, tree_path: str, arguments: List[str], cores: int=0) -> Job:
+        if kind not in Job.KINDS:
+            raise ValueError('Invalid job kind: {}'.format(kind))
+        if not os.path.isdir(tree_path):
+            raise ValueError('Path "{}" does not exist'.format(tree_path))
+
+        memory = {
+            Job.BUILD: self._configuration.daemon_build_memory(),
+            Job.SIGN: self._configuration.daemon_sign_memory(),
+            Job.SYNC: self._configuration.daemon_sync_memory()
+        }[kind]
+        with self._lock:
+            # Jobs without a number of cores share the budget with the other trees, so that one of them does not hold
+            # all the cores while the others wait.
+            if kind == Job.SIGN:
+                cores = 1
+            elif not cores:
+                active_trees = set(self._queues) | {os.path.realpath(tree_path)}
+                cores = max(1, BuildDaemon._max_cores(self._configuration) // len(active_trees))
+
+            job_id = next(self._job_ids)
+            log_path = os.path.join(self._configuration.daemon_logs_path(), '{}-{}.log'.format(job_id, kind))
+            job = Job(job_id, kind, os.path.realpath(tree_path), arguments, cores, memory, log_path)
+            self._jobs[job_id] = job
+
+            # One worker per tree runs its jobs in order. It is started with the first job of the tree, and stops once
+            # the queue of the tree is empty.
+            queue = self._queues.setdefault(job.tree_path(), list())
+            queue.append(job)
+            if len(queue) == 1:
+                threading.Thread(target=self._run_tree_queue, args=(job.tree_path(),), daemon=True).start()
+
+        return job
+
+    def _command(self, job: Job) -> List[str]:
+        tools_path = os.path.dirname(os.path.realpath(__file__))
+        if job.kind() == Job.BUILD:
+            return [sys.executable, os.path.join(tools_path, 'aospbuild.py'), '-y', '-w', job.tree_path(), '-c',
+                    str(job.cores())] + job.arguments()
+        elif job.kind() == Job.SIGN:
+            return [sys.executable, os.path.join(tools_path, 'sign.py'), '-w', job.tree_path()] + job.arguments()
+        else:
+            return RepoAdapter.sync_command(job.cores(), self._configuration.repo_only_current_branch(),
+                                            self._configuration.repo_no_tags()) + job.arguments()
+
+    def _handle(self, request: Dict[str, object]) -> Iterator[Dict[str, object]]:
+        command = request['command']
+        if command == 'submit':
+            job = self.submit(request['kind'], request['tree'], request.get('arguments', list()),
+                              request.get('cores', 0))
+            yield {'event': 'job', 'job': job.to_dict()}
+        elif command == 'list':
+            for job in self.jobs():
+                yield {'event': 'job', 'job': job.to_dict()}
+            return
+        elif command == 'follow':
+            job = self.job(request['id'])
+        else:
+            raise ValueError('Invalid command: {}'.format(command))
+
+        if request.get('follow', True):
+            for line in job.follow():
+                yield {'event': 'log', 'line': line}
+            yield {'event': 'done', 'job': job.to_dict()}
+
+    @staticmethod
+    def _max_cores(configuration: Configuration) -> int:
+        return configuration.daemon_max_cores() or os.cpu_count()
+
+    @staticmethod
+    def _max_memory(configuration: Configuration) -> int:
+        # In GiB.
+        return configuration.daemon_max_memory() or \
+            os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 1024 ** 3
+
+    def _run_tree_queue(self, tree_path: str) -> None:
+        while True:
+            with self._lock:
+                job = self._queues[tree_path][0]
+            # Whatever happens to a job, the next ones on the tree must not stay queued forever.
+            try:
+                with self._resources.reserve(job.cores(), job.memory()):
+                    job.run(self._command(job))
+            except Exception as exception:
+                job.fail(str(exception) or type(exception).__name__)
+            finally:
+                with self._lock:
+                    self._queues[tree_path].pop(0)
+                    done = not self._queues[tree_path]
+                    if done:
+                        del self._queues[tree_path]
+            if done:
+                return
+
+
+class BuildDaemonClient(object):
+    """
+    Talk to a :class:`BuildDaemon` through its socket.
+    """
+
+    def __init__(self, socket_path: str) -> None:
+        self._socket_path = socket_path
+
+    @staticmethod
+    def description(job: Dict[str, object]) -> str:
+        return '#{id} {kind:5} {state:9} {duration:>8}s  {tree} {arguments}'.format(
+            **dict(job, arguments=' '.join(job['arguments'])))
+
+    def follow(self, job_id: int) -> Iterator[Dict[str, object]]:
+        return self._request({'command': 'follow', 'id': job_id})
+
+    def jobs(self) -> Iterator[Dict[str, object]]:
+        return self._request({'command': 'list'})
+
+    def submit(self, kind: str, tree_path: str, arguments: List[str], cores: int=0,
+               follow: bool=True) -> Iterator[Dict[str, object]]:
+        return self._request({'command': 'submit', 'kind': kind, 'tree': tree_path, 'arguments': arguments,
+                              'cores': cores, 'follow': follow})
+
+    def _request(self, request: Dict[str, object]) -> Iterator[Dict[str, object]]:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+            client_socket.connect(self._socket_path)
+            client_socket.sendall((json.dumps(request) + '\n').encode())
+            with client_socket.makefile('rb') as responses:
+                for response in responses:
+                    yield json.loads(response.decode())
+
+
+def main() -> None:
+    SanityChecks.run()
+
+    configuration = Configuration()
+    cli = DaemonCommandLineInterface(configuration)
+    if cli.action() == DaemonCommandLineInterface.SERVE:
+        BuildDaemon(configuration).serve()
+        return
+
+    client = BuildDaemonClient(configuration.daemon_socket_path())
+    if cli.action() == DaemonCommandLineInterface.LIST:
+        responses = client.jobs()
+    elif cli.action() == DaemonCommandLineInterface.FOLLOW:
+        responses = client.follow(cli.job_id())
+    else:
+        responses = client.submit(cli.action(), cli.path(), cli.arguments(), cli.num_cores(), not cli.detach())
+
+    return_code = 0
+    for response in responses:
+        if response['event'] == 'log':
+            sys.stdout.write(response['line'])
+            sys.stdout.flush()
+        elif response['event'] == 'job':
+            print(BuildDaemonClient.description(response['job']))
+        elif response['event'] == 'done':
+            print(BuildDaemonClient.description(response['job']))
+            return_code = response['job']['return_code']
+        else:
+            print(response['message'], file=sys.stderr)
+            return_code = os.EX_USAGE
+    sys.exit(return_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -25,37 +25,150 @@
 # SOFTWARE.
 #
 
+import os
 import subprocess
+import tempfile
 
-from typing import List
+from fastboottcp import FastbootTCPClient
+from imagearchive import ArchiveImage
+from typing import Callable, Dict, List
 
 
 class FastbootAdapter(object):
     """
-    Provides utility functions for issuing fastboot commands.
+    Provides utility functions for issuing fastboot commands. When a serial is given, commands are issued to this device
+    only, otherwise to the only device connected.
+
+    Devices connected over USB are driven through the ``fastboot`` binary. Devices reached over the network (serials of
+    the form ``tcp:host[:port]``) are driven by a :class:`fastboottcp.FastbootTCPClient`, which keeps its session open
+    between commands.
     """
 
+    _BOOTLOADER_PREFIX = '(bootloader)'
     _FASTBOOT = 'fastboot'
 
+    # Partitions wiped by "fastboot -w", where the device has them.
+    _WIPED_PARTITIONS = ('userdata', 'cache', 'metadata')
+
     @staticmethod
     def devices() -> List[str]:
         return subprocess.check_output([FastbootAdapter._FASTBOOT, 'devices']).decode().strip().splitlines()
 
     @staticmethod
-    def erase(partition_name: str) -> int:
-        return subprocess.check_call([FastbootAdapter._FASTBOOT, 'erase', partition_name])
+    def erase(partition_name: str, serial: str='') -> int:
+        if FastbootTCPClient.is_tcp_serial(serial):
+            return FastbootAdapter._tcp_call(serial, lambda client: client.erase(partition_name))
+        return subprocess.check_call(FastbootAdapter._command(serial, 'erase', partition_name))
+
+    @staticmethod
+    def flash(partition_name: str, image_path: str, serial: str='') -> int:
+        if FastbootTCPClient.is_tcp_serial(serial):
+            return FastbootAdapter._tcp_call(serial, lambda client: client.flash(partition_name, image_path))
+        return subprocess.check_call(FastbootAdapter._command(serial, 'flash', partition_name, image_path))
+
+    @staticmethod
+    def flash_archive_image(partition_name: str, image: ArchiveImage, serial: str='') -> int:
+        """
+        Flash an image straight out of its archive. Over TCP, the image is streamed to the device as it is read. The
+        binary only flashes files of a known size, so the image is extracted to a temporary file first (one image at a
+        time).
+        """
+        if FastbootTCPClient.is_tcp_serial(serial):
+            return FastbootAdapter._tcp_call(serial, lambda client: client.flash_stream(
+                partition_name, str(image), image.size(), image.chunks()))
+        with tempfile.TemporaryDirectory() as image_directory:
+            image_path = os.path.join(image_directory, os.path.basename(image.name()))
+            image.extract(image_path)
+            return FastbootAdapter.flash(partition_name, image_path, serial)
 
     @staticmethod
-    def flash(partition_name: str, image_path: str) -> int:
-        return subprocess.check_call([FastbootAdapter._FASTBOOT, 'flash', partition_name, image_path])
+    def getvar(name: str, serial: str='') -> str:
+        """
+        :return: the value of a bootloader variable, or an empty string if the bootloader does not know it.
+        """
+        if FastbootTCPClient.is_tcp_serial(serial):
+            return FastbootAdapter._tcp_call(serial, lambda client: client.getvar(name))
+
+        # Fastboot prints the variables on the error output, as "name: value".
+        try:
+            output = subprocess.check_output(FastbootAdapter._command(serial, 'getvar', name),
+                                             stderr=subprocess.STDOUT).decode()
+        except subprocess.CalledProcessError:
+            return ''
+        for line in output.splitlines():
+            if line.startswith('{}:'.format(name)):
+                return line.split(':', 1)[1].strip()
+        return ''
+
+    @staticmethod
+    def getvars(serial: str='') -> Dict[str, str]:
+        """
+        :return: all the bootloader variables at once, by name (e.g. "partition-size:system_a").
+        """
+        if FastbootTCPClient.is_tcp_serial(serial):
+            return FastbootAdapter._tcp_call(serial, lambda client: client.getvars())
+
+        # Fastboot prints the variables on the error output, as "(bootloader) name: value".
+        output = subprocess.check_output(FastbootAdapter._command(serial, 'getvar', 'all'),
+                                         stderr=subprocess.STDOUT).decode()
+        variables = dict()
+        for line in output.splitlines():
+            line = line.strip()
+            if line.startswith(FastbootAdapter._BOOTLOADER_PREFIX) and ': ' in line:
+                name, value = line[len(FastbootAdapter._BOOTLOADER_PREFIX):].strip().rsplit(': ', 1)
+                variables[name] = value
+        return variables
 
     @staticmethod
-    def reboot(bootloader: bool=False) -> int:
-        cmd = [FastbootAdapter._FASTBOOT, 'reboot']
+    def max_download_size(serial: str='') -> int:
+        """
+        :return: the maximum size of the data the device accepts at once, or 0 if unknown.
+        """
+        try:
+            return int(FastbootAdapter.getvar('max-download-size', serial), 0)
+        except ValueError:
+            return 0
+
+    @staticmethod
+    def reboot(bootloader: bool=False, serial: str='') -> int:
+        if FastbootTCPClient.is_tcp_serial(serial):
+            # The device drops the connection, the next command will open a new session.
+            FastbootAdapter._tcp_call(serial, lambda client: client.reboot(bootloader))
+            FastbootTCPClient.drop_session(serial)
+            return 0
+        cmd = FastbootAdapter._command(serial, 'reboot')
         if bootloader:
             cmd.append('bootloader')
         return subprocess.check_call(cmd)
 
     @staticmethod
-    def wipe_userdata() -> int:
-        return subprocess.check_call([FastbootAdapter._FASTBOOT, '-w'])
+    def serials() -> List[str]:
+        # Lines are made of the serial and the state of the device, separated by a tab.
+        return [device.split()[0] for device in FastbootAdapter.devices() if device.strip()]
+
+    @staticmethod
+    def wipe_userdata(serial: str='') -> int:
+        if FastbootTCPClient.is_tcp_serial(serial):
+            # Unlike the binary, the partitions are erased but not formatted: Android formats them on boot. The user data
+            # partition is always erased, the others only if the device has them (i.e. reports their type).
+            def wipe(client: FastbootTCPClient) -> None:
+                for partition_name in FastbootAdapter._WIPED_PARTITIONS:
+                    if partition_name == 'userdata' or client.getvar('partition-type:{}'.format(partition_name)):
+                        client.erase(partition_name)
+
+            return FastbootAdapter._tcp_call(serial, wipe)
+        return subprocess.check_call(FastbootAdapter._command(serial, '-w'))
+
+    @staticmethod
+    def _command(serial: str, *args: str) -> List[str]:
+        return [FastbootAdapter._FASTBOOT] + (['-s', serial] if serial else []) + list(args)
+
+    @staticmethod
+    def _tcp_call(serial: str, call: Callable[[FastbootTCPClient], object]) -> object:
+        # A broken session is dropped, so that the next command connects again. Commands return 0 like the binary.
+        try:
+            result = call(FastbootTCPClient.session(serial))
+        except OSError:
+            FastbootTCPClient.drop_session(serial)
+            raise
+        return 0 if result is None else result
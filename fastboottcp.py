@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+from typing import Callable, Dict, Iterable, List, Tuple
+
+
+class FastbootTCPClient(object):
+    """
+    Talk the fastboot protocol to a device over TCP, without spawning the ``fastboot`` binary. A client keeps its
+    connection open, so commands on the same device do not negotiate the session again. Downloaded images are sent
+    straight from the file to the socket (see :meth:`socket.socket.sendfile`) rather than read into memory, or streamed
+    as they are read when they are not files (see :meth:`download_stream`).
+
+    Devices are designated by serials of the form ``tcp:host[:port]``, like with the ``fastboot`` binary. One session is
+    kept per serial, see :meth:`session`.
+
+    See ``system/core/fastboot/README.md`` for the protocol: a handshake, then packets prefixed by their length.
+    """
+
+    DEFAULT_PORT = 5554
+    SERIAL_PREFIX = 'tcp:'
+
+    _HANDSHAKE = b'FB01'
+    _LENGTH_FORMAT = '>Q'
+    _LENGTH_SIZE = struct.calcsize(_LENGTH_FORMAT)
+    _MAX_RESPONSE_SIZE = 256
+
+    _sessions = dict()
+    _sessions_lock = threading.Lock()
+    _serial_locks = dict()
+
+    def __init__(self, host: str, port: int=DEFAULT_PORT, timeout_sec: float=60,
+                 command_timeout_sec: float=None) -> None:
+        """
+        :param timeout_sec: time given to the device to accept the connection and answer the handshake.
+        :param command_timeout_sec: time given to the device to answer a command, or None to wait forever. Flashing or
+                                    erasing a large partition takes minutes, during which the device sends nothing.
+        """
+        self._lock = threading.Lock()
+        self._max_download_size = None
+        self._socket = socket.create_connection((host, port), timeout_sec)
+        try:
+            self._socket.sendall(FastbootTCPClient._HANDSHAKE)
+            handshake = self._receive(len(FastbootTCPClient._HANDSHAKE))
+            if handshake[:2] != FastbootTCPClient._HANDSHAKE[:2] or not handshake[2:].isdigit() or \
+                    int(handshake[2:]) < 1:
+                raise ConnectionError('Invalid fastboot handshake: {}'.format(handshake))
+            self._socket.settimeout(command_timeout_sec)
+        except BaseException:
+            self._socket.close()
+            raise
+
+    def close(self) -> None:
+        self._socket.close()
+
+    def command(self, command: str) -> str:
+        """
+        Issue a command and wait for it to complete. Information sent by the device meanwhile is printed.
+
+        :return: the message of the final response.
+        """
+        with self._lock:
+            self._send_packet(command.encode())
+            return self._response()
+
+    def download(self, path: str) -> None:
+        with open(path, 'rb') as data_file:
+            self._download(path, os.path.getsize(path), lambda: self._socket.sendfile(data_file))
+
+    def download_stream(self, name: str, size: int, chunks: Iterable[bytes]) -> None:
+        """
+        Download data produced on the fly (e.g. read out of an archive), without writing it to a file first.
+
+        :param name: name of the data, for the error messages.
+        :param size: size of the data, which the device needs up front.
+        :param chunks: the data, piece by piece.
+        """
+        def send() -> None:
+            sent_size = 0
+            for chunk in chunks:
+                self._socket.sendall(chunk)
+                sent_size += len(chunk)
+            if sent_size != size:
+                # The device still waits for data, the session cannot be used anymore.
+                raise ConnectionError('"{}" is {} bytes instead of {}'.format(name, sent_size, size))
+
+        self._download(name, size, send)
+
+    def erase(self, partition_name: str) -> None:
+        self.command('erase:{}'.format(partition_name))
+
+    def flash(self, partition_name: str, image_path: str) -> None:
+        self.download(image_path)
+        self.command('flash:{}'.format(partition_name))
+
+    def flash_stream(self, partition_name: str, name: str, size: int, chunks: Iterable[bytes]) -> None:
+        self.download_stream(name, size, chunks)
+        self.command('flash:{}'.format(partition_name))
+
+    def getvar(self, name: str) -> str:
+        try:
+            return self.command('getvar:{}'.format(name))
+        except RuntimeError:
+            return ''
+
+    def getvars(self) -> Dict[str, str]:
+        """
+        :return: all the bootloader variables at once, by name (e.g. "partition-size:system_a").
+        """
+        # The bootloader sends the variables as information, as "name: value".
+        information = list()
+        with self._lock:
+            self._send_packet(b'getvar:all')
+            self._response(information=information)
+        return dict(line.rsplit(': ', 1) for line in information if ': ' in line)
+
+    def max_download_size(self) -> int:
+        # It is only asked once per session.
+        if self._max_download_size is None:
+            try:
+                self._max_download_size = int(self.getvar('max-download-size'), 0)
+            except ValueError:
+                self._max_download_size = 0
+        return self._max_download_size
+
+    def reboot(self, bootloader: bool=False) -> None:
+        # The device drops the connection when rebooting.
+        self.command('reboot-bootloader' if bootloader else 'reboot')
+        self.close()
+
+    @staticmethod
+    def address(serial: str) -> Tuple[str, int]:
+        host, _, port = serial[len(FastbootTCPClient.SERIAL_PREFIX):].partition(':')
+        return host, int(port) if port else FastbootTCPClient.DEFAULT_PORT
+
+    @staticmethod
+    def drop_session(serial: str) -> None:
+        with FastbootTCPClient._sessions_lock:
+            client = FastbootTCPClient._sessions.pop(serial, None)
+        if client:
+            client.close()
+
+    @staticmethod
+    def is_tcp_serial(serial: str) -> bool:
+        return serial.startswith(FastbootTCPClient.SERIAL_PREFIX)
+
+    @staticmethod
+    def session(serial: str) -> 'FastbootTCPClient':
+        """
+        :param serial: serial of the device, as ``tcp:host[:port]``.
+        :return: the client connected to the device, connecting to it first if needed.
+        """
+        # Connecting may take up to the timeout: only the sessions with the same device wait for it.
+        with FastbootTCPClient._sessions_lock:
+            serial_lock = FastbootTCPClient._serial_locks.setdefault(serial, threading.Lock())
+        with serial_lock:
+            with FastbootTCPClient._sessions_lock:
+                client = FastbootTCPClient._sessions.get(serial)
+            if client is None:
+                client = FastbootTCPClient(*FastbootTCPClient.address(serial))
+                with FastbootTCPClient._sessions_lock:
+                    FastbootTCPClient._sessions[serial] = client
+            return client
+
+    def _download(self, name: str, size: int, send: Callable[[], None]) -> None:
+        max_size = self.max_download_size()
+        if max_size and size > max_size:
+            raise ValueError('"{}" is larger than the maximum download size of the device ({} bytes), sparse it first '
+                             '(see sparseimage.py)'.format(name, max_size))
+
+        with self._lock:
+            self._send_packet('download:{:08x}'.format(size).encode())
+            data_size = int(self._response(b'DATA'), 16)
+            if data_size != size:
+                raise ConnectionError('The device expects {} bytes instead of {}'.format(data_size, size))
+            self._socket.sendall(struct.pack(FastbootTCPClient._LENGTH_FORMAT, size))
+            send()
+            self._response()
+
+    def _receive(self, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            buffer = self._socket.recv(size - len(data))
+            if not buffer:
+                raise ConnectionError('The device closed the connection')
+            data.extend(buffer)
+        return bytes(data)
+
+    def _receive_packet(self) -> bytes:
+        size = struct.unpack(FastbootTCPClient._LENGTH_FORMAT, self._receive(FastbootTCPClient._LENGTH_SIZE))[0]
+        if size > FastbootTCPClient._MAX_RESPONSE_SIZE:
+            raise ConnectionError('Response of {} bytes from the device'.format(size))
+        return self._receive(size)
+
+    def _response(self, expected_status: bytes=b'OKAY', information: List[str]=None) -> str:
+        # Information is printed, unless a list is given for collecting it.
+        while True:
+            packet = self._receive_packet()
+            status, message = packet[:4], packet[4:].decode(errors='replace')
+            if status == b'INFO' and information is not None:
+                information.append(message)
+            elif status == b'INFO':
+                print('(device) {}'.format(message))
+            elif status == b'TEXT':
+                sys.stdout.write(message)
+            elif status == b'FAIL':
+                raise RuntimeError('The device failed: {}'.format(message))
+            elif status == expected_status:
+                return message
+            else:
+                raise ConnectionError('Unexpected response from the device: {}'.format(packet))
+
+    def _send_packet(self, data: bytes) -> None:
+        self._socket.sendall(struct.pack(FastbootTCPClient._LENGTH_FORMAT, len(data)) + data)
@@ -25,60 +25,387 @@
 # SOFTWARE.
 #
 
+import concurrent.futures
+import functools
+import json
 import os
 import sys
+import tempfile
+import threading
+import time
 
 from adb import ADBAdapter
+from boottimes import BootTimes
+from cache import ArtifactCache
 from commandline import FlasherCommandLineInterface
 from configuration import Configuration
 from fastboot import FastbootAdapter
+from fastboottcp import FastbootTCPClient
+from imagearchive import ArchiveImage, ImageArchive
+from inventory import DeviceInventory
 from sanity import SanityChecks
+from sparseimage import SparseImage
+from typing import Callable, Dict, List, Tuple, Union
+
+
+class FlashRegistry(object):
+    """
+    Record which images were flashed on which device, by content hash, so that partitions already holding an image are
+    not flashed again.
+
+    A record alone cannot be trusted: the device may have been flashed by other means since. So the properties of the
+    device are recorded once it booted with the flashed images, and a record is only used if the device still reports
+    the same properties. A device in the bootloader cannot report them, only its active slot is checked then.
+    """
+
+    # Properties identifying what a device runs: the build of the system, the digest of the vbmeta images computed by
+    # the bootloader, and the active slot.
+    _PROPERTIES = ('ro.boot.slot_suffix', 'ro.boot.vbmeta.digest', 'ro.build.fingerprint')
+
+    def __init__(self, path: str, inventory: DeviceInventory=None) -> None:
+        """
+        :param inventory: where to get the properties of the devices from.
+        """
+        self._hashes = dict()
+        self._inventory = inventory or DeviceInventory()
+        self._lock = threading.Lock()
+        self._path = path
+
+    def forget(self, serial: str) -> None:
+        with self._lock:
+            records = self._read()
+            if records.pop(serial, None) is not None:
+                self._write(records)
+
+    def hash_image(self, image: Union[str, ArchiveImage]) -> str:
+        """
+        :param image: path to the image, or the image in its archive.
+        """
+        # Images are hashed once even when flashed on several devices.
+        archived = isinstance(image, ArchiveImage)
+        image_stat = os.stat(image.archive_path() if archived else image)
+        hash_key = (str(image), image_stat.st_size, image_stat.st_mtime_ns)
+        with self._lock:
+            if hash_key not in self._hashes:
+                self._hashes[hash_key] = image.hash() if archived else ArtifactCache.hash_file(image)
+            return self._hashes[hash_key]
+
+    def record(self, serial: str, images: Dict[str, Union[str, ArchiveImage]]) -> None:
+        """
+        Record the images flashed on a device, which must be booted.
+
+        :param images: the images on the device, by partition (see :meth:`hash_image`).
+        """
+        device = self._inventory.device(serial)
+        if device is None or not device.booted():
+            raise RuntimeError('Device "{}" is not booted'.format(serial))
+        properties = device.properties()
+        record = {
+            'images': dict((partition, self.hash_image(image)) for partition, image in images.items()),
+            'properties': dict((name, properties.get(name, '')) for name in FlashRegistry._PROPERTIES)
+        }
+        with self._lock:
+            records = self._read()
+            records[serial] = record
+            self._write(records)
+
+    def unchanged(self, serial: str, images: Dict[str, Union[str, ArchiveImage]]) -> List[str]:
+        """
+        :param images: the images to flash, by partition (see :meth:`hash_image`).
+        :return: the partitions which already hold their image.
+        """
+        with self._lock:
+            record = self._read().get(serial)
+        device = self._inventory.device(serial)
+        if not record or not record['properties'] or device is None:
+            return list()
+
+        if device.booted():
+            properties = device.properties()
+            if any(properties.get(name, '') != value for name, value in record['properties'].items()):
+                return list()
+        elif not device.in_bootloader() or \
+                device.slot() != record['properties'].get('ro.boot.slot_suffix', '').lstrip('_'):
+            return list()
+
+        return sorted(partition for partition, image in images.items()
+                      if record['images'].get(partition) == self.hash_image(image))
+
+    def _read(self) -> Dict[str, dict]:
+        try:
+            with open(self._path) as registry_file:
+                return json.load(registry_file)
+        except FileNotFoundError:
+            return dict()
+
+    def _write(self, records: Dict[str, dict]) -> None:
+        if not os.path.isdir(os.path.dirname(self._path)):
+            os.makedirs(os.path.dirname(self._path))
+        temp_path = '{}.tmp'.format(self._path)
+        with open(temp_path, 'w') as registry_file:
+            json.dump(records, registry_file, indent=2, sort_keys=True)
+        os.replace(temp_path, self._path)
+
+
+class _ExtractedImages(object):
+    """
+    Archived images extracted to a directory, each at most once. The ``fastboot`` binary only flashes files, so devices
+    it drives share the extracted images rather than extracting them each.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._paths = dict()
+
+    def path(self, image: ArchiveImage) -> str:
+        # A single lock: the devices flashed at the same time need the same images in the same order anyway.
+        with self._lock:
+            if str(image) not in self._paths:
+                image_path = os.path.join(self._directory, os.path.basename(image.name()))
+                image.extract(image_path)
+                self._paths[str(image)] = image_path
+            return self._paths[str(image)]
 
 
 class Flasher(object):
     """
-    Flash a ``system`` image and its ``vbmeta`` image on a device. It is meant for signed GSIs along with stock images.
-    Note that this will wipe all the user data.
+    Flash images on a device, typically a ``system`` image and its ``vbmeta`` image (signed GSIs along with stock
+    images) or all the images of a ``*-signed_img-*.zip``. Note that this will wipe all the user data.
+
+    Images are given by partition, either as paths or as :class:`imagearchive.ArchiveImage`. The latter are flashed
+    straight out of their archive over TCP, see :meth:`fastboot.FastbootAdapter.flash_archive_image`. Otherwise they are
+    extracted once for all the devices flashed.
+
+    Several devices can be flashed at the same time, see :meth:`flash_devices`. When given a :class:`FlashRegistry`,
+    partitions already holding their image are skipped, and the user data is kept if the system is not flashed. When
+    given a :class:`boottimes.BootTimes`, the boot following the flash is timed phase by phase.
     """
 
-    @staticmethod
-    def flash(system_image_path: str, vbmeta_image_path: str) -> None:
-        if ADBAdapter.devices():
-            ADBAdapter.reboot('bootloader')
-        FastbootAdapter.erase('system')
-        FastbootAdapter.erase('vbmeta')
-        FastbootAdapter.wipe_userdata()
-        FastbootAdapter.flash('system', system_image_path)
-        FastbootAdapter.flash('vbmeta', vbmeta_image_path)
-        FastbootAdapter.reboot()
+    def __init__(self, registry: FlashRegistry=None, boot_times: BootTimes=None, boot_timeout_sec: float=0,
+                 force: bool=False, inventory: DeviceInventory=None) -> None:
+        """
+        :param registry: registry of the flashed images, only used for devices given by serial.
+        :param boot_times: where to record how long the devices take to boot once flashed.
+        :param boot_timeout_sec: time a device is given to boot once flashed, or 0 to wait forever.
+        :param force: flash all the partitions, even those already holding their image.
+        :param inventory: where to get the state of the devices from.
+        """
+        self._boot_times = boot_times
+        self._boot_timeout_sec = boot_timeout_sec
+        self._force = force
+        self._inventory = inventory or DeviceInventory()
+        self._registry = registry
 
     @staticmethod
-    def description(system_image_path: str, vbmeta_image_path: str) -> str:
+    def description(images: Dict[str, Union[str, ArchiveImage]], serials: List[str]=(),
+                    differential: bool=False) -> str:
         description = list()
         description.append('Notes:')
         description.append('- the device must be unlocked')
         description.append('- the partitions listed below will be erased (make sure you can restore them)')
-        description.append('- the user data will be wiped')
+        if differential:
+            description.append('- partitions already holding their image will be skipped (use -f/--force to flash '
+                               'them anyway)')
+            description.append('- the user data will be wiped if the system is flashed')
+        else:
+            description.append('- the user data will be wiped')
         description.append('- the device will not be relocked automatically once flashed')
         description.append('Will flash:')
-        description.append('- "{}" on partition "system"'.format(system_image_path))
-        description.append('- "{}" on partition "vbmeta"'.format(vbmeta_image_path))
+        for partition in sorted(images):
+            description.append('- "{}" on partition "{}"'.format(images[partition], partition))
+        if serials:
+            description.append('On devices: {}'.format(' '.join(serials)))
         description.append('=' * max(map(len, description)))
         description.insert(0, description[-1])
 
         return '\n'.join(description)
 
+    def flash(self, images: Dict[str, Union[str, ArchiveImage]], serial: str='',
+              sparse_paths: Dict[str, List[str]]=None) -> None:
+        """
+        :param images: the images to flash, by partition.
+        :param serial: serial of the device to flash, or empty for the only device connected.
+        :param sparse_paths: sparse images to flash in place of the images, by partition (see
+                             :class:`sparseimage.SparseImage`).
+        """
+        with tempfile.TemporaryDirectory() as extraction_directory:
+            self._flash(images, serial, sparse_paths, _ExtractedImages(extraction_directory))
+
+    def flash_devices(self, images: Dict[str, Union[str, ArchiveImage]], serials: List[str], max_devices: int,
+                      sparse_paths: Dict[str, List[str]]=None) -> Dict[str, str]:
+        """
+        Flash several devices at the same time. A failure only affects its own device.
+
+        :param serials: serials of the devices to flash.
+        :param max_devices: maximum number of devices flashed at the same time, as they share the bandwidth of the USB
+                            bus.
+        :return: the error of each device which failed, by serial.
+        """
+        def flash_device(serial: str) -> float:
+            start_time = time.time()
+            self._flash(images, serial, sparse_paths, extracted_images)
+            return time.time() - start_time
+
+        durations = dict()
+        errors = dict()
+        with tempfile.TemporaryDirectory() as extraction_directory, \
+                concurrent.futures.ThreadPoolExecutor(max(max_devices, 1)) as executor:
+            extracted_images = _ExtractedImages(extraction_directory)
+            futures = {executor.submit(flash_device, serial): serial for serial in serials}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    durations[futures[future]] = future.result()
+                    print('[{}] Done'.format(futures[future]))
+                except Exception as exception:
+                    errors[futures[future]] = str(exception) or type(exception).__name__
+                    print('[{}] Failed: {}'.format(futures[future], errors[futures[future]]))
+
+        print(Flasher.summary(durations, errors))
+        return errors
+
+    @staticmethod
+    def summary(durations: Dict[str, float], errors: Dict[str, str]) -> str:
+        summary = list()
+        for serial in sorted(set(durations) | set(errors)):
+            summary.append('{:20} {:>6} {}'.format(serial, '{:.0f}s'.format(durations[serial]) if serial in durations
+                                                   else '', 'FAILED: {}'.format(errors[serial]) if serial in errors
+                                                   else 'OK'))
+        summary.append('=' * max(map(len, summary or [''])))
+        summary.insert(0, summary[-1])
+
+        return '\n'.join(summary)
+
+    def _flash(self, images: Dict[str, Union[str, ArchiveImage]], serial: str, sparse_paths: Dict[str, List[str]],
+               extracted_images: _ExtractedImages) -> None:
+        steps = self._steps(images, serial, sparse_paths or dict(), extracted_images)
+        if not steps:
+            print('[{}] All the partitions already hold their image (use -f/--force to flash anyway)'.format(serial))
+        for step, function in steps:
+            if serial:
+                print('[{}] {}'.format(serial, step))
+            function()
+
+    @staticmethod
+    def _flash_archive_image(partition: str, image: ArchiveImage, serial: str,
+                             extracted_images: _ExtractedImages) -> None:
+        if FastbootTCPClient.is_tcp_serial(serial):
+            FastbootAdapter.flash_archive_image(partition, image, serial)
+        else:
+            FastbootAdapter.flash(partition, extracted_images.path(image), serial)
+
+    def _reboot(self, serial: str) -> None:
+        FastbootAdapter.reboot(serial=serial)
+        self._inventory.invalidate(serial)
+
+    def _reboot_to_bootloader(self, serial: str) -> None:
+        # Fastboot commands must not be issued before the device actually left Android.
+        ADBAdapter.reboot('bootloader', serial=serial)
+        ADBAdapter.wait_for_shutdown(serial, self._boot_timeout_sec)
+
+    def _steps(self, images: Dict[str, Union[str, ArchiveImage]], serial: str,
+               sparse_paths: Dict[str, List[str]],
+               extracted_images: _ExtractedImages) -> List[Tuple[str, Callable[[], None]]]:
+        device = self._inventory.device(serial)
+        booted = device is not None and device.booted()
+        registry = self._registry if serial else None
+        partitions = sorted(images)
+        if registry and not self._force:
+            unchanged = registry.unchanged(serial, images)
+            partitions = [partition for partition in partitions if partition not in unchanged]
+            if not partitions:
+                return list()
+
+        steps = list()
+        if booted:
+            steps.append(('Reboot to the bootloader', functools.partial(self._reboot_to_bootloader, serial)))
+        if registry:
+            # The record no longer holds if flashing fails half way.
+            steps.append(('Forget the flashed images', functools.partial(registry.forget, serial)))
+        for partition in partitions:
+            steps.append(('Erase {}'.format(partition), functools.partial(FastbootAdapter.erase, partition, serial)))
+        if 'system' in partitions:
+            steps.append(('Wipe user data', lambda: FastbootAdapter.wipe_userdata(serial)))
+        for partition in partitions:
+            if partition not in sparse_paths and isinstance(images[partition], ArchiveImage):
+                steps.append(('Flash {}'.format(partition), functools.partial(
+                    Flasher._flash_archive_image, partition, images[partition], serial, extracted_images)))
+                continue
+            paths = sparse_paths.get(partition, [images[partition]])
+            for index, path in enumerate(paths, start=1):
+                step = 'Flash {}'.format(partition)
+                if len(paths) > 1:
+                    step += ' ({}/{})'.format(index, len(paths))
+                steps.append((step, functools.partial(FastbootAdapter.flash, partition, path, serial)))
+        steps.append(('Reboot', functools.partial(self._reboot, serial)))
+        if registry or (serial and self._boot_times):
+            steps.append(('Wait for the boot to complete', functools.partial(self._wait_for_boot, serial)))
+        if registry:
+            steps.append(('Record the flashed images', functools.partial(registry.record, serial, images)))
+        return steps
+
+    def _wait_for_boot(self, serial: str) -> None:
+        timeline = ADBAdapter.wait_for_boot_completed(serial, self._boot_timeout_sec)
+        print('[{}] Booted in {:.1f}s ({})'.format(serial, timeline[-1][1], ', '.join(
+            '{} at {:.1f}s'.format(phase, seconds) for phase, seconds in timeline)))
+        if self._boot_times:
+            # The device may have gone away since it booted: its boot is still recorded, without its build.
+            device = self._inventory.device(serial)
+            self._boot_times.add(serial, device.fingerprint() if device else '', timeline)
+
 
 def main() -> None:
     SanityChecks.run()
 
-    cli = FlasherCommandLineInterface(Configuration())
-    print(Flasher.description(cli.system_image_path(), cli.vbmeta_image_path()))
-    if cli.press_enter():
-        Flasher.flash(cli.system_image_path(), cli.vbmeta_image_path())
+    configuration = Configuration()
+    cli = FlasherCommandLineInterface(configuration)
+    inventory = DeviceInventory()
+    serials = [device.serial() for device in inventory.select(cli.product())] if cli.all() else cli.serials()
+    if cli.all() and not serials:
+        print('No device attached' + (' of product "{}"'.format(cli.product()) if cli.product() else ''))
+        sys.exit(1)
+    if cli.image_archive_path():
+        images = ImageArchive(cli.image_archive_path()).images()
+        if not images:
+            print('No image in "{}"'.format(cli.image_archive_path()))
+            sys.exit(1)
     else:
+        images = {'system': cli.system_image_path(), 'vbmeta': cli.vbmeta_image_path()}
+    print(Flasher.description(images, serials, not cli.force()))
+    if not cli.press_enter():
         sys.exit(os.EX_USAGE)  # Set an error code for canceling chained commands.
 
+    with tempfile.TemporaryDirectory() as sparse_directory:
+        # Sparse the images larger than the maximum download size once for all the devices. Images in an archive are
+        # extracted first, as sparse images are made out of files.
+        sparse_paths = dict()
+        for partition, image in sorted(images.items()):
+            archived = isinstance(image, ArchiveImage)
+            if not cli.max_download_size() or \
+                    (image.size() if archived else os.path.getsize(image)) <= cli.max_download_size():
+                continue
+            image_path = image
+            if archived:
+                print('Extracting the {} image'.format(partition))
+                image_path = os.path.join(sparse_directory, os.path.basename(image.name()))
+                image.extract(image_path)
+            if not SparseImage.is_sparse(image_path):
+                print('Sparsing the {} image'.format(partition))
+                sparse_paths[partition] = SparseImage(image_path).split(os.path.join(sparse_directory, partition),
+                                                                        cli.max_download_size())
+            elif archived:
+                sparse_paths[partition] = [image_path]
+
+        flasher = Flasher(FlashRegistry(configuration.flash_registry_path(), inventory),
+                          BootTimes(configuration.flash_boot_times_path()), configuration.flash_boot_timeout_sec(),
+                          cli.force(), inventory)
+        if not serials:
+            # The registry and the boot times need the serial of the device, which is known when there is only one.
+            attached_serials = inventory.serials()
+            flasher.flash(images, attached_serials[0] if len(attached_serials) == 1 else '', sparse_paths)
+        elif flasher.flash_devices(images, serials, cli.max_devices(), sparse_paths):
+            sys.exit(1)
+
 
 if __name__ == '__main__':
     main()
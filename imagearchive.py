@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import hashlib
+import mmap
+import os
+import struct
+import zipfile
+
+from typing import Dict, Iterator
+
+
+class ArchiveImage(object):
+    """
+    An image held by an :class:`ImageArchive`, read from the archive without extracting it. Stored images are read
+    through a memory map of the archive, and handed out as views of it rather than copies. Deflated images are
+    decompressed on the fly.
+    """
+
+    _BUFFER_SIZE = 1024 * 1024
+    _LOCAL_FILE_HEADER_FORMAT = '<4sHHHHHIIIHH'
+
+    def __init__(self, archive_path: str, info: zipfile.ZipInfo) -> None:
+        self._archive_path = archive_path
+        self._info = info
+
+    def __str__(self) -> str:
+        return '{}:{}'.format(self._archive_path, self._info.filename)
+
+    def archive_path(self) -> str:
+        return self._archive_path
+
+    def chunks(self) -> Iterator[bytes]:
+        """
+        :return: the content of the image, piece by piece. A piece is only valid until the next one is requested.
+        """
+        with open(self._archive_path, 'rb') as archive_file:
+            if self._info.compress_type != zipfile.ZIP_STORED:
+                with zipfile.ZipFile(archive_file) as archive, archive.open(self._info) as image_file:
+                    yield from iter(lambda: image_file.read(ArchiveImage._BUFFER_SIZE), b'')
+                return
+
+            with mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ) as archive:
+                # The data follows the local header, whose extra field may differ from the one of the central directory.
+                local_header = struct.unpack_from(ArchiveImage._LOCAL_FILE_HEADER_FORMAT, archive,
+                                                  self._info.header_offset)
+                data_offset = self._info.header_offset + struct.calcsize(ArchiveImage._LOCAL_FILE_HEADER_FORMAT) + \
+                    local_header[9] + local_header[10]
+                # Views must be released before the map is closed.
+                with memoryview(archive) as data:
+                    for offset in range(data_offset, data_offset + self._info.file_size, ArchiveImage._BUFFER_SIZE):
+                        with data[offset:min(offset + ArchiveImage._BUFFER_SIZE,
+                                             data_offset + self._info.file_size)] as chunk:
+                            yield chunk
+
+    def extract(self, path: str) -> None:
+        with open(path, 'wb') as image_file:
+            for chunk in self.chunks():
+                image_file.write(chunk)
+
+    def hash(self) -> str:
+        digest = hashlib.sha256()
+        for chunk in self.chunks():
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def name(self) -> str:
+        return self._info.filename
+
+    def size(self) -> int:
+        return self._info.file_size
+
+
+class ImageArchive(object):
+    """
+    An archive of partition images, like the ``*-signed_img-*.zip`` files produced by :class:`sign.Signer`. Each image
+    at the root of the archive is named after its partition (e.g. ``system.img`` for the partition ``system``).
+    """
+
+    _IMAGE_EXTENSION = '.img'
+
+    # Images which are not flashed as is on a partition of the same name.
+    _NOT_PARTITIONS = ('super_empty',)
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+
+    def images(self) -> Dict[str, ArchiveImage]:
+        """
+        :return: the images of the archive, by partition.
+        """
+        images = dict()
+        with zipfile.ZipFile(self._path) as archive:
+            for info in archive.infolist():
+                partition, extension = os.path.splitext(info.filename)
+                if extension == ImageArchive._IMAGE_EXTENSION and '/' not in partition and \
+                        partition not in ImageArchive._NOT_PARTITIONS:
+                    images[partition] = ArchiveImage(self._path, info)
+        return images
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import concurrent.futures
+import subprocess
+import sys
+import threading
+
+from adb import ADBAdapter
+from commandline import DeviceInventoryCommandLineInterface
+from configuration import Configuration
+from fastboot import FastbootAdapter
+from fastboottcp import FastbootTCPClient
+from sanity import SanityChecks
+from typing import Dict, List
+
+
+class Device(object):
+    """
+    A device attached, either to ADB or to fastboot, as listed by a :class:`DeviceInventory`. Its properties (when
+    booted) or its bootloader variables (when in the bootloader) are the ones at the time it was listed.
+    """
+
+    STATE_BOOTED = 'device'
+    STATE_BOOTLOADER = 'fastboot'
+
+    TRANSPORT_TCP = 'tcp'
+    TRANSPORT_USB = 'usb'
+
+    def __init__(self, serial: str, state: str, transport: str, fields: Dict[str, str]=None,
+                 properties: Dict[str, str]=None, variables: Dict[str, str]=None) -> None:
+        """
+        :param fields: the fields listing the device, see :meth:`adbclient.ADBClient.devices`.
+        :param properties: the properties of the device, by name.
+        :param variables: the bootloader variables of the device, by name.
+        """
+        self._fields = fields or dict()
+        self._properties = properties or dict()
+        self._serial = serial
+        self._state = state
+        self._transport = transport
+        self._variables = variables or dict()
+
+    def __str__(self) -> str:
+        return Device.description(self)
+
+    def booted(self) -> bool:
+        return self._state == Device.STATE_BOOTED
+
+    def bootloader_variables(self) -> Dict[str, str]:
+        return dict(self._variables)
+
+    @staticmethod
+    def description(device: 'Device') -> str:
+        description = list()
+        description.append('Serial: {}'.format(device.serial()))
+        description.append('State: {}'.format(device.state()))
+        description.append('Transport: {}'.format(device.transport()))
+        description.append('Product: {}'.format(device.product()))
+        if device.fingerprint():
+            description.append('Fingerprint: {}'.format(device.fingerprint()))
+        for name, value in sorted(device.properties().items()):
+            description.append('[{}]: [{}]'.format(name, value))
+        for name, value in sorted(device.bootloader_variables().items()):
+            description.append('(bootloader) {}: {}'.format(name, value))
+        description.append('=' * max(map(len, description)))
+        description.insert(0, description[-1])
+
+        return '\n'.join(description)
+
+    def fields(self) -> Dict[str, str]:
+        return dict(self._fields)
+
+    def fingerprint(self) -> str:
+        return self._properties.get('ro.build.fingerprint', '')
+
+    def in_bootloader(self) -> bool:
+        return self._state == Device.STATE_BOOTLOADER
+
+    def product(self) -> str:
+        return self._properties.get('ro.product.name') or self._fields.get('product') or \
+            self._variables.get('product', '')
+
+    def properties(self) -> Dict[str, str]:
+        return dict(self._properties)
+
+    def serial(self) -> str:
+        return self._serial
+
+    def slot(self) -> str:
+        """
+        :return: the active slot (e.g. "a"), or an empty string for devices without slots.
+        """
+        return (self._properties.get('ro.boot.slot_suffix') or self._variables.get('current-slot', '')).lstrip('_')
+
+    def state(self) -> str:
+        return self._state
+
+    @staticmethod
+    def summary(devices: List['Device']) -> str:
+        summary = list()
+        for device in devices:
+            summary.append('{:24} {:12} {:4} {:16} {}'.format(device.serial(), device.state(), device.transport(),
+                                                             device.product(), device.fingerprint()))
+        summary.append('=' * max(map(len, summary or [''])))
+        summary.insert(0, summary[-1])
+
+        return '\n'.join(summary)
+
+    def transport(self) -> str:
+        return self._transport
+
+
+class DeviceInventory(object):
+    """
+    List the devices attached to ADB and to fastboot as :class:`Device` records.
+
+    Listing the devices is cheap, querying them is not: all the properties of a device (or all its bootloader
+    variables) are fetched at once, then cached until the device is listed in another state or on another transport
+    (ADB gives a new transport to a device each time it connects, e.g. after a reboot). Properties not starting with
+    "ro." may still change while cached, call :meth:`invalidate` when they matter. Several devices are queried at the
+    same time.
+    """
+
+    _MAX_QUERIES = 8
+
+    def __init__(self) -> None:
+        # Cached properties or variables, along with what they are valid for, by serial.
+        self._cache = dict()
+        self._lock = threading.Lock()
+
+    def device(self, serial: str='') -> Device:
+        """
+        :param serial: serial of the device, or empty for the only device attached. Devices in the bootloader over TCP
+                       (``tcp:host[:port]``) are not listed by fastboot, they are only found by their serial.
+        :return: the device, or None if it is not attached (or if several devices are attached and no serial given).
+        """
+        listing = self._list()
+        if not serial:
+            return self._query(listing[0]) if len(listing) == 1 else None
+        device = next((device for device in listing if device.serial() == serial), None)
+        if device is None and FastbootTCPClient.is_tcp_serial(serial):
+            device = DeviceInventory._probe(serial)
+        return self._query(device) if device is not None else None
+
+    def devices(self) -> List[Device]:
+        listing = self._list()
+        with concurrent.futures.ThreadPoolExecutor(DeviceInventory._MAX_QUERIES) as executor:
+            return list(executor.map(self._query, listing))
+
+    def invalidate(self, serial: str) -> None:
+        with self._lock:
+            self._cache.pop(serial, None)
+
+    def select(self, product: str='', state: str='') -> List[Device]:
+        """
+        :param product: only the devices of this product, or all of them if empty.
+        :param state: only the devices in this state (e.g. "device" or "fastboot"), or all of them if empty.
+        """
+        return [device for device in self.devices()
+                if (not product or device.product() == product) and (not state or device.state() == state)]
+
+    @staticmethod
+    def serials() -> List[str]:
+        """
+        :return: the serials of all the devices attached, either booted or in the bootloader.
+        """
+        return sorted(device.serial() for device in DeviceInventory._list())
+
+    @staticmethod
+    def _list() -> List[Device]:
+        # ADB lists a serial followed by a state, which may be made of several words (e.g. "no permissions"), then the
+        # fields describing the device as "name:value".
+        devices = dict()
+        for line in ADBAdapter.devices(long=True):
+            words = line.split()
+            if not words:
+                continue
+            state = ' '.join(word for word in words[1:] if ':' not in word)
+            fields = dict(word.split(':', 1) for word in words[1:] if ':' in word)
+            devices[words[0]] = Device(words[0], state, DeviceInventory._transport(words[0]), fields)
+        for serial in FastbootAdapter.serials():
+            devices[serial] = Device(serial, Device.STATE_BOOTLOADER, DeviceInventory._transport(serial))
+        return [devices[serial] for serial in sorted(devices)]
+
+    @staticmethod
+    def _probe(serial: str) -> Device:
+        # A device over TCP is attached if it answers. Its session is kept for the commands to come.
+        try:
+            client = FastbootTCPClient.session(serial)
+            fields = {'product': client.getvar('product'), 'serialno': client.getvar('serialno')}
+        except OSError:
+            FastbootTCPClient.drop_session(serial)
+            return None
+        return Device(serial, Device.STATE_BOOTLOADER, Device.TRANSPORT_TCP, fields)
+
+    def _query(self, device: Device) -> Device:
+        if not device.booted() and not device.in_bootloader():
+            return device  # E.g. unauthorized or offline, it cannot be queried.
+
+        # The transport is only known for devices listed by ADB.
+        key = (device.state(), device.fields().get('transport_id', ''))
+        with self._lock:
+            cached_key, values = self._cache.get(device.serial(), (None, None))
+        if cached_key != key:
+            try:
+                values = ADBAdapter.getprops(device.serial()) if device.booted() else \
+                    FastbootAdapter.getvars(device.serial())
+            except (OSError, RuntimeError, subprocess.CalledProcessError):
+                return device  # It went away meanwhile.
+            with self._lock:
+                self._cache[device.serial()] = (key, values)
+
+        if device.booted():
+            return Device(device.serial(), device.state(), device.transport(), device.fields(), properties=values)
+        return Device(device.serial(), device.state(), device.transport(), device.fields(), variables=values)
+
+    @staticmethod
+    def _transport(serial: str) -> str:
+        # Devices reached over the network are designated by their address, e.g. "192.168.1.2:5555" for ADB and
+        # "tcp:192.168.1.2" for fastboot.
+        return Device.TRANSPORT_TCP if FastbootTCPClient.is_tcp_serial(serial) or ':' in serial else \
+            Device.TRANSPORT_USB
+
+
+def main() -> None:
+    SanityChecks.run()
+
+    configuration = Configuration()
+    cli = DeviceInventoryCommandLineInterface(configuration)
+    inventory = DeviceInventory()
+    if cli.serial():
+        device = inventory.device(cli.serial())
+        if device is None:
+            print('Device "{}" is not attached'.format(cli.serial()))
+            sys.exit(1)
+        print(device)
+    else:
+        print(Device.summary(inventory.select(cli.product(), cli.state())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import collections
+import contextlib
+import gzip
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+
+from commandline import LogsCommandLineInterface
+from configuration import Configuration
+from profiler import ResourceSampler
+from sanity import SanityChecks
+from typing import Dict, List
+
+
+class _LogWriter(object):
+    """
+    Write the output of a stage into a gzip file made of several members, each holding about the same amount of
+    uncompressed output. A member can be decompressed on its own, so reading a given line only requires decompressing
+    the member it is in. Error lines are written to an index file as they go by, along with the member they are in.
+    """
+
+    # Amount of uncompressed output per gzip member.
+    _MEMBER_SIZE = 16 * 1024 * 1024
+
+    # Failing ninja edges, then other error messages from the tools run during a build.
+    _EDGE_PATTERN = re.compile(rb'^FAILED: (.*)$')
+    _ERROR_PATTERN = re.compile(rb'(\berror:|\bERROR:|^fatal:|^make(\[\d+\])?: \*\*\*|^ninja: build stopped|'
+                                rb'^Traceback \(most recent call last\))')
+
+    def __init__(self, log_path: str, index_path: str) -> None:
+        self._index_file = open(index_path, 'w')
+        self._line_number = 0
+        self._log_file = open(log_path, 'wb')
+        self._member = None
+        self._member_line_number = 0
+        self._member_offset = 0
+        self._member_size = 0
+
+    def close(self, return_code: int) -> None:
+        if self._member is not None:
+            self._member.close()
+        self._log_file.close()
+        self._write_index({'kind': 'exit', 'return_code': return_code, 'lines': self._line_number})
+        self._index_file.close()
+
+    def write(self, line: bytes) -> None:
+        if self._member is None or self._member_size >= _LogWriter._MEMBER_SIZE:
+            if self._member is not None:
+                self._member.close()  # Only ends the member, the underlying file is left open.
+            self._member_line_number = self._line_number
+            self._member_offset = self._log_file.tell()
+            self._member_size = 0
+            self._member = gzip.GzipFile(fileobj=self._log_file, mode='wb')
+
+        self._member.write(line)
+        self._member_size += len(line)
+
+        edge_match = _LogWriter._EDGE_PATTERN.match(line.rstrip())
+        if edge_match or _LogWriter._ERROR_PATTERN.search(line):
+            self._write_index({
+                'kind': 'edge' if edge_match else 'error',
+                'line': self._line_number,
+                'member_line': self._member_line_number,
+                'member_offset': self._member_offset,
+                'text': line.decode(errors='replace').rstrip()
+            })
+        self._line_number += 1
+
+    def _write_index(self, entry: Dict[str, object]) -> None:
+        self._index_file.write(json.dumps(entry) + '\n')
+        self._index_file.flush()
+
+
+class LogRun(object):
+    """
+    A :class:`LogRun` gathers the logs of the stages run by one invocation of a tool. Each stage has a compressed log
+    file and an index of its errors, see :class:`_LogWriter`. The resources used by each stage are sampled too when a
+    sample interval is given, see :class:`profiler.ResourceSampler`.
+    """
+
+    INDEX_EXTENSION = '.index'
+    LOG_EXTENSION = '.log.gz'
+
+    def __init__(self, path: str, sample_interval: float=0) -> None:
+        self._lock = threading.Lock()
+        self._path = path
+        self._sample_interval = sample_interval
+
+    def call(self, command: List[str], stage: str, **kwargs) -> int:
+        """
+        Run a command, printing its output and writing it to the log of a stage.
+
+        :param command: the command to run.
+        :param stage: name of the stage, used for naming its log files.
+        :param kwargs: keyword arguments passed to ``subprocess.Popen``.
+        :return: the return code of the command.
+        """
+        with self._lock:
+            if not os.path.isdir(self._path):
+                os.makedirs(self._path)
+            stage_name = stage
+            for stage_number in range(2, sys.maxsize):
+                if not os.path.exists(os.path.join(self._path, stage_name + LogRun.INDEX_EXTENSION)):
+                    break
+                stage_name = '{}-{}'.format(stage, stage_number)
+            log_writer = _LogWriter(os.path.join(self._path, stage_name + LogRun.LOG_EXTENSION),
+                                    os.path.join(self._path, stage_name + LogRun.INDEX_EXTENSION))
+
+        return_code = -1
+        resource_sampler = None
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs)
+            if self._sample_interval > 0:
+                resource_sampler = ResourceSampler(process.pid, self._sample_interval,
+                                                   os.path.join(self._path, stage_name + ResourceSampler.EXTENSION),
+                                                   kwargs.get('cwd') or '.')
+                resource_sampler.start()
+            with process.stdout:
+                for line in process.stdout:
+                    sys.stdout.buffer.write(line)
+                    sys.stdout.buffer.flush()
+                    log_writer.write(line)
+            return_code = process.wait()
+        finally:
+            if resource_sampler is not None:
+                resource_sampler.stop()
+            log_writer.close(return_code)
+
+        return return_code
+
+    @staticmethod
+    def index(index_path: str) -> List[Dict[str, object]]:
+        with open(index_path) as index_file:
+            return [json.loads(line) for line in index_file if line.strip()]
+
+    @staticmethod
+    def lines(log_path: str, entry: Dict[str, object], context: int) -> List[str]:
+        """
+        Read the lines of a log around an entry of its index. Only the member containing the entry (and the following
+        one if the context spreads over it) is decompressed.
+
+        :param log_path: path to the compressed log.
+        :param entry: an entry of the index of the log.
+        :param context: number of lines to read before and after the line of the entry.
+        :return: the lines.
+        """
+        lines_before = collections.deque(maxlen=context)
+        lines_after = list()
+        with open(log_path, 'rb') as log_file:
+            log_file.seek(entry['member_offset'])
+            with gzip.GzipFile(fileobj=log_file, mode='rb') as log_reader:
+                for line_number, line in enumerate(log_reader, entry['member_line']):
+                    if line_number < entry['line']:
+                        lines_before.append(line.decode(errors='replace').rstrip('\n'))
+                    elif line_number <= entry['line'] + context:
+                        lines_after.append(line.decode(errors='replace').rstrip('\n'))
+                    else:
+                        break
+        return list(lines_before) + lines_after
+
+    def path(self) -> str:
+        return self._path
+
+    @staticmethod
+    def stages(run_path: str) -> List[str]:
+        # In the order they were run.
+        index_file_names = sorted((file_name for file_name in os.listdir(run_path)
+                                   if file_name.endswith(LogRun.INDEX_EXTENSION)),
+                                  key=lambda file_name: os.path.getmtime(os.path.join(run_path, file_name)))
+        return [file_name[:-len(LogRun.INDEX_EXTENSION)] for file_name in index_file_names]
+
+
+_current = threading.local()
+
+
+def check_call(command: List[str], stage: str, **kwargs) -> int:
+    """
+    Equivalent of ``subprocess.check_call``, writing the output of the command to the current :class:`LogRun` if there
+    is one (see :func:`recording`).
+
+    :param command: the command to run.
+    :param stage: name of the stage, used for naming its log files.
+    :param kwargs: keyword arguments passed to ``subprocess.Popen``.
+    """
+    log_run = current_run()
+    if log_run is None:
+        return subprocess.check_call(command, **kwargs)
+
+    return_code = log_run.call(command, stage, **kwargs)
+    if return_code:
+        raise subprocess.CalledProcessError(return_code, command)
+    return return_code
+
+
+@contextlib.contextmanager
+def attached(log_run: LogRun) -> None:
+    """
+    Write the output of the commands run through :func:`check_call` to an existing :class:`LogRun` for the context
+    scope only. It applies to the current thread, so it is meant for passing the run of a thread on to the threads it
+    starts (see :func:`current_run`).
+
+    :param log_run: the run, or None for not writing the output anywhere.
+    """
+    previous_log_run = getattr(_current, 'log_run', None)
+    _current.log_run = log_run
+    try:
+        yield
+    finally:
+        _current.log_run = previous_log_run
+
+
+def current_run() -> LogRun:
+    """
+    :return: the :class:`LogRun` of the current thread, or None.
+    """
+    return getattr(_current, 'log_run', None)
+
+
+@contextlib.contextmanager
+def recording(logs_path: str, name: str, sample_interval: float=0) -> None:
+    """
+    Write the output of the commands run through :func:`check_call` to a new :class:`LogRun` for the context scope
+    only. It applies to the current thread.
+
+    :param logs_path: directory containing all the runs.
+    :param name: name of the run.
+    :param sample_interval: interval in seconds between two samples of the resources used by the commands, 0 for not
+                            sampling them.
+    """
+    with attached(LogRun(os.path.join(logs_path, name), sample_interval)):
+        yield
+
+
+def main() -> None:
+    SanityChecks.run()
+
+    configuration = Configuration()
+    cli = LogsCommandLineInterface(configuration)
+
+    # Without a run, list the runs.
+    if not cli.run():
+        run_names = os.listdir(configuration.logs_path()) if os.path.isdir(configuration.logs_path()) else list()
+        for run_name in sorted(run_names)[-cli.count():]:
+            run_path = os.path.join(configuration.logs_path(), run_name)
+            stages = list()
+            for stage in LogRun.stages(run_path):
+                index = LogRun.index(os.path.join(run_path, stage + LogRun.INDEX_EXTENSION))
+                exit_entries = [entry for entry in index if entry['kind'] == 'exit']
+                status = 'exit {}'.format(exit_entries[0]['return_code']) if exit_entries else 'running'
+                stages.append('{} ({}, {} error(s))'.format(stage, status, len(index) - len(exit_entries)))
+            print('{}: {}'.format(run_name, ', '.join(stages)))
+        return
+
+    # Otherwise show the failure: the first failing ninja edge, or the first error.
+    run_path = os.path.join(configuration.logs_path(), cli.run())
+    for stage in LogRun.stages(run_path):
+        if cli.stage() and stage != cli.stage():
+            continue
+        index = LogRun.index(os.path.join(run_path, stage + LogRun.INDEX_EXTENSION))
+        entries = [entry for entry in index if entry['kind'] == 'edge'] or \
+                  [entry for entry in index if entry['kind'] == 'error']
+        if not cli.all():
+            entries = entries[:1]
+        for entry in entries:
+            print('=== {}, line {}'.format(stage, entry['line'] + 1))
+            print('\n'.join(LogRun.lines(os.path.join(run_path, stage + LogRun.LOG_EXTENSION), entry, cli.context())))
+
+
+if __name__ == '__main__':
+    main()
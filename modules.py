@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import glob
+import json
+import os
+import sqlite3
+import sys
+import urllib.parse
+
+from commandline import ModuleIndexCommandLineInterface
+from configuration import Configuration
+from sanity import SanityChecks
+from typing import Iterator, List, TextIO, Tuple
+
+
+class _JSONObjectReader(object):
+    """
+    Read the members of a top-level JSON object one by one, without loading the whole document in memory.
+    """
+
+    _CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, json_file: TextIO) -> None:
+        self._buffer = ''
+        self._decoder = json.JSONDecoder()
+        self._file = json_file
+        self._position = 0
+
+    def members(self) -> Iterator[Tuple[str, object]]:
+        self._expect('{')
+        while True:
+            if self._peek() == '}':
+                return
+            name = self._decode()
+            self._expect(':')
+            value = self._decode()
+            yield name, value
+
+            # Drop what has been parsed so far, so that the buffer only ever holds about one member.
+            self._buffer = self._buffer[self._position:]
+            self._position = 0
+            if self._peek() == ',':
+                self._position += 1
+
+    def _decode(self) -> object:
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                if not self._read():
+                    raise
+                continue
+
+            # A number at the end of the buffer may be truncated: it is complete only once followed by a delimiter.
+            if isinstance(value, (int, float)) and self._buffer[end:end + 1] not in list(',]} \t\r\n') and \
+                    self._read():
+                continue
+            self._position = end
+            return value
+
+    def _expect(self, char: str) -> None:
+        if self._peek() != char:
+            raise ValueError('Invalid JSON object: expected "{}" at offset {}'.format(char, self._position))
+        self._position += 1
+
+    def _peek(self) -> str:
+        # Skip whitespaces and return the next character.
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position].isspace():
+                self._position += 1
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._read():
+                raise ValueError('Invalid JSON object: unexpected end of file')
+
+    def _read(self) -> bool:
+        chunk = self._file.read(_JSONObjectReader._CHUNK_SIZE)
+        self._buffer += chunk
+        return bool(chunk)
+
+
+class ModuleIndex(object):
+    """
+    Answer questions about the modules of a built AOSP tree, as described by the ``module-info.json`` file the build
+    system generates in the product output directory. As this file is huge, it is converted once into an SQLite database
+    stored next to it, indexed by module name, module path and installed file.
+    """
+
+    MODULE_INFO_GLOB = 'out/target/product/*/module-info.json'
+
+    _INDEX_EXTENSION = '.db'
+    _SCHEMA = '''
+        CREATE TABLE modules (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, class TEXT NOT NULL);
+        CREATE TABLE paths (module_id INTEGER NOT NULL, path TEXT NOT NULL);
+        CREATE TABLE installed (module_id INTEGER NOT NULL, file TEXT NOT NULL, device_file TEXT NOT NULL);
+        CREATE INDEX paths_path ON paths (path);
+        CREATE INDEX paths_module_id ON paths (module_id);
+        CREATE INDEX installed_file ON installed (file);
+        CREATE INDEX installed_device_file ON installed (device_file);
+        CREATE INDEX installed_module_id ON installed (module_id);
+    '''
+
+    def __init__(self, index_path: str) -> None:
+        self._connection = sqlite3.connect('file:{}?mode=ro'.format(urllib.parse.quote(index_path)), uri=True)
+
+    @staticmethod
+    def find(tree_path: str) -> str:
+        """
+        Find the most recent ``module-info.json`` file of a tree.
+
+        :param tree_path: path to the root of the AOSP tree.
+        :return: the path to the file, or an empty string if the tree has not been built.
+        """
+        module_info_paths = glob.glob(os.path.join(tree_path, ModuleIndex.MODULE_INFO_GLOB))
+        if not module_info_paths:
+            return ''
+        return max(module_info_paths, key=os.path.getmtime)
+
+    def installed(self, module: str) -> List[str]:
+        cursor = self._connection.execute('SELECT file FROM installed JOIN modules ON modules.id = module_id '
+                                          'WHERE name = ? ORDER BY file', (module,))
+        return [file for file, in cursor]
+
+    def installers(self, file: str) -> List[str]:
+        """
+        Find the modules installing a file.
+
+        :param file: path of the installed file, either relative to the root of the tree (e.g.
+                     ``out/target/product/generic/system/bin/sh``) or as seen on the device (e.g. ``/system/bin/sh``).
+        :return: the names of the modules.
+        """
+        cursor = self._connection.execute('SELECT DISTINCT name FROM installed JOIN modules ON modules.id = module_id '
+                                          'WHERE file = ? OR device_file = ? ORDER BY name',
+                                          (os.path.normpath(file), os.path.normpath(file)))
+        return [name for name, in cursor]
+
+    @staticmethod
+    def load(tree_path: str) -> 'ModuleIndex':
+        """
+        Open the index of the most recent ``module-info.json`` file of a tree, generating it first if it is missing or
+        out of date.
+
+        :param tree_path: path to the root of the AOSP tree.
+        :return: the index, or ``None`` if the tree has not been built.
+        """
+        module_info_path = ModuleIndex.find(tree_path)
+        if not module_info_path:
+            return None
+        return ModuleIndex(ModuleIndex.update(module_info_path))
+
+    def owners(self, path: str) -> List[str]:
+        """
+        Find the modules defined in the closest directory containing a source file.
+
+        :param path: path of the source file, relative to the root of the tree.
+        :return: the names of the modules, or an empty list if no directory containing the file defines modules.
+        """
+        path = os.path.normpath(path)
+        while path and path != os.sep:
+            cursor = self._connection.execute('SELECT name FROM paths JOIN modules ON modules.id = module_id '
+                                              'WHERE path = ? ORDER BY name', (path,))
+            names = [name for name, in cursor]
+            if names:
+                return names
+            path = os.path.dirname(path)
+        return list()
+
+    def paths(self, module: str) -> List[str]:
+        cursor = self._connection.execute('SELECT path FROM paths JOIN modules ON modules.id = module_id '
+                                          'WHERE name = ? ORDER BY path', (module,))
+        return [path for path, in cursor]
+
+    @staticmethod
+    def update(module_info_path: str) -> str:
+        """
+        Generate the index of a ``module-info.json`` file, unless it is already up to date. The file is streamed, so
+        memory usage does not depend on its size.
+
+        :param module_info_path: path to the ``module-info.json`` file.
+        :return: the path to the index.
+        """
+        index_path = os.path.splitext(module_info_path)[0] + ModuleIndex._INDEX_EXTENSION
+        if os.path.isfile(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(module_info_path):
+            return index_path
+
+        # The product output directory relative to the root of the tree (e.g. ``out/target/product/generic``), which
+        # installed files are relative to on the device.
+        product_path = os.path.join(*os.path.normpath(module_info_path).split(os.sep)[-5:-1])
+
+        temp_index_path = '{}.tmp{}'.format(index_path, os.getpid())
+        if os.path.exists(temp_index_path):
+            os.remove(temp_index_path)
+        connection = sqlite3.connect(temp_index_path)
+        try:
+            with connection:
+                connection.executescript(ModuleIndex._SCHEMA)
+                with open(module_info_path) as module_info_file:
+                    for module_id, (name, module) in enumerate(_JSONObjectReader(module_info_file).members()):
+                        connection.execute('INSERT INTO modules VALUES (?, ?, ?)',
+                                           (module_id, name, ','.join(module.get('class', list()))))
+                        connection.executemany('INSERT INTO paths VALUES (?, ?)',
+                                               [(module_id, os.path.normpath(path))
+                                                for path in module.get('path', list())])
+                        connection.executemany('INSERT INTO installed VALUES (?, ?, ?)',
+                                               [(module_id, os.path.normpath(file),
+                                                 ModuleIndex._device_file(file, product_path))
+                                                for file in module.get('installed', list())])
+        finally:
+            connection.close()
+        os.replace(temp_index_path, index_path)
+
+        return index_path
+
+    @staticmethod
+    def _device_file(file: str, product_path: str) -> str:
+        # Return the path of an installed file on the device, or an empty string for files not installed on the device
+        # (e.g. host tools).
+        file = os.path.normpath(file)
+        if not file.startswith(product_path + os.sep):
+            return ''
+        return os.sep + os.path.relpath(file, product_path)
+
+
+def main() -> None:
+    SanityChecks.run()
+
+    cli = ModuleIndexCommandLineInterface(Configuration())
+    module_index = ModuleIndex.load(cli.path())
+    if module_index is None:
+        print('The tree has not been built: no file matches "{}"'.format(ModuleIndex.MODULE_INFO_GLOB),
+              file=sys.stderr)
+        sys.exit(os.EX_DATAERR)
+
+    if cli.owner():
+        # Paths are relative to the root of the tree, or absolute. Absolute paths outside of the tree are paths on the
+        # device.
+        path = cli.owner()
+        if os.path.isabs(path) and not os.path.relpath(path, cli.path()).startswith(os.pardir):
+            path = os.path.relpath(path, cli.path())
+        results = module_index.installers(path) or module_index.owners(path)
+    else:
+        results = module_index.installed(cli.module())
+
+    for result in results:
+        print(result)
+    if not results:
+        sys.exit(os.EX_DATAERR)
+
+
+if __name__ == '__main__':
+    main()
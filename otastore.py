@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import json
+import os
+import shutil
+import zipfile
+
+from commandline import OTAStoreCommandLineInterface
+from configuration import Configuration
+from sanity import SanityChecks
+from typing import Dict, List, Tuple
+
+
+class OTAStore(object):
+    """
+    An :class:`OTAStore` retains the last signed target files of each product, so that incremental OTAs can be
+    generated from them to newer builds. Target files are indexed by product and release, the release being the
+    incremental version of the build (``ro.build.version.incremental``). Only the most recent ones are retained.
+    """
+
+    # Where the build properties are in a target files zip, depending on the version of Android.
+    _BUILD_PROPERTIES_PATHS = ['SYSTEM/build.prop', 'SYSTEM/etc/build.prop']
+    _DATE_PROPERTY = 'ro.build.date.utc'
+    _RELEASE_PROPERTY = 'ro.build.version.incremental'
+
+    def __init__(self, path: str, retained: int) -> None:
+        self._path = path
+        self._retained = retained
+
+    def add(self, product: str, target_file_path: str) -> str:
+        """
+        Add a signed target file to the store, then forget the oldest ones of the product beyond the retained number.
+        Adding the same release again replaces it.
+
+        :param product: name of the product.
+        :param target_file_path: path to the signed target file.
+        :return: the release of the target file.
+        """
+        release, date = OTAStore.release(target_file_path)
+        release_path = self.path(product, release)
+        if not os.path.isdir(os.path.dirname(release_path)):
+            os.makedirs(os.path.dirname(release_path))
+        # The target file is copied under a temporary name first, so that a partial copy is never used as a base.
+        shutil.copyfile(target_file_path, release_path + '.tmp')
+        os.replace(release_path + '.tmp', release_path)
+        with open(self._metadata_path(product, release), 'w') as metadata_file:
+            json.dump({'date': date}, metadata_file)
+
+        for old_release in self.releases(product)[self._retained:]:
+            os.remove(self.path(product, old_release))
+            os.remove(self._metadata_path(product, old_release))
+        return release
+
+    def path(self, product: str, release: str) -> str:
+        return os.path.join(self._path, product, '{}.zip'.format(release))
+
+    def products(self) -> List[str]:
+        if not os.path.isdir(self._path):
+            return list()
+        return sorted(name for name in os.listdir(self._path) if os.path.isdir(os.path.join(self._path, name)))
+
+    @staticmethod
+    def release(target_file_path: str) -> Tuple[str, int]:
+        """
+        :param target_file_path: path to a target file.
+        :return: the release of the build in the target file and its date (seconds since the epoch).
+        """
+        properties = dict()
+        with zipfile.ZipFile(target_file_path) as target_file:
+            names = set(target_file.namelist())
+            for build_properties_path in OTAStore._BUILD_PROPERTIES_PATHS:
+                if build_properties_path in names:
+                    properties = OTAStore._parse_properties(target_file.read(build_properties_path).decode())
+                    break
+        if OTAStore._RELEASE_PROPERTY not in properties:
+            raise ValueError('No {} in "{}"'.format(OTAStore._RELEASE_PROPERTY, target_file_path))
+        return properties[OTAStore._RELEASE_PROPERTY], int(properties.get(OTAStore._DATE_PROPERTY, 0))
+
+    def releases(self, product: str) -> List[str]:
+        """
+        :param product: name of the product.
+        :return: the releases of the product in the store, most recent first.
+        """
+        dates = dict()
+        product_path = os.path.join(self._path, product)
+        if os.path.isdir(product_path):
+            for file_name in os.listdir(product_path):
+                if file_name.endswith('.json'):
+                    with open(os.path.join(product_path, file_name)) as metadata_file:
+                        dates[file_name[:-len('.json')]] = json.load(metadata_file)['date']
+        return sorted(dates, key=lambda release: (dates[release], release), reverse=True)
+
+    def _metadata_path(self, product: str, release: str) -> str:
+        return os.path.join(self._path, product, '{}.json'.format(release))
+
+    @staticmethod
+    def _parse_properties(content: str) -> Dict[str, str]:
+        properties = dict()
+        for line in content.splitlines():
+            line = line.strip()
+            if line and not line.startswith('#') and '=' in line:
+                name, value = line.split('=', 1)
+                properties[name.strip()] = value.strip()
+        return properties
+
+
+def main() -> None:
+    SanityChecks.run()
+
+    configuration = Configuration()
+    cli = OTAStoreCommandLineInterface(configuration)
+    ota_store = OTAStore(configuration.ota_store_path(), configuration.ota_store_retained())
+    for product in ota_store.products():
+        if cli.product() and product != cli.product():
+            continue
+        print('{}: {}'.format(product, ' '.join(ota_store.releases(product))))
+
+
+if __name__ == '__main__':
+    main()
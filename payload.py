@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import collections
+import mmap
+import struct
+import zipfile
+
+from cache import ArtifactCache
+from commandline import PayloadCommandLineInterface
+from configuration import Configuration
+from sanity import SanityChecks
+from typing import Dict, Iterator, List, Tuple
+
+
+class Payload(object):
+    """
+    A :class:`Payload` is the summary of the ``payload.bin`` of an A/B OTA file: the partitions it updates and the
+    operations updating them. The payload is read straight out of the OTA zip, where it is stored uncompressed, and only
+    its header and manifest are read (not the data of the operations).
+
+    See ``update_metadata.proto`` in ``system/update_engine`` for the format of the manifest.
+    """
+
+    MAGIC = b'CrAU'
+    NAME = 'payload.bin'
+
+    # Names of the types of ``InstallOperation``.
+    OPERATION_TYPES = {
+        0: 'REPLACE',
+        1: 'REPLACE_BZ',
+        2: 'MOVE',
+        3: 'BSDIFF',
+        4: 'SOURCE_COPY',
+        5: 'SOURCE_BSDIFF',
+        6: 'ZERO',
+        7: 'DISCARD',
+        8: 'REPLACE_XZ',
+        9: 'PUFFDIFF',
+        10: 'BROTLI_BSDIFF',
+        11: 'ZUCCHINI',
+        12: 'LZ4DIFF_BSDIFF',
+        13: 'LZ4DIFF_PUFFDIFF',
+        14: 'REPLACE_ZSTD'
+    }
+
+    # Header: magic, major version, manifest size, then the metadata signature size from version 2.
+    _HEADER_FORMAT = '>4sQQ'
+    _LOCAL_FILE_HEADER_FORMAT = '<4sHHHHHIIIHH'
+
+    # Protobuf wire types.
+    _VARINT = 0
+    _FIXED64 = 1
+    _LENGTH_DELIMITED = 2
+    _FIXED32 = 5
+
+    def __init__(self, ota_path: str) -> None:
+        with zipfile.ZipFile(ota_path) as ota_file:
+            info = ota_file.getinfo(Payload.NAME)
+        if info.compress_type != zipfile.ZIP_STORED:
+            raise ValueError('{} is compressed in "{}"'.format(Payload.NAME, ota_path))
+
+        with open(ota_path, 'rb') as ota_file:
+            with mmap.mmap(ota_file.fileno(), 0, access=mmap.ACCESS_READ) as ota:
+                # The data starts after the local file header, whose extra field may differ from the central one.
+                local_header = struct.unpack_from(Payload._LOCAL_FILE_HEADER_FORMAT, ota, info.header_offset)
+                payload_offset = info.header_offset + struct.calcsize(Payload._LOCAL_FILE_HEADER_FORMAT) + \
+                    local_header[9] + local_header[10]
+                magic, self._major_version, manifest_size = struct.unpack_from(Payload._HEADER_FORMAT, ota,
+                                                                               payload_offset)
+                if magic != Payload.MAGIC:
+                    raise ValueError('{} of "{}" is not a payload'.format(Payload.NAME, ota_path))
+                manifest_offset = payload_offset + struct.calcsize(Payload._HEADER_FORMAT)
+                if self._major_version >= 2:
+                    manifest_offset += 4
+                manifest = ota[manifest_offset:manifest_offset + manifest_size]
+
+        self._block_size = 4096
+        self._minor_version = 0
+        self._partitions = list()
+        for field_number, _, value in Payload._fields(manifest):
+            if field_number == 3:
+                self._block_size = value
+            elif field_number == 12:
+                self._minor_version = value
+            elif field_number == 13:
+                self._partitions.append(manifest[value[0]:value[1]])
+        self._partitions = [self._partition(partition) for partition in self._partitions]
+
+    def block_size(self) -> int:
+        return self._block_size
+
+    def description(self) -> str:
+        description = list()
+        description.append('Payload version {}.{}, {}'.format(self._major_version, self._minor_version,
+                                                              'incremental' if self.is_incremental() else 'full'))
+        for partition in self._partitions:
+            description.append('{}: {} -> {}, {} of data ({:.1f}x), {}'.format(
+                partition['name'], ArtifactCache.human_readable_size(partition['old_size']),
+                ArtifactCache.human_readable_size(partition['new_size']),
+                ArtifactCache.human_readable_size(partition['data_size']),
+                partition['written_size'] / max(partition['data_size'], 1),
+                ', '.join('{} {}'.format(count, operation_type)
+                          for operation_type, count in sorted(partition['operations'].items()))))
+        description.append('=' * max(map(len, description)))
+        description.insert(0, description[-1])
+
+        return '\n'.join(description)
+
+    def is_incremental(self) -> bool:
+        return any(partition['old_size'] for partition in self._partitions)
+
+    def partitions(self) -> List[Dict[str, object]]:
+        """
+        :return: for each partition, its name, its size before and after the update, the number of operations of each
+                 type, the size of the data of the operations and the size written by the operations having data. The
+                 ratio of the last two is the compression ratio of the partition.
+        """
+        return self._partitions
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            'block_size': self._block_size,
+            'major_version': self._major_version,
+            'minor_version': self._minor_version,
+            'partitions': self._partitions
+        }
+
+    @staticmethod
+    def _fields(message: bytes) -> Iterator[Tuple[int, int, object]]:
+        # Decode the fields of a protobuf message: numbers and values for scalars, start and end offsets for the others.
+        offset = 0
+        while offset < len(message):
+            key, offset = Payload._varint(message, offset)
+            wire_type = key & 0x7
+            if wire_type == Payload._VARINT:
+                value, offset = Payload._varint(message, offset)
+            elif wire_type == Payload._FIXED64:
+                value, offset = struct.unpack_from('<Q', message, offset)[0], offset + 8
+            elif wire_type == Payload._FIXED32:
+                value, offset = struct.unpack_from('<I', message, offset)[0], offset + 4
+            elif wire_type == Payload._LENGTH_DELIMITED:
+                length, offset = Payload._varint(message, offset)
+                value, offset = (offset, offset + length), offset + length
+            else:
+                raise ValueError('Unsupported protobuf wire type {}'.format(wire_type))
+            yield key >> 3, wire_type, value
+
+    def _partition(self, message: bytes) -> Dict[str, object]:
+        # Fields of ``PartitionUpdate``.
+        partition = {'name': '', 'old_size': 0, 'new_size': 0, 'data_size': 0, 'written_size': 0}
+        operations = collections.Counter()
+        for field_number, _, value in Payload._fields(message):
+            if field_number == 1:
+                partition['name'] = message[value[0]:value[1]].decode()
+            elif field_number in [6, 7]:
+                size = [size for number, _, size in Payload._fields(message[value[0]:value[1]]) if number == 1]
+                partition['old_size' if field_number == 6 else 'new_size'] = size[0] if size else 0
+            elif field_number == 8:
+                operation_type, data_size, written_blocks = self._operation(message[value[0]:value[1]])
+                operations[Payload.OPERATION_TYPES.get(operation_type, str(operation_type))] += 1
+                # Operations without data (e.g. ZERO, SOURCE_COPY) would skew the compression ratio.
+                if data_size:
+                    partition['data_size'] += data_size
+                    partition['written_size'] += written_blocks * self._block_size
+        partition['operations'] = dict(operations)
+        return partition
+
+    @staticmethod
+    def _operation(message: bytes) -> Tuple[int, int, int]:
+        # Fields of ``InstallOperation``: its type, the size of its data, and the number of blocks it writes.
+        operation_type = 0
+        data_size = 0
+        written_blocks = 0
+        for field_number, _, value in Payload._fields(message):
+            if field_number == 1:
+                operation_type = value
+            elif field_number == 3:
+                data_size = value
+            elif field_number == 6:
+                extent = message[value[0]:value[1]]
+                written_blocks += sum(num_blocks for number, _, num_blocks in Payload._fields(extent) if number == 2)
+        return operation_type, data_size, written_blocks
+
+    @staticmethod
+    def _varint(message: bytes, offset: int) -> Tuple[int, int]:
+        value = 0
+        shift = 0
+        while True:
+            byte = message[offset]
+            offset += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value, offset
+
+
+def main() -> None:
+    SanityChecks.run()
+
+    cli = PayloadCommandLineInterface(Configuration())
+    for ota_path in cli.ota_paths():
+        print(ota_path)
+        print(Payload(ota_path).description())
+
+
+if __name__ == '__main__':
+    main()
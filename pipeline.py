@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import logs
+import os
+import sys
+
+from aospbuild import AOSPBuild
+from aospspec import AOSPSpec
+from aosptree import AOSPTree
+from boottimes import BootTimes
+from cache import ArtifactCache
+from commandline import PipelineCommandLineInterface
+from configuration import Configuration
+from flash import Flasher, FlashRegistry
+from imagearchive import ImageArchive
+from inventory import DeviceInventory
+from manifest import LocalManifest
+from otastore import OTAStore
+from repo import RepoAdapter
+from sanity import SanityChecks
+from sign import Signer
+from tasks import TaskGraph
+from typing import Dict, List, Tuple
+from verifier import Verifier
+
+
+class Pipeline(object):
+    """
+    Run the stages of a release in one process, as the tools would when chained: fetch the local manifest, clone the
+    AOSP tree (``repo init`` then ``repo sync``), set up its build rules, build it, sign it, then flash the signed
+    images.
+    The stages are the tasks of a :class:`tasks.TaskGraph`, so a stage starts as soon as the stages it depends on are
+    done: the local manifest is fetched while ``repo init`` runs.
+
+    ``repo init`` and the setup of the build rules are skipped when their stamp holds the key of what they would run
+    with. The tree is synced on every run, as the refs of the manifests may have moved since the last one, which a
+    stamp cannot tell. The build and the signing are not stamped either, as they skip themselves when nothing changed
+    (see :class:`aospbuild.AOSPBuild` and :class:`sign.Signer`), and so are the partitions already flashed (see
+    :class:`flash.FlashRegistry`).
+    """
+
+    MANIFEST = 'manifest'
+    INIT = 'init'
+    SYNC = 'sync'
+    SPEC = 'spec'
+    BUILD = 'build'
+    SIGN = 'sign'
+    FLASH = 'flash'
+    STAGES = (MANIFEST, INIT, SYNC, SPEC, BUILD, SIGN, FLASH)
+
+    # The stages each stage depends on.
+    _DEPENDENCIES = {
+        MANIFEST: (),
+        INIT: (),
+        SYNC: (MANIFEST, INIT),
+        SPEC: (SYNC,),
+        BUILD: (SPEC,),
+        SIGN: (BUILD,),
+        FLASH: (SIGN,)
+    }
+
+    _STAMPED_STAGES = (INIT, SPEC)
+
+    # Stamps are kept along with the state of repo rather than under the output directory: removing the built files
+    # does not undo the setup of the tree.
+    _STAMP_FILE_NAME_FORMAT = 'pipeline-{}.stamp'
+    _STAMPS_DIRECTORY = os.path.join(RepoAdapter.INSTALL_DIRECTORY, 'aosp-tools')
+
+    def __init__(self, configuration: Configuration, path: str, release: str, manifest_refs: Tuple[str, str, str],
+                 aosp_spec: AOSPSpec, aosp_build: AOSPBuild, num_cores: int, signer: Signer=None,
+                 flasher: Flasher=None, serials: List[str]=(), forced_stages: List[str]=()) -> None:
+        """
+        :param path: path to the AOSP tree, cloned if it does not exist.
+        :param manifest_refs: the generic ref, the ref and the specific ref of the local manifest (see
+                              :meth:`manifest.LocalManifest.from_revisions`).
+        :param signer: signs the build, or None for stopping after the build.
+        :param flasher: flashes the signed images, or None for stopping after the signing.
+        :param serials: serials of the devices to flash, or empty for all the devices attached.
+        :param forced_stages: stages run even if their stamp says they are up to date.
+        """
+        self._aosp_build = aosp_build
+        self._aosp_spec = aosp_spec
+        self._configuration = configuration
+        self._flasher = flasher
+        self._forced_stages = forced_stages
+        self._local_manifest = None
+        self._manifest_refs = manifest_refs
+        self._num_cores = num_cores
+        self._path = path
+        self._release = release
+        self._serials = serials
+        self._signer = signer
+
+    @staticmethod
+    def description(path: str, release: str, stages: List[str], signed_image_file_path: str='',
+                    serials: List[str]=()) -> str:
+        description = list()
+        description.append('Path: {}'.format(path))
+        description.append('Release: {}'.format(release))
+        description.append('Stages: {}'.format(' '.join(stages)))
+        skipped_stages = [stage for stage in Pipeline.STAGES if stage not in stages]
+        if skipped_stages:
+            description.append('Skipped: {} (up to date or not requested, use -f/--force STAGE to run init or spec '
+                               'anyway)'.format(' '.join(skipped_stages)))
+        if Pipeline.FLASH in stages:
+            devices = ' '.join(serials) if serials else 'all the devices attached'
+            description.append('Will flash the images of "{}" on {} (the devices must be unlocked, the user data will '
+                               'be wiped if the system is flashed)'.format(signed_image_file_path, devices))
+        description.append('=' * max(map(len, description)))
+        description.insert(0, description[-1])
+
+        return '\n'.join(description)
+
+    def run(self) -> Dict[str, float]:
+        """
+        :return: the duration of each stage which ran, in seconds.
+        """
+        stages = self.stages()
+        task_graph = TaskGraph()
+        for stage in stages:
+            task_graph.add(stage, lambda stage=stage: self._run(stage),
+                           [dependency for dependency in Pipeline._DEPENDENCIES[stage] if dependency in stages])
+        return task_graph.run()
+
+    def signed_image_file_path(self) -> str:
+        """
+        :return: path to the signed image file flashed, absolute.
+        """
+        return os.path.join(self._path, Signer.signed_file_path(
+            Signer.target_file_path(self._configuration, self._aosp_spec), 'signed_img'))
+
+    def stages(self) -> List[str]:
+        """
+        :return: the stages to run, in order.
+        """
+        runs = dict((stage, True) for stage in Pipeline.STAGES)
+        for stage in Pipeline._STAMPED_STAGES:
+            runs[stage] = self._stamp(stage) != self._key(stage) or stage in self._forced_stages
+        # A tree which has just been initialized has no build rules yet.
+        runs[Pipeline.SPEC] = runs[Pipeline.SPEC] or runs[Pipeline.INIT]
+        runs[Pipeline.SIGN] = self._signer is not None
+        runs[Pipeline.FLASH] = self._signer is not None and self._flasher is not None
+
+        return [stage for stage in Pipeline.STAGES if runs[stage]]
+
+    def _build(self) -> None:
+        self._aosp_build.build(self._configuration, AOSPTree(self._path))
+
+    def _flash(self) -> None:
+        serials = self._serials or DeviceInventory.serials()
+        if not serials:
+            raise RuntimeError('No device attached')
+        errors = self._flasher.flash_devices(ImageArchive(self.signed_image_file_path()).images(), serials,
+                                             self._configuration.flash_max_devices())
+        if errors:
+            raise RuntimeError('Flashing failed on {}'.format(' '.join(sorted(errors))))
+
+    def _init(self) -> None:
+        if self._release not in self._configuration.repository_build().remote_refs()[1]:
+            raise ValueError('Android release "{}" does not exist'.format(self._release))
+        if not os.path.isdir(self._path):
+            os.mkdir(self._path)
+        AOSPTree.init(self._configuration, self._path, self._release)
+
+    def _key(self, stage: str) -> str:
+        # What a stage runs with, the key of its stamp.
+        configuration = self._configuration
+        if stage == Pipeline.INIT:
+            return ArtifactCache.key(configuration.repository_manifest().get_remote_url(), self._release,
+                                     ','.join(configuration.repo_groups()), str(configuration.repo_depth()))
+        if stage == Pipeline.SPEC:
+            return ArtifactCache.key(str(self._aosp_spec))
+        raise ValueError('Stage "{}" has no stamp'.format(stage))
+
+    def _manifest(self) -> None:
+        generic_ref, ref, specific_ref = self._manifest_refs
+        heads, tags = self._configuration.repository_local_manifest().remote_refs()
+        if specific_ref not in heads and specific_ref not in tags:
+            raise ValueError('Specific Git reference "{}" does not exist'.format(specific_ref))
+        self._local_manifest = LocalManifest.from_revisions(self._configuration, generic_ref, ref, specific_ref)
+
+    def _run(self, stage: str) -> None:
+        # The stamp is removed first, so that a stage which failed half way is not considered done.
+        stamped = stage in Pipeline._STAMPED_STAGES
+        if stamped and os.path.isfile(self._stamp_path(stage)):
+            os.remove(self._stamp_path(stage))
+        print('[{}] Started'.format(stage))
+        getattr(self, '_{}'.format(stage))()
+        if stamped:
+            if not os.path.isdir(os.path.dirname(self._stamp_path(stage))):
+                os.makedirs(os.path.dirname(self._stamp_path(stage)))
+            with open(self._stamp_path(stage), 'w') as stamp_file:
+                stamp_file.write(self._key(stage))
+        print('[{}] Done'.format(stage))
+
+    def _sign(self) -> None:
+        self._signer.sign(self._configuration, AOSPTree(self._path))
+
+    def _spec(self) -> None:
+        self._aosp_spec.setup(self._configuration, AOSPTree(self._path))
+
+    def _stamp(self, stage: str) -> str:
+        try:
+            with open(self._stamp_path(stage)) as stamp_file:
+                return stamp_file.read().strip()
+        except FileNotFoundError:
+            return ''
+
+    def _stamp_path(self, stage: str) -> str:
+        return os.path.join(self._path, Pipeline._STAMPS_DIRECTORY, Pipeline._STAMP_FILE_NAME_FORMAT.format(stage))
+
+    def _sync(self) -> None:
+        AOSPTree.sync(self._configuration, self._path, self._local_manifest, self._num_cores)
+
+
+def main() -> None:
+    SanityChecks.run()
+
+    configuration = Configuration()
+    cli = PipelineCommandLineInterface(configuration, Pipeline.STAGES)
+    aosp_spec = AOSPSpec(cli.product(), cli.variant())
+    aosp_build = AOSPBuild(cli.make_target(), cli.num_cores(),
+                           None if cli.no_cache() else ArtifactCache(configuration.artifact_cache_path(), 'build'))
+    signer = None
+    if cli.key_path():
+        signer = Signer(cli.key_path(),
+                        None if cli.no_cache() else ArtifactCache(configuration.artifact_cache_path(), 'sign'),
+                        OTAStore(configuration.ota_store_path(), configuration.ota_store_retained()),
+                        verifier=Verifier(cli.key_path(), configuration.verify_timeout_sec()))
+    flasher = None
+    if cli.all() or cli.serials():
+        inventory = DeviceInventory()
+        flasher = Flasher(FlashRegistry(configuration.flash_registry_path(), inventory),
+                          BootTimes(configuration.flash_boot_times_path()), configuration.flash_boot_timeout_sec(),
+                          inventory=inventory)
+    pipeline = Pipeline(configuration, cli.path(), cli.release(), (cli.generic_ref(), cli.ref(), cli.specific_ref()),
+                        aosp_spec, aosp_build, cli.num_cores(), signer, flasher, cli.serials(), cli.forced_stages())
+
+    print(Pipeline.description(cli.path(), cli.release(), pipeline.stages(), pipeline.signed_image_file_path(),
+                               cli.serials()))
+    print(aosp_spec)
+    print(aosp_build)
+    if not cli.press_enter():
+        sys.exit(os.EX_USAGE)  # Set an error code for canceling chained commands.
+
+    with logs.recording(configuration.logs_path(), '{}_pipeline'.format(configuration.default_name()),
+                        configuration.logs_sample_interval_sec()):
+        print(TaskGraph.description(pipeline.run()))
+
+
+if __name__ == '__main__':
+    main()
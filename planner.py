@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import json
+import os
+import subprocess
+
+from aosptree import AOSPTree
+from modules import ModuleIndex
+from typing import Dict, List, Set
+
+
+class BuildPlanner(object):
+    """
+    Work out the make goals needed for building only what changed since the last successful build of an
+    :class:`aosptree.AOSPTree`: the modules owning the changed files, plus the images these modules are installed in.
+
+    The planner falls back to the full make target whenever it cannot tell what changed (no previous build, projects
+    added or removed, commits not available locally because of shallow clones) or when a changed file does not belong to
+    any module (e.g. a change to the build system itself).
+    """
+
+    _RECORD_FILE_NAME_FORMAT = 'last_build-{}.json'
+
+    # Make goal rebuilding the image of each partition, by name of the partition directory in the product output
+    # directory.
+    _IMAGE_GOALS = {
+        'odm': 'odmimage',
+        'product': 'productimage',
+        'ramdisk': 'bootimage',
+        'recovery': 'recoveryimage',
+        'root': 'bootimage',
+        'system': 'systemimage',
+        'system_ext': 'systemextimage',
+        'vendor': 'vendorimage',
+        'vendor_ramdisk': 'vendorbootimage'
+    }
+
+    def __init__(self, aosp_tree: AOSPTree) -> None:
+        self._aosp_tree = aosp_tree
+
+    def plan(self, make_target: str) -> List[str]:
+        """
+        :param make_target: the make target to fall back to.
+        :return: the make goals to build.
+        """
+        changed_files = self._changed_files(make_target)
+        module_index = ModuleIndex.load(self._aosp_tree.path())
+        if changed_files is None or module_index is None:
+            return [make_target]
+        if not changed_files:
+            return list()
+
+        modules = set()
+        for changed_file in changed_files:
+            owners = module_index.owners(changed_file)
+            if not owners:
+                return [make_target]
+            modules.update(owners)
+
+        images = set()
+        for module in modules:
+            images.update(BuildPlanner._image_goals(module_index.installed(module)))
+
+        return sorted(modules) + sorted(images)
+
+    def record(self, make_target: str, project_revisions: Dict[str, str], local_changes: Dict[str, List[str]]) -> None:
+        """
+        Record the state of the tree as the one of the last successful build of a make target.
+
+        :param make_target: the make target which has been built (or planned for).
+        :param project_revisions: the revisions of the projects the build started from, see
+                                  :meth:`aosptree.AOSPTree.project_revisions`.
+        :param local_changes: the local changes the build started from, see :meth:`aosptree.AOSPTree.local_changes`.
+        """
+        record = {
+            'project_revisions': project_revisions,
+            'changed_files': sorted(BuildPlanner._status_paths(local_changes))
+        }
+
+        record_path = self._record_path(make_target)
+        if not os.path.isdir(os.path.dirname(record_path)):
+            os.makedirs(os.path.dirname(record_path))
+        with open(record_path, 'w') as record_file:
+            json.dump(record, record_file, indent=2, sort_keys=True)
+
+    def _changed_files(self, make_target: str) -> Set[str]:
+        # Return None when the changes cannot be determined.
+        try:
+            with open(self._record_path(make_target)) as record_file:
+                record = json.load(record_file)
+        except FileNotFoundError:
+            return None
+
+        project_revisions = self._aosp_tree.project_revisions()
+        if set(project_revisions) != set(record['project_revisions']):
+            return None
+
+        # Files locally modified at the time of the last build must be rebuilt too, as they may have been reverted
+        # since.
+        changed_files = set(record['changed_files'])
+        changed_files.update(BuildPlanner._status_paths(self._aosp_tree.local_changes()))
+        for project_path, revision in project_revisions.items():
+            recorded_revision = record['project_revisions'][project_path]
+            if revision != recorded_revision:
+                try:
+                    changed_files.update(self._aosp_tree.changed_files(project_path, recorded_revision, revision))
+                except subprocess.CalledProcessError:
+                    return None
+
+        return changed_files
+
+    @staticmethod
+    def _image_goals(installed_paths: List[str]) -> Set[str]:
+        image_goals = set()
+        for installed_path in installed_paths:
+            path_parts = os.path.normpath(installed_path).split(os.sep)
+            if path_parts[:3] == ['out', 'target', 'product'] and len(path_parts) > 5:
+                partition = path_parts[4]
+                if partition in BuildPlanner._IMAGE_GOALS:
+                    image_goals.add(BuildPlanner._IMAGE_GOALS[partition])
+        return image_goals
+
+    def _record_path(self, make_target: str) -> str:
+        return self._aosp_tree.state_path(BuildPlanner._RECORD_FILE_NAME_FORMAT.format(make_target))
+
+    @staticmethod
+    def _status_paths(local_changes: Dict[str, List[str]]) -> Set[str]:
+        # Extract the paths from lines of ``git status --porcelain`` (e.g. " M file", "R  old -> new", "?? file").
+        paths = set()
+        for project_path, status_lines in local_changes.items():
+            for status_line in status_lines:
+                for path in status_line[3:].split(' -> '):
+                    paths.add(os.path.join(project_path, path.strip('"')))
+        return paths
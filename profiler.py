@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import csv
+import gzip
+import io
+import os
+import threading
+import time
+
+from commandline import ProfilerCommandLineInterface
+from configuration import Configuration
+from sanity import SanityChecks
+from typing import Dict, List, Tuple
+
+
+class ResourceSampler(object):
+    """
+    Sample the resources used by a process and all its descendants (CPU, RSS, I/O), as well as the state of the host
+    (CPU, I/O wait, memory, swap, disk), at a regular interval while the process runs. Everything is read from
+    ``/proc``. Samples are written as a gzipped CSV time series, one row per interval.
+    """
+
+    EXTENSION = '.samples.csv.gz'
+
+    # Columns of the time series, with their descriptions and units.
+    COLUMNS = [
+        ('time', 'Elapsed time', 's'),
+        ('cpu', 'CPU used by the processes', 'cores'),
+        ('rss', 'Resident memory of the processes', 'MiB'),
+        ('read', 'Read by the processes', 'MiB/s'),
+        ('write', 'Written by the processes', 'MiB/s'),
+        ('host_cpu', 'Host CPU usage', '%'),
+        ('host_iowait', 'Host CPU waiting for I/O', '%'),
+        ('host_available', 'Host memory available', 'MiB'),
+        ('host_swap', 'Host swap used', 'MiB'),
+        ('host_swapping', 'Host pages swapped in and out', 'pages/s'),
+        ('disk_read', 'Host disks read', 'MiB/s'),
+        ('disk_write', 'Host disks written', 'MiB/s'),
+        ('disk_free', 'Free space in the working directory', 'GiB')
+    ]
+
+    _CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+    _SECTOR_SIZE = 512
+
+    def __init__(self, pid: int, interval: float, output_path: str, disk_path: str='.') -> None:
+        self._disk_path = os.path.realpath(disk_path)
+        self._interval = interval
+        self._output_path = output_path
+        self._pid = pid
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._thread.join()
+
+    @staticmethod
+    def _disks() -> Tuple[int, int]:
+        # Sectors read and written by the whole disks (not their partitions, nor virtual devices).
+        sectors_read = 0
+        sectors_written = 0
+        with open('/proc/diskstats') as diskstats_file:
+            for line in diskstats_file:
+                fields = line.split()
+                name = fields[2]
+                if os.path.exists(os.path.join('/sys/block', name, 'device')):
+                    sectors_read += int(fields[5])
+                    sectors_written += int(fields[9])
+        return sectors_read, sectors_written
+
+    @staticmethod
+    def _host_cpu() -> Tuple[int, int, int]:
+        # Total, idle and I/O wait clock ticks of the host.
+        with open('/proc/stat') as stat_file:
+            fields = [int(field) for field in stat_file.readline().split()[1:]]
+        return sum(fields), fields[3], fields[4]
+
+    @staticmethod
+    def _host_memory() -> Dict[str, int]:
+        meminfo = dict()
+        with open('/proc/meminfo') as meminfo_file:
+            for line in meminfo_file:
+                name, value = line.split(':', 1)
+                meminfo[name] = int(value.split()[0]) * 1024
+        with open('/proc/vmstat') as vmstat_file:
+            for line in vmstat_file:
+                name, value = line.split()
+                if name in ['pswpin', 'pswpout']:
+                    meminfo[name] = int(value)
+        return meminfo
+
+    def _process_tree(self) -> Dict[int, Tuple[int, int, int, int]]:
+        # CPU clock ticks, RSS, and bytes read and written, for the process and all its descendants. The ticks of the
+        # reaped children are left out: they were counted while the children ran.
+        children = dict()
+        statistics = dict()
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open('/proc/{}/stat'.format(entry)) as stat_file:
+                    # The name of the command may contain spaces, the fields are after its closing parenthesis.
+                    fields = stat_file.read().rsplit(')', 1)[1].split()
+            except (FileNotFoundError, ProcessLookupError):
+                continue
+            children.setdefault(int(fields[1]), list()).append(int(entry))
+            statistics[int(entry)] = (sum(int(field) for field in fields[11:13]), int(fields[21]) * self._PAGE_SIZE)
+
+        process_tree = dict()
+        pids = [self._pid]
+        while pids:
+            pid = pids.pop()
+            if pid not in statistics:
+                continue
+            pids.extend(children.get(pid, list()))
+            read_bytes = 0
+            write_bytes = 0
+            try:
+                with open('/proc/{}/io'.format(pid)) as io_file:
+                    for line in io_file:
+                        name, value = line.split(':')
+                        if name == 'read_bytes':
+                            read_bytes = int(value)
+                        elif name == 'write_bytes':
+                            write_bytes = int(value)
+            except (FileNotFoundError, PermissionError, ProcessLookupError):
+                pass
+            process_tree[pid] = statistics[pid] + (read_bytes, write_bytes)
+        return process_tree
+
+    def _run(self) -> None:
+        with gzip.open(self._output_path, 'wt', newline='') as output_file:
+            writer = csv.writer(output_file)
+            writer.writerow([name for name, _, _ in ResourceSampler.COLUMNS])
+
+            start_time = time.time()
+            previous_time = start_time
+            previous_processes = dict()
+            previous_host_cpu = ResourceSampler._host_cpu()
+            previous_memory = ResourceSampler._host_memory()
+            previous_disks = ResourceSampler._disks()
+            while not self._stop_event.wait(self._interval):
+                now = time.time()
+                elapsed = now - previous_time
+                processes = self._process_tree()
+                host_cpu = ResourceSampler._host_cpu()
+                memory = ResourceSampler._host_memory()
+                disks = ResourceSampler._disks()
+                disk_statistics = os.statvfs(self._disk_path)
+
+                # Only count what happened during the interval. Processes which appeared during it count from zero.
+                deltas = [0, 0, 0]
+                for pid, (cpu_ticks, _, read_bytes, write_bytes) in processes.items():
+                    previous = previous_processes.get(pid, (0, 0, 0, 0))
+                    deltas[0] += max(0, cpu_ticks - previous[0])
+                    deltas[1] += max(0, read_bytes - previous[2])
+                    deltas[2] += max(0, write_bytes - previous[3])
+                host_ticks = max(1, host_cpu[0] - previous_host_cpu[0])
+
+                writer.writerow([
+                    round(now - start_time, 1),
+                    round(deltas[0] / ResourceSampler._CLOCK_TICKS / elapsed, 2),
+                    round(sum(rss for _, rss, _, _ in processes.values()) / 1024 ** 2, 1),
+                    round(deltas[1] / 1024 ** 2 / elapsed, 2),
+                    round(deltas[2] / 1024 ** 2 / elapsed, 2),
+                    round(100 * (host_ticks - (host_cpu[1] - previous_host_cpu[1])) / host_ticks, 1),
+                    round(100 * (host_cpu[2] - previous_host_cpu[2]) / host_ticks, 1),
+                    round(memory['MemAvailable'] / 1024 ** 2),
+                    round((memory['SwapTotal'] - memory['SwapFree']) / 1024 ** 2),
+                    round((memory['pswpin'] + memory['pswpout'] - previous_memory['pswpin'] -
+                           previous_memory['pswpout']) / elapsed),
+                    round((disks[0] - previous_disks[0]) * ResourceSampler._SECTOR_SIZE / 1024 ** 2 / elapsed, 2),
+                    round((disks[1] - previous_disks[1]) * ResourceSampler._SECTOR_SIZE / 1024 ** 2 / elapsed, 2),
+                    round(disk_statistics.f_bavail * disk_statistics.f_frsize / 1024 ** 3, 1)
+                ])
+                output_file.flush()
+
+                previous_time = now
+                previous_processes = processes
+                previous_host_cpu = host_cpu
+                previous_memory = memory
+                previous_disks = disks
+
+
+class ResourceReport(object):
+    """
+    Summarize a time series written by a :class:`ResourceSampler`, as text or HTML.
+    """
+
+    _CHART_HEIGHT = 120
+    _CHART_WIDTH = 800
+    _SPARKLINE_CHARACTERS = ' ▁▂▃▄▅▆▇█'
+    _SPARKLINE_WIDTH = 60
+
+    def __init__(self, samples_path: str) -> None:
+        self._samples_path = samples_path
+        with gzip.open(samples_path, 'rt', newline='') as samples_file:
+            rows = list(csv.reader(samples_file))
+        self._columns = {name: [float(row[index]) for row in rows[1:]] for index, name in enumerate(rows[0])}
+
+    def diagnosis(self) -> List[str]:
+        """
+        Tell what most likely limited the process, based on rough thresholds.
+        """
+        if not self._columns['time']:
+            return ['Not enough samples']
+
+        diagnosis = list()
+        average = {name: sum(values) / len(values) for name, values in self._columns.items()}
+        if average['host_swapping'] > 100:
+            diagnosis.append('Swapping: {:.0f} pages/s on average, use fewer jobs or add memory'.format(
+                average['host_swapping']))
+        if average['host_iowait'] > 20:
+            diagnosis.append('I/O-bound: the host waits for I/O {:.0f}% of the time'.format(average['host_iowait']))
+        if average['host_cpu'] > 85:
+            diagnosis.append('CPU-bound: the host CPU is {:.0f}% busy on average'.format(average['host_cpu']))
+        if not diagnosis:
+            diagnosis.append('Neither CPU, I/O nor memory bound: {:.1f} cores used on average out of {}'.format(
+                average['cpu'], os.cpu_count()))
+        return diagnosis
+
+    def html(self) -> str:
+        """
+        :return: an HTML section with the diagnosis and a chart per column, see :meth:`html_document`.
+        """
+        output = io.StringIO()
+        output.write('<section>\n<h1>{}</h1>\n<ul>\n'.format(self.name()))
+        for line in self.diagnosis():
+            output.write('<li>{}</li>\n'.format(line))
+        output.write('</ul>\n')
+
+        times = self._columns['time']
+        for name, description, unit in ResourceSampler.COLUMNS[1:]:
+            values = self._columns[name]
+            maximum = max(values + [1e-9])
+            points = ' '.join('{:.1f},{:.1f}'.format(
+                ResourceReport._CHART_WIDTH * elapsed / max(times[-1], 1e-9),
+                ResourceReport._CHART_HEIGHT * (1 - value / maximum)) for elapsed, value in zip(times, values))
+            output.write('<h2>{} ({}), max {:g}</h2>\n'.format(description, unit, max(values + [0])))
+            output.write('<svg width="{}" height="{}" style="border: 1px solid #ccc">'
+                         '<polyline fill="none" stroke="#36c" points="{}"/></svg>\n'.format(
+                             ResourceReport._CHART_WIDTH, ResourceReport._CHART_HEIGHT, points))
+        output.write('</section>\n')
+        return output.getvalue()
+
+    @staticmethod
+    def html_document(title: str, sections: List[str]) -> str:
+        return '<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{0}</title></head><body>\n{1}</body>' \
+               '</html>\n'.format(title, ''.join(sections))
+
+    def name(self) -> str:
+        return os.path.basename(self._samples_path)[:-len(ResourceSampler.EXTENSION)]
+
+    @staticmethod
+    def stages(run_path: str) -> List[str]:
+        # In the order they were run.
+        samples_file_names = sorted((file_name for file_name in os.listdir(run_path)
+                                     if file_name.endswith(ResourceSampler.EXTENSION)),
+                                    key=lambda file_name: os.path.getmtime(os.path.join(run_path, file_name)))
+        return [file_name[:-len(ResourceSampler.EXTENSION)] for file_name in samples_file_names]
+
+    def text(self) -> str:
+        lines = list()
+        lines.append('{} ({} samples over {:.0f}s)'.format(self.name(), len(self._columns['time']),
+                                                            self._columns['time'][-1] if self._columns['time'] else 0))
+        lines.extend('- {}'.format(line) for line in self.diagnosis())
+        for name, description, unit in ResourceSampler.COLUMNS[1:]:
+            values = self._columns[name]
+            if not values:
+                continue
+            lines.append('{:40} avg {:>9.1f} max {:>9.1f} {:8} {}'.format(
+                description, sum(values) / len(values), max(values), unit, ResourceReport._sparkline(values)))
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _sparkline(values: List[float]) -> str:
+        # Average the values into buckets so that the line fits the width.
+        bucket_size = max(1, -(-len(values) // ResourceReport._SPARKLINE_WIDTH))
+        buckets = [values[index:index + bucket_size] for index in range(0, len(values), bucket_size)]
+        averages = [sum(bucket) / len(bucket) for bucket in buckets]
+        maximum = max(averages) or 1
+        steps = len(ResourceReport._SPARKLINE_CHARACTERS) - 1
+        return ''.join(ResourceReport._SPARKLINE_CHARACTERS[round(steps * average / maximum)] for average in averages)
+
+
+def main() -> None:
+    SanityChecks.run()
+
+    configuration = Configuration()
+    cli = ProfilerCommandLineInterface(configuration)
+    run_path = os.path.join(configuration.logs_path(), cli.run())
+    reports = [ResourceReport(os.path.join(run_path, stage + ResourceSampler.EXTENSION))
+               for stage in ResourceReport.stages(run_path) if not cli.stage() or stage == cli.stage()]
+    if not reports:
+        print('No resources were sampled (see SampleIntervalSec in the configuration)')
+        return
+
+    print('\n\n'.join(report.text() for report in reports))
+    if cli.html_path():
+        with open(cli.html_path(), 'w') as html_file:
+            html_file.write(ResourceReport.html_document(cli.run(), [report.html() for report in reports]))
+
+
+if __name__ == '__main__':
+    main()
@@ -25,6 +25,8 @@
 # SOFTWARE.
 #
 
+import contexts
+import logs
 import subprocess
 
 from typing import List
@@ -32,13 +34,24 @@ from typing import List
 
 class RepoAdapter(object):
     """
-    Provides utility functions for issuing repo commands.
+    Provides utility functions for issuing repo commands. They run in the :class:`contexts.ExecutionContext` of the
+    current thread (e.g. the root of a tree, see :func:`contexts.set_cwd`).
     """
 
     INSTALL_DIRECTORY = '.repo'
 
     _REPO = 'repo'
 
+    @staticmethod
+    def forall(command: str, num_jobs: int=0, print_projects: bool=False) -> str:
+        cmd = [RepoAdapter._REPO, 'forall']
+        if num_jobs:
+            cmd.extend(['-j{}'.format(num_jobs)])
+        if print_projects:
+            cmd.extend(['-p'])
+        cmd.extend(['-c', command])
+        return subprocess.check_output(cmd, **contexts.current().kwargs()).decode()
+
     @staticmethod
     def init(url: str, ref: str='', component_groups: List[str]=list(), depth: int=0) -> int:
         cmd = [RepoAdapter._REPO, 'init', '-u', url]
@@ -48,14 +61,22 @@ class RepoAdapter(object):
             cmd.extend(['-g', ','.join(component_groups)])
         if depth:
             cmd.extend(['--depth', str(depth)])
-        return subprocess.check_call(cmd)
+        return subprocess.check_call(cmd, **contexts.current().kwargs())
 
     @staticmethod
-    def manifest() -> str:
-        return subprocess.check_output([RepoAdapter._REPO, 'manifest']).decode()
+    def manifest(revisions_as_hashes: bool=False) -> str:
+        cmd = [RepoAdapter._REPO, 'manifest']
+        if revisions_as_hashes:
+            cmd.extend(['-r'])
+        return subprocess.check_output(cmd, **contexts.current().kwargs()).decode()
 
     @staticmethod
     def sync(num_jobs: int=0, current_branch_only: bool=False, no_tags: bool=False) -> int:
+        return logs.check_call(RepoAdapter.sync_command(num_jobs, current_branch_only, no_tags), 'sync',
+                               **contexts.current().kwargs())
+
+    @staticmethod
+    def sync_command(num_jobs: int=0, current_branch_only: bool=False, no_tags: bool=False) -> List[str]:
         cmd = [RepoAdapter._REPO, 'sync']
         if num_jobs:
             cmd.extend(['-j{}'.format(num_jobs)])
@@ -63,4 +84,4 @@ class RepoAdapter(object):
             cmd.extend(['-c', '--no-clone-bundle'])
         if no_tags:
             cmd.extend(['--no-tags'])
-        return subprocess.check_call(cmd)
+        return cmd
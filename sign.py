@@ -25,17 +25,27 @@
 # SOFTWARE.
 #
 
+import concurrent.futures
 import contexts
+import functools
 import getpass
+import glob
+import logs
 import os
-import subprocess
+import sys
+import time
 
 from aospbuild import AOSPBuild
 from aospspec import AOSPSpec
 from aosptree import AOSPTree
+from cache import ArtifactCache
 from commandline import SignerCommandLineInterface
 from configuration import Configuration
+from otastore import OTAStore
 from sanity import SanityChecks
+from tasks import TaskGraph
+from typing import Dict, List
+from verifier import Verifier
 
 
 class Signer(object):
@@ -45,51 +55,250 @@ class Signer(object):
     - signed target file
     - signed image file
     - signed OTA file
+    - signed incremental OTA files, from previous releases retained in an :class:`otastore.OTAStore`
+
+    Target files of several products can be signed at the same time in a batch, see :meth:`sign_batch`.
+
+    The image and OTA files are generated concurrently once the signed target file exists, then all the signed files are
+    verified when a :class:`verifier.Verifier` is given. When an artifact cache is
+    given, the signed files (except the incremental OTA files) are reused as long as the target file and the keys are
+    the same.
 
     The images/OTAs must be signed for release. See also: https://source.android.com/devices/tech/ota/sign_builds
     """
 
+    TARGET_FILES_GLOB = '*-target_files-*.zip'
+
     # The script ``brillo_update_payload`` is a dependency of the signer scripts but is not built by default.
     _BRILLO_UPDATE_PAYLOAD = 'brillo_update_payload'
+    _TARGET_FILES_INFIX = '-target_files-'
 
-    def __init__(self, key_path: str) -> None:
+    def __init__(self, key_path: str, artifact_cache: ArtifactCache=None, ota_store: OTAStore=None,
+                 base_releases: List[str]=(), latest_bases: int=0, max_jobs: int=0, verifier: Verifier=None) -> None:
+        self._artifact_cache = artifact_cache
+        self._base_releases = base_releases
         self._key_path = key_path
+        self._latest_bases = latest_bases
+        self._max_jobs = max_jobs
+        self._ota_store = ota_store
+        self._verifier = verifier
 
-    def sign(self, configuration: Configuration, aosp_tree: AOSPTree) -> None:
-        with contexts.set_cwd(aosp_tree.path()):
+    @staticmethod
+    def build_dependencies(configuration: Configuration, aosp_tree: AOSPTree) -> None:
+        with contexts.set_cwd(aosp_tree.path()) as context:
             # Build `brillo_update_payload`` if it has not been built yet.
-            if not os.path.isfile(os.path.join(configuration.host_bin_path(), Signer._BRILLO_UPDATE_PAYLOAD)):
+            if not os.path.isfile(context.path(os.path.join(configuration.host_bin_path(),
+                                                            Signer._BRILLO_UPDATE_PAYLOAD))):
                 AOSPBuild(Signer._BRILLO_UPDATE_PAYLOAD).build(configuration, aosp_tree)
 
-            aosp_spec = AOSPSpec.from_aosp_tree(aosp_tree)
-
-            target_file_name = '{}-target_files-eng.{}.zip'.format(aosp_spec.product(), getpass.getuser())
-            signed_target_file_name = '{}-signed_target_files-eng.{}.zip'.format(aosp_spec.product(), getpass.getuser())
-            signed_image_file_name = '{}-signed_img-eng.{}.zip'.format(aosp_spec.product(), getpass.getuser())
-            signed_ota_file_name = '{}-signed_ota-eng.{}.zip'.format(aosp_spec.product(), getpass.getuser())
-            target_file_path = os.path.join(configuration.dist_path(), target_file_name)
-            signed_target_file_path = os.path.join(configuration.dist_path(), signed_target_file_name)
-            signed_image_file_path = os.path.join(configuration.dist_path(), signed_image_file_name)
-            signed_ota_file_path = os.path.join(configuration.dist_path(), signed_ota_file_name)
-
-            # Sign target file.
-            if os.path.exists(signed_target_file_path):
-                os.remove(signed_target_file_path)
-            subprocess.check_call([os.path.join(configuration.release_tools_path(), 'sign_target_files_apks'), '-o',
-                                   '-d', self._key_path, target_file_path, signed_target_file_path])
-
-            # Sign image file.
-            if os.path.exists(signed_image_file_path):
-                os.remove(signed_image_file_path)
-            subprocess.check_call([os.path.join(configuration.release_tools_path(), 'img_from_target_files'),
-                                   signed_target_file_path, signed_image_file_path])
-
-            # Sign OTA file.
-            if os.path.exists(signed_ota_file_path):
-                os.remove(signed_ota_file_path)
-            subprocess.check_call([os.path.join(configuration.release_tools_path(), 'ota_from_target_files'), '-k',
-                                   os.path.join(self._key_path, 'releasekey'), signed_target_file_path,
-                                   signed_ota_file_path])
+    @staticmethod
+    def description(durations: Dict[str, float], errors: Dict[str, str]) -> str:
+        description = list()
+        for product in sorted(set(durations) | set(errors)):
+            description.append('{:30} {:>8} {}'.format(
+                product, '{:.0f}s'.format(durations[product]) if product in durations else '',
+                'FAILED: {}'.format(errors[product]) if product in errors else 'OK'))
+        description.append('=' * max(map(len, description or [''])))
+        description.insert(0, description[-1])
+
+        return '\n'.join(description)
+
+    @staticmethod
+    def max_processes(configuration: Configuration, num_target_files: int) -> int:
+        """
+        :return: how many target files can be signed at the same time given the cores and memory of the host, and the
+                 memory needed for signing (see the Daemon/SignMemory option).
+        """
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 1024 ** 3
+        return max(1, min(num_target_files, os.cpu_count(), memory // max(configuration.daemon_sign_memory(), 1)))
+
+    @staticmethod
+    def product(target_file_path: str) -> str:
+        return os.path.basename(target_file_path).split(Signer._TARGET_FILES_INFIX, 1)[0]
+
+    def sign(self, configuration: Configuration, aosp_tree: AOSPTree) -> None:
+        self.sign_target_file(configuration, aosp_tree,
+                              Signer.target_file_path(configuration, AOSPSpec.from_aosp_tree(aosp_tree)))
+
+    def sign_batch(self, configuration: Configuration, aosp_tree: AOSPTree, target_file_paths: List[str],
+                   max_processes: int=0) -> Dict[str, str]:
+        """
+        Sign several target files at the same time, each in its own process and with its own logs. A failure only
+        affects its own target file.
+
+        :param target_file_paths: paths to the target files, relative to the root of the tree or absolute.
+        :param max_processes: maximum number of target files signed at the same time, 0 for sizing it to the host.
+        :return: the error of each target file which failed, by product.
+        """
+        Signer.build_dependencies(configuration, aosp_tree)
+
+        durations = dict()
+        errors = dict()
+        max_processes = max_processes or Signer.max_processes(configuration, len(target_file_paths))
+        with concurrent.futures.ProcessPoolExecutor(max_processes) as executor:
+            futures = dict()
+            for target_file_path in target_file_paths:
+                run_name = '{}_sign_{}'.format(configuration.default_name(), Signer.product(target_file_path))
+                future = executor.submit(_sign_target_file, self, aosp_tree, target_file_path, run_name)
+                futures[future] = Signer.product(target_file_path)
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    durations[futures[future]] = future.result()
+                except Exception as exception:
+                    errors[futures[future]] = str(exception) or type(exception).__name__
+
+        print(Signer.description(durations, errors))
+        return errors
+
+    def sign_target_file(self, configuration: Configuration, aosp_tree: AOSPTree, target_file_path: str) -> None:
+        """
+        :param target_file_path: path to the target file, relative to the root of the tree or absolute. The signed files
+                                 are written next to it, named after it.
+        """
+        # The commands run from the root of the tree, files are accessed by their absolute path. The paths of the signed
+        # files are stored in the artifact cache as given, relative to the root of the tree.
+        with contexts.set_cwd(aosp_tree.path()) as context:
+            product = Signer.product(target_file_path)
+            signed_target_file_path = Signer.signed_file_path(target_file_path, 'signed_target_files')
+            signed_image_file_path = Signer.signed_file_path(target_file_path, 'signed_img')
+            signed_ota_file_path = Signer.signed_file_path(target_file_path, 'signed_ota')
+            signed_file_paths = [signed_target_file_path, signed_image_file_path, signed_ota_file_path]
+            base_releases = self._bases(product, context.path(target_file_path))
+
+            # Reuse the signed files if this target file has already been signed with these keys.
+            restored = False
+            cache_key = self._cache_key(context.path(target_file_path), signed_file_paths)
+            if cache_key:
+                if self._artifact_cache.lookup(cache_key):
+                    restored_size = self._artifact_cache.restore(cache_key, aosp_tree.path())
+                    print('Restored {} of signed files from the artifact cache'.format(
+                        ArtifactCache.human_readable_size(restored_size)))
+                    restored = True
+                else:
+                    self._artifact_cache.record_miss()
+            if restored and not base_releases:
+                self._verify(configuration, context.path(target_file_path), list(map(context.path, signed_file_paths)))
+                self._store_release(product, context.path(signed_target_file_path), restored)
+                return
+
+            Signer.build_dependencies(configuration, aosp_tree)
+
+            # Image and OTA files only depend on the signed target file, they are generated concurrently.
+            task_graph = TaskGraph()
+            signed_target_file_task = list()
+            incremental_ota_file_paths = list()
+            if not restored:
+                task_graph.add('sign_target_files_apks', lambda: Signer._generate(
+                    context, [os.path.join(configuration.release_tools_path(), 'sign_target_files_apks'), '-o', '-d',
+                              self._key_path, target_file_path, signed_target_file_path], signed_target_file_path,
+                    'sign_target_files_apks'))
+                task_graph.add('img_from_target_files', lambda: Signer._generate(
+                    context, [os.path.join(configuration.release_tools_path(), 'img_from_target_files'),
+                              signed_target_file_path, signed_image_file_path], signed_image_file_path,
+                    'img_from_target_files'), ['sign_target_files_apks'])
+                task_graph.add('ota_from_target_files', lambda: Signer._generate(
+                    context, [os.path.join(configuration.release_tools_path(), 'ota_from_target_files'), '-k',
+                              os.path.join(self._key_path, 'releasekey'), signed_target_file_path,
+                              signed_ota_file_path], signed_ota_file_path, 'ota_from_target_files'),
+                    ['sign_target_files_apks'])
+                signed_target_file_task.append('sign_target_files_apks')
+            for base_release in base_releases:
+                task_name = 'ota_from_target_files-{}'.format(base_release)
+                signed_incremental_ota_file_path = Signer.signed_file_path(
+                    target_file_path, 'signed_incremental_ota-{}'.format(base_release))
+                task_graph.add(task_name, functools.partial(Signer._generate, context, [
+                    os.path.join(configuration.release_tools_path(), 'ota_from_target_files'), '-k',
+                    os.path.join(self._key_path, 'releasekey'), '-i', self._ota_store.path(product, base_release),
+                    signed_target_file_path, signed_incremental_ota_file_path], signed_incremental_ota_file_path,
+                    task_name), signed_target_file_task)
+                incremental_ota_file_paths.append(signed_incremental_ota_file_path)
+            print(TaskGraph.description(task_graph.run(self._max_jobs)))
+
+            # Only store the signed files once they have been verified.
+            self._verify(configuration, context.path(target_file_path),
+                         list(map(context.path, signed_file_paths + incremental_ota_file_paths)))
+            if cache_key and not restored:
+                self._artifact_cache.store(cache_key, aosp_tree.path(), signed_file_paths)
+            self._store_release(product, context.path(signed_target_file_path), restored)
+
+    @staticmethod
+    def signed_file_path(target_file_path: str, kind: str) -> str:
+        # E.g. "product-target_files-eng.user.zip" gives "product-signed_img-eng.user.zip" for the kind "signed_img".
+        return os.path.join(os.path.dirname(target_file_path), os.path.basename(target_file_path).replace(
+            Signer._TARGET_FILES_INFIX, '-{}-'.format(kind), 1))
+
+    @staticmethod
+    def target_file_path(configuration: Configuration, aosp_spec: AOSPSpec) -> str:
+        """
+        :return: path to the target file built for a spec, relative to the root of the tree.
+        """
+        target_file_name = '{}-target_files-eng.{}.zip'.format(aosp_spec.product(), getpass.getuser())
+        return os.path.join(configuration.dist_path(), target_file_name)
+
+    def _bases(self, product: str, target_file_path: str) -> List[str]:
+        # The releases to generate incremental OTA files from: the requested ones, then the most recent ones. The
+        # release being signed is not a base of itself.
+        if self._ota_store is None:
+            return list()
+
+        release, _ = OTAStore.release(target_file_path)
+        stored_releases = self._ota_store.releases(product)
+        for base_release in self._base_releases:
+            if base_release not in stored_releases:
+                raise ValueError('Release "{}" of "{}" is not in the OTA store'.format(base_release, product))
+
+        base_releases = list()
+        for base_release in list(self._base_releases) + stored_releases[:self._latest_bases]:
+            if base_release != release and base_release not in base_releases:
+                base_releases.append(base_release)
+        return base_releases
+
+    def _cache_key(self, target_file_path: str, signed_file_paths: List[str]) -> str:
+        # The key covers the content of the target file and of every file of the keys directory. The names of the
+        # signed files are part of it too, as they are restored under the same names.
+        if self._artifact_cache is None:
+            return ''
+
+        key_files = list()
+        for directory, _, file_names in sorted(os.walk(self._key_path)):
+            for file_name in sorted(file_names):
+                file_path = os.path.join(directory, file_name)
+                key_files.append('{} {}'.format(os.path.relpath(file_path, self._key_path),
+                                                ArtifactCache.hash_file(file_path)))
+
+        return ArtifactCache.key(ArtifactCache.hash_file(target_file_path), '\n'.join(key_files),
+                                 '\n'.join(signed_file_paths))
+
+    @staticmethod
+    def _generate(context: contexts.ExecutionContext, command: List[str], output_path: str, stage: str) -> None:
+        if os.path.exists(context.path(output_path)):
+            os.remove(context.path(output_path))
+        logs.check_call(command, stage, **context.kwargs())
+
+    def _verify(self, configuration: Configuration, target_file_path: str, signed_file_paths: List[str]) -> None:
+        # The record is written next to the signed files, one per product.
+        if self._verifier is None:
+            return
+        record_path = os.path.join(os.path.dirname(target_file_path), '{}-{}'.format(
+            Signer.product(target_file_path), os.path.basename(configuration.signing_info())))
+        self._verifier.verify(signed_file_paths[0], signed_file_paths, record_path)
+
+    def _store_release(self, product: str, signed_target_file_path: str, restored: bool) -> None:
+        # A restored signed target file is most likely in the store already.
+        if self._ota_store is None:
+            return
+        release, _ = OTAStore.release(signed_target_file_path)
+        if not restored or release not in self._ota_store.releases(product):
+            self._ota_store.add(product, signed_target_file_path)
+
+
+def _sign_target_file(signer: Signer, aosp_tree: AOSPTree, target_file_path: str, run_name: str) -> float:
+    # Run in the processes of the pool of :meth:`Signer.sign_batch`, hence a module-level function.
+    configuration = Configuration()
+    start_time = time.time()
+    with logs.recording(configuration.logs_path(), run_name, configuration.logs_sample_interval_sec()):
+        signer.sign_target_file(configuration, aosp_tree, target_file_path)
+    return time.time() - start_time
 
 
 def main() -> None:
@@ -97,8 +306,30 @@ def main() -> None:
 
     configuration = Configuration()
     cli = SignerCommandLineInterface(configuration)
-    signer = Signer(cli.key_path())
-    signer.sign(configuration, AOSPTree(cli.path()))
+    artifact_cache = None if cli.no_cache() else ArtifactCache(configuration.artifact_cache_path(), 'sign')
+    ota_store = OTAStore(configuration.ota_store_path(), configuration.ota_store_retained())
+    verifier = None if cli.no_verify() else Verifier(cli.key_path(), configuration.verify_timeout_sec())
+    signer = Signer(cli.key_path(), artifact_cache, ota_store, cli.base_releases(), cli.latest_bases(), cli.max_jobs(),
+                    verifier)
+    aosp_tree = AOSPTree(cli.path())
+
+    with logs.recording(configuration.logs_path(), '{}_sign'.format(configuration.default_name()),
+                        configuration.logs_sample_interval_sec()):
+        if not cli.all() and not cli.target_file_paths():
+            signer.sign(configuration, aosp_tree)
+            return
+
+        # In batch mode, sign the given target files or all the ones of the dist directory.
+        target_file_paths = cli.target_file_paths()
+        if cli.all():
+            with contexts.set_cwd(aosp_tree.path()) as context:
+                target_file_paths = sorted(os.path.relpath(path, context.cwd()) for path in glob.glob(
+                    context.path(os.path.join(configuration.dist_path(), Signer.TARGET_FILES_GLOB))))
+        if not target_file_paths:
+            print('No target files in "{}"'.format(configuration.dist_path()))
+            sys.exit(1)
+        if signer.sign_batch(configuration, aosp_tree, target_file_paths, cli.max_processes()):
+            sys.exit(1)
 
 
 if __name__ == '__main__':
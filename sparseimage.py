@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import collections
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from cache import ArtifactCache
+from commandline import SparseImageCommandLineInterface
+from configuration import Configuration
+from fastboot import FastbootAdapter
+from sanity import SanityChecks
+from typing import List, Tuple
+
+
+class SparseImage(object):
+    """
+    Convert a raw image into Android sparse images, the format ``fastboot`` sends images in. The raw image is read
+    through a memory map, blocks made of a repeated 32-bit value (mostly zeros) become fill chunks and the others raw
+    chunks. The result is split into files no larger than the ``max-download-size`` of the device: each of them covers
+    the whole image, the blocks held by the other files being marked as "don't care".
+
+    Doing so once per build spares ``fastboot`` from sparsing the image in memory for every device.
+
+    See ``system/core/libsparse/sparse_format.h`` for the format.
+    """
+
+    MAGIC = 0xed26ff3a
+
+    CHUNK_TYPE_RAW = 0xcac1
+    CHUNK_TYPE_FILL = 0xcac2
+    CHUNK_TYPE_DONT_CARE = 0xcac3
+    CHUNK_TYPE_CRC32 = 0xcac4
+
+    # File header: magic, major version, minor version, file header size, chunk header size, block size, number of
+    # blocks, number of chunks, checksum. Chunk header: type, reserved, number of blocks, total size in bytes.
+    _FILE_HEADER_FORMAT = '<IHHHHIIII'
+    _CHUNK_HEADER_FORMAT = '<HHII'
+    _FILE_HEADER_SIZE = struct.calcsize(_FILE_HEADER_FORMAT)
+    _CHUNK_HEADER_SIZE = struct.calcsize(_CHUNK_HEADER_FORMAT)
+
+    _BUFFER_SIZE = 1024 * 1024
+    _PART_PATH_FORMAT = '{}.sparse.{}'
+
+    def __init__(self, image_path: str, block_size: int=4096) -> None:
+        if block_size <= 0 or block_size % 4:
+            raise ValueError('The block size must be a multiple of 4, got {}'.format(block_size))
+        self._block_size = block_size
+        self._chunks = None
+        self._image_path = image_path
+        self._image_size = os.path.getsize(image_path)
+
+    def chunks(self) -> List[Tuple[int, int, int, bytes]]:
+        """
+        :return: the chunks of the image as tuples of the type, the first block, the number of blocks and the fill
+                 value (empty for raw chunks).
+        """
+        if self._chunks is None:
+            self._chunks = list()
+            if self._image_size:
+                with open(self._image_path, 'rb') as image_file:
+                    with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as image_map:
+                        self._chunks = self._scan(image_map)
+        return self._chunks
+
+    def description(self, part_paths: List[str]) -> str:
+        blocks = collections.Counter()
+        for chunk_type, _, num_blocks, _ in self.chunks():
+            blocks[chunk_type] += num_blocks
+
+        description = list()
+        description.append('Image: {} ({})'.format(self._image_path,
+                                                   ArtifactCache.human_readable_size(self._image_size)))
+        description.append('Raw blocks: {}'.format(blocks[SparseImage.CHUNK_TYPE_RAW]))
+        description.append('Fill blocks: {}'.format(blocks[SparseImage.CHUNK_TYPE_FILL]))
+        for part_path in part_paths:
+            description.append('- {} ({})'.format(part_path,
+                                                  ArtifactCache.human_readable_size(os.path.getsize(part_path))))
+        description.append('=' * max(map(len, description)))
+        description.insert(0, description[-1])
+
+        return '\n'.join(description)
+
+    @staticmethod
+    def is_sparse(image_path: str) -> bool:
+        with open(image_path, 'rb') as image_file:
+            magic = image_file.read(4)
+        return len(magic) == 4 and struct.unpack('<I', magic)[0] == SparseImage.MAGIC
+
+    def num_blocks(self) -> int:
+        return -(-self._image_size // self._block_size)
+
+    def split(self, output_prefix: str, max_size: int) -> List[str]:
+        """
+        Write the sparse images.
+
+        :param output_prefix: prefix of the paths of the sparse images, which are numbered from 1.
+        :param max_size: maximum size of each sparse image in bytes, usually the ``max-download-size`` of the device.
+        :return: the paths of the sparse images, to be flashed in that order.
+        """
+        parts = self._pack(max_size)
+        part_paths = list()
+        with open(self._image_path, 'rb') as image_file:
+            image_map = mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) if self._image_size else b''
+            try:
+                for index, part in enumerate(parts, start=1):
+                    part_paths.append(SparseImage._PART_PATH_FORMAT.format(output_prefix, index))
+                    self._write_part(image_map, part, part_paths[-1])
+            finally:
+                if self._image_size:
+                    image_map.close()
+        return part_paths
+
+    @staticmethod
+    def unsparse(sparse_paths: List[str], output_path: str) -> None:
+        """
+        Write the raw image described by sparse images, applying them in order like a device would.
+
+        :param sparse_paths: paths of the sparse images.
+        :param output_path: path of the raw image.
+        """
+        with open(output_path, 'wb') as output_file:
+            total_size = 0
+            for sparse_path in sparse_paths:
+                with open(sparse_path, 'rb') as sparse_file:
+                    total_size = max(total_size, SparseImage._unsparse_file(sparse_file, output_file))
+            output_file.truncate(total_size)
+
+    def _pack(self, max_size: int) -> List[List[Tuple[int, int, int, bytes]]]:
+        # Each file may need a "don't care" chunk before and after its own chunks.
+        budget = max_size - SparseImage._FILE_HEADER_SIZE - 2 * SparseImage._CHUNK_HEADER_SIZE
+        if budget < SparseImage._CHUNK_HEADER_SIZE + self._block_size:
+            raise ValueError('The maximum size of {} bytes cannot hold a single block'.format(max_size))
+
+        parts = [list()]
+        used_size = 0
+        chunks = collections.deque(self.chunks())
+        while chunks:
+            chunk_type, first_block, num_blocks, fill_value = chunks.popleft()
+            if chunk_type == SparseImage.CHUNK_TYPE_FILL:
+                if used_size + SparseImage._CHUNK_HEADER_SIZE + 4 > budget:
+                    parts.append(list())
+                    used_size = 0
+                parts[-1].append((chunk_type, first_block, num_blocks, fill_value))
+                used_size += SparseImage._CHUNK_HEADER_SIZE + 4
+                continue
+
+            # Raw chunks are cut so that they fill up the file.
+            fitting_blocks = (budget - used_size - SparseImage._CHUNK_HEADER_SIZE) // self._block_size
+            if fitting_blocks <= 0:
+                parts.append(list())
+                used_size = 0
+                fitting_blocks = (budget - SparseImage._CHUNK_HEADER_SIZE) // self._block_size
+            if fitting_blocks < num_blocks:
+                chunks.appendleft((chunk_type, first_block + fitting_blocks, num_blocks - fitting_blocks, fill_value))
+                num_blocks = fitting_blocks
+            parts[-1].append((chunk_type, first_block, num_blocks, fill_value))
+            used_size += SparseImage._CHUNK_HEADER_SIZE + num_blocks * self._block_size
+
+        return [part for part in parts if part] or [list()]
+
+    def _scan(self, image_map: mmap.mmap) -> List[Tuple[int, int, int, bytes]]:
+        # Consecutive blocks of the same kind (and the same fill value) are merged into one chunk. The last block is
+        # padded with zeros.
+        chunks = list()
+        repeat = self._block_size // 4
+        zero_block = bytes(self._block_size)
+        for block_index in range(self.num_blocks()):
+            block = image_map[block_index * self._block_size:(block_index + 1) * self._block_size]
+            if len(block) < self._block_size:
+                block += bytes(self._block_size - len(block))
+            if block == zero_block:
+                chunk_type, fill_value = SparseImage.CHUNK_TYPE_FILL, zero_block[:4]
+            elif block[:4] * repeat == block:
+                chunk_type, fill_value = SparseImage.CHUNK_TYPE_FILL, block[:4]
+            else:
+                chunk_type, fill_value = SparseImage.CHUNK_TYPE_RAW, b''
+
+            if chunks and chunks[-1][0] == chunk_type and chunks[-1][3] == fill_value:
+                chunks[-1][2] += 1
+            else:
+                chunks.append([chunk_type, block_index, 1, fill_value])
+
+        return [tuple(chunk) for chunk in chunks]
+
+    @staticmethod
+    def _unsparse_file(sparse_file, output_file) -> int:
+        # Return the size of the raw image.
+        file_header = sparse_file.read(SparseImage._FILE_HEADER_SIZE)
+        if len(file_header) < SparseImage._FILE_HEADER_SIZE:
+            raise ValueError('Truncated sparse image "{}"'.format(sparse_file.name))
+        magic, major_version, _, file_header_size, chunk_header_size, block_size, num_blocks, num_chunks, _ = \
+            struct.unpack(SparseImage._FILE_HEADER_FORMAT, file_header)
+        if magic != SparseImage.MAGIC or major_version != 1:
+            raise ValueError('"{}" is not a sparse image'.format(sparse_file.name))
+        sparse_file.seek(file_header_size)
+
+        block_index = 0
+        for _ in range(num_chunks):
+            chunk_header = sparse_file.read(chunk_header_size)
+            if len(chunk_header) < chunk_header_size:
+                raise ValueError('Truncated sparse image "{}"'.format(sparse_file.name))
+            chunk_type, _, chunk_blocks, total_size = struct.unpack(SparseImage._CHUNK_HEADER_FORMAT,
+                                                                    chunk_header[:SparseImage._CHUNK_HEADER_SIZE])
+            data_size = total_size - chunk_header_size
+            output_file.seek(block_index * block_size)
+            if chunk_type == SparseImage.CHUNK_TYPE_RAW:
+                if data_size != chunk_blocks * block_size:
+                    raise ValueError('Invalid raw chunk in "{}"'.format(sparse_file.name))
+                while data_size:
+                    buffer = sparse_file.read(min(SparseImage._BUFFER_SIZE, data_size))
+                    if not buffer:
+                        raise ValueError('Truncated sparse image "{}"'.format(sparse_file.name))
+                    output_file.write(buffer)
+                    data_size -= len(buffer)
+            elif chunk_type == SparseImage.CHUNK_TYPE_FILL:
+                fill_buffer = sparse_file.read(4) * (SparseImage._BUFFER_SIZE // 4)
+                for buffer_offset in range(0, chunk_blocks * block_size, SparseImage._BUFFER_SIZE):
+                    output_file.write(fill_buffer[:chunk_blocks * block_size - buffer_offset])
+            elif chunk_type == SparseImage.CHUNK_TYPE_CRC32:
+                sparse_file.read(data_size)
+            elif chunk_type != SparseImage.CHUNK_TYPE_DONT_CARE:
+                raise ValueError('Unknown chunk type 0x{:x} in "{}"'.format(chunk_type, sparse_file.name))
+            block_index += chunk_blocks
+
+        if block_index != num_blocks:
+            raise ValueError('The chunks of "{}" do not cover its {} blocks'.format(sparse_file.name, num_blocks))
+        return num_blocks * block_size
+
+    def _write_part(self, image_map: mmap.mmap, part: List[Tuple[int, int, int, bytes]], part_path: str) -> None:
+        chunks = list(part)
+        first_block = part[0][1] if part else 0
+        end_block = part[-1][1] + part[-1][2] if part else 0
+        if first_block:
+            chunks.insert(0, (SparseImage.CHUNK_TYPE_DONT_CARE, 0, first_block, b''))
+        if end_block < self.num_blocks() or not chunks:
+            chunks.append((SparseImage.CHUNK_TYPE_DONT_CARE, end_block, self.num_blocks() - end_block, b''))
+
+        with open(part_path, 'wb') as part_file:
+            part_file.write(struct.pack(SparseImage._FILE_HEADER_FORMAT, SparseImage.MAGIC, 1, 0,
+                                        SparseImage._FILE_HEADER_SIZE, SparseImage._CHUNK_HEADER_SIZE,
+                                        self._block_size, self.num_blocks(), len(chunks), 0))
+            for chunk_type, chunk_first_block, num_blocks, fill_value in chunks:
+                data_size = {SparseImage.CHUNK_TYPE_RAW: num_blocks * self._block_size,
+                             SparseImage.CHUNK_TYPE_FILL: 4}.get(chunk_type, 0)
+                part_file.write(struct.pack(SparseImage._CHUNK_HEADER_FORMAT, chunk_type, 0, num_blocks,
+                                            SparseImage._CHUNK_HEADER_SIZE + data_size))
+                if chunk_type == SparseImage.CHUNK_TYPE_FILL:
+                    part_file.write(fill_value)
+                elif chunk_type == SparseImage.CHUNK_TYPE_RAW:
+                    self._write_raw_data(image_map, part_file, chunk_first_block * self._block_size, data_size)
+
+    def _write_raw_data(self, image_map: mmap.mmap, part_file, offset: int, size: int) -> None:
+        # The data is written straight from the memory map, then padded up to the last block.
+        with memoryview(image_map) as image_view:
+            end = min(offset + size, self._image_size)
+            for buffer_offset in range(offset, end, SparseImage._BUFFER_SIZE):
+                part_file.write(image_view[buffer_offset:min(buffer_offset + SparseImage._BUFFER_SIZE, end)])
+        part_file.write(bytes(offset + size - end))
+
+
+def main() -> None:
+    SanityChecks.run()
+
+    cli = SparseImageCommandLineInterface(Configuration())
+    max_size = cli.max_size() or FastbootAdapter.max_download_size(cli.serial())
+    if not max_size:
+        print('Could not get the maximum download size of the device, use -m/--max-size')
+        sys.exit(1)
+
+    sparse_image = SparseImage(cli.image_path(), cli.block_size())
+    part_paths = sparse_image.split(cli.output_prefix(), max_size)
+    print(sparse_image.description(part_paths))
+
+    if cli.check():
+        with tempfile.TemporaryDirectory() as temp_path:
+            raw_path = os.path.join(temp_path, os.path.basename(cli.image_path()))
+            SparseImage.unsparse(part_paths, raw_path)
+            with open(raw_path, 'r+b') as raw_file:
+                raw_file.truncate(os.path.getsize(cli.image_path()))
+            if ArtifactCache.hash_file(raw_path) != ArtifactCache.hash_file(cli.image_path()):
+                print('The sparse images do not match the raw image')
+                sys.exit(1)
+        print('The sparse images match the raw image')
+
+
+if __name__ == '__main__':
+    main()
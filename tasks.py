@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import concurrent.futures
+import contexts
+import logs
+import time
+
+from typing import Callable, Dict, List
+
+
+class TaskGraph(object):
+    """
+    A :class:`TaskGraph` runs functions (tasks) in threads as soon as the tasks they depend on are done, so that
+    independent tasks run concurrently. The current :class:`logs.LogRun` and :class:`contexts.ExecutionContext` are
+    passed on to the threads.
+
+    When a task fails, no other task is started. The tasks already running are waited for, then the exception of the
+    failing task is raised.
+    """
+
+    def __init__(self) -> None:
+        self._dependencies = dict()
+        self._functions = dict()
+
+    def add(self, name: str, function: Callable[[], None], dependencies: List[str]=()) -> None:
+        """
+        :param name: unique name of the task.
+        :param function: function run by the task, without arguments.
+        :param dependencies: names of the tasks which must be done before this one starts. They must have been added
+                             already, which also prevents cycles.
+        """
+        if name in self._functions:
+            raise ValueError('Task "{}" already exists'.format(name))
+        for dependency in dependencies:
+            if dependency not in self._functions:
+                raise ValueError('Task "{}" depends on unknown task "{}"'.format(name, dependency))
+        self._dependencies[name] = set(dependencies)
+        self._functions[name] = function
+
+    @staticmethod
+    def description(timings: Dict[str, float]) -> str:
+        description = list()
+        for name in sorted(timings, key=timings.get, reverse=True):
+            description.append('{}: {:.1f}s'.format(name, timings[name]))
+        description.append('-' * max(map(len, description or [''])))
+        description.insert(0, description[-1])
+
+        return '\n'.join(description)
+
+    def run(self, max_workers: int=0) -> Dict[str, float]:
+        """
+        :param max_workers: maximum number of tasks running at the same time, 0 for no limit.
+        :return: the duration of each task in seconds.
+        """
+        context = contexts.current()
+        log_run = logs.current_run()
+        timings = dict()
+
+        def run_task(name: str) -> None:
+            start_time = time.time()
+            with contexts.attached(context), logs.attached(log_run):
+                self._functions[name]()
+            timings[name] = time.time() - start_time
+
+        pending = dict(self._dependencies)
+        done = set()
+        exception = None
+        with concurrent.futures.ThreadPoolExecutor(max_workers or max(len(pending), 1)) as executor:
+            running = dict()
+            while pending or running:
+                if exception is None:
+                    for name in sorted(pending):
+                        if pending[name] <= done:
+                            running[executor.submit(run_task, name)] = name
+                            del pending[name]
+                if not running:
+                    break
+                finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.exception() is None:
+                        done.add(name)
+                    elif exception is None:
+                        exception = future.exception()
+
+        if exception is not None:
+            raise exception
+        return timings
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import argparse
+import os
+import shutil
+import socketserver
+import stat
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+
+from adbclient import ADBClient
+from commandline import CommandLineInterface
+from configuration import Configuration
+from sanity import SanityChecks
+from typing import Dict
+
+
+class FakeADBServer(object):
+    """
+    A stand-in for the ADB server and its devices, for trying out :class:`adbclient.ADBClient` without a device. The file system
+    of each device is a local directory, and shell commands run on the host, in the directory of the device. A
+    ``getprop`` command reading the properties of the device is put first in their path.
+    """
+
+    # Prints all the properties like Android does, or the value of one.
+    _GETPROP = """#!/bin/sh
+if [ $# -eq 0 ]; then
+    sed 's/^\\([^=]*\\)=\\(.*\\)$/[\\1]: [\\2]/' "$FAKE_ADB_PROPERTIES"
+else
+    grep "^$1=" "$FAKE_ADB_PROPERTIES" | head -n 1 | cut -d = -f 2-
+fi
+"""
+
+    def __init__(self, root_path: str, host: str='127.0.0.1', port: int=0) -> None:
+        self._changed = threading.Condition()
+        self._devices = dict()
+        self._generation = 0
+        self._last_transport_id = 0
+        self._root_path = root_path
+        self._server = socketserver.ThreadingTCPServer((host, port), self._request_handler())
+        self._server.daemon_threads = True
+
+        getprop_path = os.path.join(self._bin_path(), 'getprop')
+        os.makedirs(self._bin_path(), exist_ok=True)
+        with open(getprop_path, 'w') as getprop_file:
+            getprop_file.write(FakeADBServer._GETPROP)
+        os.chmod(getprop_path, 0o755)
+
+    def add_device(self, serial: str, properties: Dict[str, str], state: str='device') -> None:
+        if not os.path.isdir(self.device_path(serial)):
+            os.makedirs(self.device_path(serial))
+        # Like with the real server, a device gets a new transport each time it connects.
+        with self._changed:
+            self._last_transport_id += 1
+            self._devices[serial] = {'properties': dict(properties), 'state': state,
+                                     'transport_id': self._last_transport_id}
+            self._write_properties(serial)
+            self._notify()
+
+    def device_path(self, serial: str) -> str:
+        return os.path.join(self._root_path, serial)
+
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def remove_device(self, serial: str) -> None:
+        with self._changed:
+            self._devices.pop(serial, None)
+            self._notify()
+
+    def set_property(self, serial: str, name: str, value: str) -> None:
+        with self._changed:
+            self._devices[serial]['properties'][name] = value
+            self._write_properties(serial)
+
+    def shutdown(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def start(self) -> None:
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def _bin_path(self) -> str:
+        return os.path.join(self._root_path, '.bin')
+
+    def _devices_string(self, long: bool=False) -> str:
+        if long:
+            return ''.join('{:22} {} product:{} model:{} device:{} transport_id:{}\n'.format(
+                serial, device['state'], device['properties'].get('ro.product.name', ''),
+                device['properties'].get('ro.product.model', '').replace(' ', '_'),
+                device['properties'].get('ro.product.device', ''), device['transport_id'])
+                for serial, device in sorted(self._devices.items()))
+        return ''.join('{}\t{}\n'.format(serial, self._devices[serial]['state']) for serial in sorted(self._devices))
+
+    def _notify(self) -> None:
+        # Must be called with the condition held.
+        self._generation += 1
+        self._changed.notify_all()
+
+    def _request_handler(self) -> type:
+        server = self
+
+        class RequestHandler(socketserver.BaseRequestHandler):
+            def handle(self) -> None:
+                try:
+                    self._handle()
+                except (BrokenPipeError, ConnectionError):
+                    pass
+
+            def _fail(self, message: str) -> None:
+                self.request.sendall(b'FAIL' + '{:04x}{}'.format(len(message), message).encode())
+
+            def _handle(self) -> None:
+                serial = None
+                while True:
+                    request = self._read_request()
+                    if request is None:
+                        return
+                    if serial is None and request.startswith('host:transport'):
+                        with server._changed:
+                            serials = sorted(server._devices)
+                        serial = request[len('host:transport:'):] if request.startswith('host:transport:') else \
+                            (serials[0] if len(serials) == 1 else '')
+                        if serial not in serials:
+                            self._fail('device \'{}\' not found'.format(serial))
+                            return
+                        self._okay()
+                    elif serial is None:
+                        self._handle_host(request)
+                        return
+                    else:
+                        self._okay()
+                        self._handle_device(serial, request)
+                        return
+
+            def _handle_device(self, serial: str, service: str) -> None:
+                if service.startswith('shell,v2,raw:'):
+                    self._shell(serial, service[len('shell,v2,raw:'):])
+                elif service == 'sync:':
+                    self._sync(server.device_path(serial))
+                elif service.startswith('reboot:'):
+                    # The device goes away, then comes back unless it stays in the bootloader.
+                    with server._changed:
+                        properties = server._devices[serial]['properties']
+                    server.remove_device(serial)
+                    if service != 'reboot:bootloader':
+                        threading.Timer(0.5, server.add_device, (serial, properties)).start()
+
+            def _handle_host(self, request: str) -> None:
+                if request == 'host:version':
+                    self._okay('0029')
+                elif request in ('host:devices', 'host:devices-l'):
+                    with server._changed:
+                        self._okay(server._devices_string(request == 'host:devices-l'))
+                elif request == 'host:track-devices':
+                    with server._changed:
+                        generation = server._generation
+                        self._okay(server._devices_string())
+                    while True:
+                        with server._changed:
+                            server._changed.wait_for(lambda: server._generation != generation)
+                            generation = server._generation
+                            devices = server._devices_string()
+                        self._send_string(devices)
+                else:
+                    self._fail('unknown host service')
+
+            def _okay(self, string: str=None) -> None:
+                self.request.sendall(b'OKAY')
+                if string is not None:
+                    self._send_string(string)
+
+            def _read_request(self) -> str:
+                size = self._receive(4)
+                return self._receive(int(size, 16)).decode() if size else None
+
+            def _receive(self, size: int) -> bytes:
+                data = bytearray()
+                while len(data) < size:
+                    buffer = self.request.recv(size - len(data))
+                    if not buffer:
+                        if data:
+                            raise ConnectionError('Truncated request')
+                        return b''
+                    data.extend(buffer)
+                return bytes(data)
+
+            def _send_string(self, string: str) -> None:
+                self.request.sendall('{:04x}{}'.format(len(string.encode()), string).encode())
+
+            def _shell(self, serial: str, command: str) -> None:
+                # The standard output is forwarded as it comes, the error output once the command is done.
+                environment = dict(os.environ, FAKE_ADB_PROPERTIES=server._properties_path(serial),
+                                   PATH=os.pathsep.join((server._bin_path(), os.environ.get('PATH', ''))))
+                process = subprocess.Popen(command, shell=True, cwd=server.device_path(serial), env=environment,
+                                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                stderr = list()
+                stderr_thread = threading.Thread(target=lambda: stderr.append(process.stderr.read()))
+                stderr_thread.start()
+                try:
+                    for buffer in iter(lambda: os.read(process.stdout.fileno(), 65536), b''):
+                        self._shell_packet(ADBClient._SHELL_STDOUT, buffer)
+                finally:
+                    if process.poll() is None:
+                        process.kill()
+                    stderr_thread.join()
+                    process.stdout.close()
+                    process.stderr.close()
+                self._shell_packet(ADBClient._SHELL_STDERR, stderr[0])
+                self._shell_packet(ADBClient._SHELL_EXIT, bytes([process.wait() & 0xff]))
+
+            def _shell_packet(self, packet_id: int, data: bytes) -> None:
+                self.request.sendall(struct.pack(ADBClient._SHELL_PACKET_HEADER_FORMAT, packet_id, len(data)) + data)
+
+            def _sync(self, device_path: str) -> None:
+                def local_path(remote_path: str) -> str:
+                    return os.path.join(device_path, os.path.normpath('/' + remote_path).lstrip('/'))
+
+                while True:
+                    header = self._receive(ADBClient._SYNC_HEADER_SIZE)
+                    if not header:
+                        return
+                    request_id, size = struct.unpack(ADBClient._SYNC_HEADER_FORMAT, header)
+                    if request_id == b'QUIT':
+                        return
+                    data = self._receive(size).decode()
+                    if request_id == b'STAT':
+                        try:
+                            file_stat = os.stat(local_path(data))
+                            values = (file_stat.st_mode, file_stat.st_size, int(file_stat.st_mtime))
+                        except FileNotFoundError:
+                            values = (0, 0, 0)
+                        self.request.sendall(b'STAT' + struct.pack(ADBClient._SYNC_STAT_FORMAT, *values))
+                    elif request_id == b'LIST':
+                        for name in sorted(os.listdir(local_path(data))):
+                            file_stat = os.stat(os.path.join(local_path(data), name))
+                            self.request.sendall(b'DENT' + struct.pack(
+                                ADBClient._SYNC_DENT_FORMAT, file_stat.st_mode, file_stat.st_size,
+                                int(file_stat.st_mtime), len(name.encode())) + name.encode())
+                        self.request.sendall(b'DONE' + bytes(struct.calcsize(ADBClient._SYNC_DENT_FORMAT)))
+                    elif request_id == b'SEND':
+                        self._sync_send(local_path(data.rsplit(',', 1)[0]))
+                    elif request_id == b'RECV':
+                        self._sync_receive(local_path(data))
+
+            def _sync_receive(self, file_path: str) -> None:
+                try:
+                    with open(file_path, 'rb') as device_file:
+                        for buffer in iter(lambda: device_file.read(ADBClient._SYNC_MAX_DATA_SIZE), b''):
+                            self.request.sendall(struct.pack(ADBClient._SYNC_HEADER_FORMAT, b'DATA', len(buffer)) +
+                                                 buffer)
+                except OSError as error:
+                    message = str(error).encode()
+                    self.request.sendall(struct.pack(ADBClient._SYNC_HEADER_FORMAT, b'FAIL', len(message)) + message)
+                    return
+                self.request.sendall(struct.pack(ADBClient._SYNC_HEADER_FORMAT, b'DONE', 0))
+
+            def _sync_send(self, file_path: str) -> None:
+                if not os.path.isdir(os.path.dirname(file_path)):
+                    os.makedirs(os.path.dirname(file_path))
+                with open(file_path, 'wb') as device_file:
+                    while True:
+                        request_id, size = struct.unpack(ADBClient._SYNC_HEADER_FORMAT,
+                                                         self._receive(ADBClient._SYNC_HEADER_SIZE))
+                        if request_id == b'DONE':
+                            break
+                        device_file.write(self._receive(size))
+                self.request.sendall(struct.pack(ADBClient._SYNC_HEADER_FORMAT, b'OKAY', 0))
+
+        return RequestHandler
+
+    def _properties_path(self, serial: str) -> str:
+        return os.path.join(self._root_path, '.{}.properties'.format(serial))
+
+    def _write_properties(self, serial: str) -> None:
+        # Must be called with the condition held. The file is replaced at once, so that it is never read half written.
+        properties = self._devices[serial]['properties']
+        with open(self._properties_path(serial) + '.tmp', 'w') as properties_file:
+            properties_file.write(''.join('{}={}\n'.format(name, properties[name]) for name in sorted(properties)))
+        os.replace(self._properties_path(serial) + '.tmp', self._properties_path(serial))
+
+
+class FakeADBServerCommandLineInterface(CommandLineInterface):
+    def __init__(self, configuration: Configuration) -> None:
+        parser = argparse.ArgumentParser(description='Measure the latency of the commands issued to the ADB server '
+                                                     'directly, against a local stand-in server',
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+        # Optional arguments.
+        parser.add_argument('-i', '--iterations',
+                            help='number of times each command is issued',
+                            default=100,
+                            type=int)
+
+        # Parse and sanity checks.
+        self._args = parser.parse_args()
+        if self.iterations() <= 0:
+            parser.error('-i/--iterations must be greater than zero')
+
+    def iterations(self) -> int:
+        return self._args.iterations
+
+
+def benchmark(iterations: int) -> str:
+    """
+    Measure the latency of commands issued to a :class:`FakeADBServer` by :class:`adbclient.ADBClient`, and by the ``adb``
+    binary if it is installed.
+
+    :return: a report of the latencies.
+    """
+    with tempfile.TemporaryDirectory() as root_path:
+        server = FakeADBServer(root_path)
+        server.add_device('fake-0', {'ro.build.fingerprint': 'fake/fingerprint'})
+        server.start()
+        try:
+            client = ADBClient(port=server.port())
+            commands = [('client devices', client.devices),
+                        ('client getprop', lambda: client.shell('getprop ro.build.fingerprint', 'fake-0'))]
+            if shutil.which('adb'):
+                commands.append(('binary devices', lambda: subprocess.check_output(
+                    ['adb', '-P', str(server.port()), 'devices'])))
+
+            latencies = list()
+            for name, command in commands:
+                start_time = time.time()
+                for _ in range(iterations):
+                    command()
+                latencies.append((name, (time.time() - start_time) / iterations))
+        finally:
+            server.shutdown()
+
+    report = ['{:16} {:8.2f} ms'.format(name, latency * 1000) for name, latency in latencies]
+    report.append('=' * max(map(len, report)))
+    report.insert(0, report[-1])
+
+    return '\n'.join(report)
+
+
+def main() -> None:
+    SanityChecks.run()
+
+    cli = FakeADBServerCommandLineInterface(Configuration())
+    print(benchmark(cli.iterations()))
+
+
+if __name__ == '__main__':
+    main()
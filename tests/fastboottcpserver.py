@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import argparse
+import hashlib
+import os
+import socketserver
+import struct
+import tempfile
+import threading
+import time
+
+from cache import ArtifactCache
+from commandline import CommandLineInterface
+from configuration import Configuration
+from fastboottcp import FastbootTCPClient
+from sanity import SanityChecks
+from typing import Dict, List, Tuple
+
+
+class FastbootTCPServer(object):
+    """
+    A stand-in for a device in fastboot mode over TCP, for trying out :class:`fastboottcp.FastbootTCPClient` and measuring its
+    throughput. Downloaded data is hashed then thrown away, and flashing a partition records the hash of the data.
+    """
+
+    _BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, host: str='127.0.0.1', port: int=0, max_download_size: int=512 * 1024 * 1024) -> None:
+        self._lock = threading.Lock()
+        self._max_download_size = max_download_size
+        self._partitions = dict()
+        self._server = socketserver.ThreadingTCPServer((host, port), self._request_handler())
+        self._server.daemon_threads = True
+
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def partitions(self) -> Dict[str, str]:
+        """
+        :return: the hash of the data flashed on each partition (empty for erased partitions).
+        """
+        with self._lock:
+            return dict(self._partitions)
+
+    def serve(self) -> None:
+        self._server.serve_forever()
+
+    def shutdown(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def start(self) -> None:
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def _handle(self, request: bytes, downloaded_hash: str) -> List[bytes]:
+        command, _, argument = request.decode().partition(':')
+        if command == 'getvar':
+            variables = {'current-slot': 'a', 'max-download-size': '0x{:x}'.format(self._max_download_size),
+                         'partition-type:metadata': 'ext4', 'partition-type:userdata': 'f2fs', 'product': 'stand-in',
+                         'serialno': 'STANDIN0'}
+            if argument == 'all':
+                return ['INFO{}: {}'.format(name, variables[name]).encode() for name in sorted(variables)] + [b'OKAY']
+            return [b'OKAY' + variables[argument].encode() if argument in variables else b'FAILunknown variable']
+        elif command == 'flash':
+            if not downloaded_hash:
+                return [b'FAILno data downloaded']
+            with self._lock:
+                self._partitions[argument] = downloaded_hash
+            return [b'OKAY']
+        elif command == 'erase':
+            with self._lock:
+                self._partitions[argument] = ''
+            return [b'OKAY']
+        elif command in ('reboot', 'reboot-bootloader'):
+            return [b'OKAY']
+        return [b'FAILunknown command']
+
+    def _request_handler(self) -> type:
+        server = self
+
+        class RequestHandler(socketserver.BaseRequestHandler):
+            def handle(self) -> None:
+                if self._receive(len(FastbootTCPClient._HANDSHAKE)) != FastbootTCPClient._HANDSHAKE:
+                    return
+                self.request.sendall(FastbootTCPClient._HANDSHAKE)
+
+                downloaded_hash = ''
+                while True:
+                    length = self._receive(FastbootTCPClient._LENGTH_SIZE)
+                    if not length:
+                        return
+                    request = self._receive(struct.unpack(FastbootTCPClient._LENGTH_FORMAT, length)[0])
+                    if request.startswith(b'download:'):
+                        downloaded_hash = self._download(int(request[len(b'download:'):], 16))
+                        continue
+                    for response in server._handle(request, downloaded_hash):
+                        self._send(response)
+                    if request.startswith(b'reboot'):
+                        return
+
+            def _download(self, size: int) -> str:
+                if size > server._max_download_size:
+                    self._send(b'FAILdata too large')
+                    return ''
+                self._send('DATA{:08x}'.format(size).encode())
+
+                # The data may come in several packets.
+                digest = hashlib.sha256()
+                remaining_size = size
+                while remaining_size:
+                    packet_size = struct.unpack(FastbootTCPClient._LENGTH_FORMAT,
+                                                self._receive(FastbootTCPClient._LENGTH_SIZE))[0]
+                    remaining_size -= packet_size
+                    while packet_size:
+                        buffer = self.request.recv(min(packet_size, FastbootTCPServer._BUFFER_SIZE))
+                        if not buffer:
+                            raise ConnectionError('The client closed the connection')
+                        digest.update(buffer)
+                        packet_size -= len(buffer)
+                self._send(b'OKAY')
+                return digest.hexdigest()
+
+            def _receive(self, size: int) -> bytes:
+                data = bytearray()
+                while len(data) < size:
+                    buffer = self.request.recv(size - len(data))
+                    if not buffer:
+                        return b''
+                    data.extend(buffer)
+                return bytes(data)
+
+            def _send(self, data: bytes) -> None:
+                self.request.sendall(struct.pack(FastbootTCPClient._LENGTH_FORMAT, len(data)) + data)
+
+        return RequestHandler
+
+
+class FastbootTCPServerCommandLineInterface(CommandLineInterface):
+    def __init__(self, configuration: Configuration) -> None:
+        parser = argparse.ArgumentParser(description='Measure the throughput of the fastboot over TCP client against a '
+                                                     'local stand-in device, or serve the stand-in device',
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+        # Optional arguments.
+        parser.add_argument('-i', '--iterations',
+                            help='number of times the image is flashed',
+                            default=3,
+                            type=int)
+        parser.add_argument('-p', '--port',
+                            help='port the stand-in device listens on when serving',
+                            default=5554,
+                            type=int)
+        parser.add_argument('-s', '--size',
+                            help='size of the image to flash in MiB',
+                            default=256,
+                            type=int)
+        parser.add_argument('--serve',
+                            help='serve the stand-in device instead of measuring the throughput',
+                            action='store_true')
+
+        # Parse and sanity checks.
+        self._args = parser.parse_args()
+        if self.iterations() <= 0:
+            parser.error('-i/--iterations must be greater than zero')
+        if self.size_mib() <= 0:
+            parser.error('-s/--size must be greater than zero')
+
+    def iterations(self) -> int:
+        return self._args.iterations
+
+    def port(self) -> int:
+        return self._args.port
+
+    def serve(self) -> bool:
+        return self._args.serve
+
+    def size_mib(self) -> int:
+        return self._args.size
+
+
+def benchmark(size_mib: int, iterations: int) -> str:
+    """
+    Flash an image on a :class:`FastbootTCPServer` through a single session, then through a new session per command
+    like the ``fastboot`` binary does.
+
+    :return: a report of the throughputs.
+    """
+    server = FastbootTCPServer()
+    server.start()
+    host, port = server.address()
+    try:
+        with tempfile.NamedTemporaryFile() as image_file:
+            for _ in range(size_mib):
+                image_file.write(os.urandom(1024 * 1024))
+            image_file.flush()
+            image_hash = ArtifactCache.hash_file(image_file.name)
+
+            durations = dict()
+            start_time = time.time()
+            client = FastbootTCPClient(host, port)
+            for _ in range(iterations):
+                client.flash('system', image_file.name)
+            client.close()
+            durations['one session'] = time.time() - start_time
+
+            start_time = time.time()
+            for _ in range(iterations):
+                client = FastbootTCPClient(host, port)
+                client.flash('system', image_file.name)
+                client.close()
+            durations['session per flash'] = time.time() - start_time
+
+            if server.partitions().get('system') != image_hash:
+                raise ValueError('The flashed image does not match the original one')
+    finally:
+        server.shutdown()
+
+    report = list()
+    for name, duration in sorted(durations.items()):
+        report.append('{:20} {:8.2f}s {:8.1f} MiB/s'.format(name, duration, size_mib * iterations / duration))
+    report.append('=' * max(map(len, report)))
+    report.insert(0, report[-1])
+
+    return '\n'.join(report)
+
+
+def main() -> None:
+    SanityChecks.run()
+
+    cli = FastbootTCPServerCommandLineInterface(Configuration())
+    if cli.serve():
+        server = FastbootTCPServer('0.0.0.0', cli.port())
+        print('Serving on port {}'.format(server.address()[1]))
+        try:
+            server.serve()
+        except KeyboardInterrupt:
+            server.shutdown()
+    else:
+        print(benchmark(cli.size_mib(), cli.iterations()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import os
+import tempfile
+import unittest
+
+from adbclient import ADBClient
+from fakeadbserver import FakeADBServer
+
+
+class ADBClientTest(unittest.TestCase):
+    """
+    Drive an :class:`adbclient.ADBClient` against a :class:`fakeadbserver.FakeADBServer`.
+    """
+
+    SERIAL = 'fake-0'
+
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self._server = FakeADBServer(os.path.join(self._directory.name, 'devices'))
+        self._server.add_device(ADBClientTest.SERIAL, {'ro.build.fingerprint': 'fake/fingerprint',
+                                                       'ro.product.name': 'fake_product'})
+        self._server.start()
+        self._client = ADBClient(port=self._server.port(), timeout_sec=10)
+
+    def tearDown(self) -> None:
+        self._server.shutdown()
+        self._directory.cleanup()
+
+    def test_devices(self) -> None:
+        self.assertEqual(self._client.devices(), ['{}\tdevice'.format(ADBClientTest.SERIAL)])
+        fields = self._client.devices(long=True)[0].split()
+        self.assertEqual(fields[:2], [ADBClientTest.SERIAL, 'device'])
+        self.assertIn('product:fake_product', fields)
+        self.assertIn('transport_id:1', fields)
+
+    def test_is_running(self) -> None:
+        self.assertTrue(self._client.is_running())
+        self._server.shutdown()
+        self.assertFalse(self._client.is_running())
+        self._server = FakeADBServer(os.path.join(self._directory.name, 'devices'))
+        self._server.start()  # For the tear down.
+
+    def test_pull_missing(self) -> None:
+        with self.assertRaises(FileNotFoundError):
+            self._client.pull(['/missing'], self._directory.name, ADBClientTest.SERIAL)
+
+    def test_push_pull_directory(self) -> None:
+        local_path = os.path.join(self._directory.name, 'local')
+        files = {'a.txt': b'a' * 100, os.path.join('sub', 'b.bin'): os.urandom(200000), 'empty': b''}
+        for relative_path, content in files.items():
+            self._write(os.path.join(local_path, relative_path), content)
+
+        # Pushed into an existing directory, like "adb push" does.
+        os.mkdir(os.path.join(self._server.device_path(ADBClientTest.SERIAL), 'sdcard'))
+        self._client.push([local_path], '/sdcard', ADBClientTest.SERIAL)
+        for relative_path, content in files.items():
+            self.assertEqual(self._read(os.path.join(self._server.device_path(ADBClientTest.SERIAL), 'sdcard',
+                                                     'local', relative_path)), content)
+
+        pulled_path = os.path.join(self._directory.name, 'pulled')
+        os.mkdir(pulled_path)
+        self._client.pull(['/sdcard/local'], pulled_path, ADBClientTest.SERIAL)
+        for relative_path, content in files.items():
+            self.assertEqual(self._read(os.path.join(pulled_path, 'local', relative_path)), content)
+
+    def test_push_pull_files(self) -> None:
+        content = os.urandom(100000)
+        local_path = self._write(os.path.join(self._directory.name, 'file'), content)
+        self._client.push_files([(local_path, '/data/1'), (local_path, '/data/2')], ADBClientTest.SERIAL)
+        pulled_path = os.path.join(self._directory.name, 'pulled', 'file')
+        self._client.pull_files([('/data/2', pulled_path)], ADBClientTest.SERIAL)
+        self.assertEqual(self._read(pulled_path), content)
+        with self.assertRaises(RuntimeError):
+            self._client.pull_files([('/data/3', pulled_path)], ADBClientTest.SERIAL)
+
+    def test_reboot(self) -> None:
+        # The device goes away, then comes back on a new transport.
+        self._client.reboot(serial=ADBClientTest.SERIAL)
+        self._client.wait_for_disconnect(ADBClientTest.SERIAL, timeout_sec=5)
+        self._client.wait_for_device(ADBClientTest.SERIAL, timeout_sec=5)
+        self.assertIn('transport_id:2', self._client.devices(long=True)[0].split())
+
+    def test_shell(self) -> None:
+        self.assertEqual(self._client.shell('echo out; echo err >&2; exit 3', ADBClientTest.SERIAL),
+                         (3, b'out\n', b'err\n'))
+        self.assertEqual(self._client.shell('true')[0], 0)
+        self.assertEqual(self._client.shell('getprop ro.build.fingerprint', ADBClientTest.SERIAL),
+                         (0, b'fake/fingerprint\n', b''))
+        self._server.set_property(ADBClientTest.SERIAL, 'sys.boot_completed', '1')
+        exit_code, output, _ = self._client.shell('getprop', ADBClientTest.SERIAL)
+        self.assertEqual(exit_code, 0)
+        self.assertIn(b'[sys.boot_completed]: [1]\n', output)
+
+    def test_shell_timeout(self) -> None:
+        # Commands printing nothing for longer than the timeout of the client still complete.
+        client = ADBClient(port=self._server.port(), timeout_sec=0.5)
+        self.assertEqual(client.shell('sleep 1; echo done', ADBClientTest.SERIAL), (0, b'done\n', b''))
+        with self.assertRaises(TimeoutError):
+            client.shell('sleep 5', ADBClientTest.SERIAL, timeout_sec=0.5)
+
+    def test_shell_lines(self) -> None:
+        self.assertEqual(list(self._client.shell_lines('printf "1\\n2\\n3"', ADBClientTest.SERIAL)), ['1', '2', '3'])
+        with self.assertRaises(TimeoutError):
+            list(self._client.shell_lines('sleep 5', ADBClientTest.SERIAL, timeout_sec=0.5))
+
+    def test_track_devices(self) -> None:
+        tracking = self._client.track_devices(timeout_sec=5)
+        self.assertEqual(next(tracking), {ADBClientTest.SERIAL: 'device'})
+        self._server.add_device('fake-1', dict(), 'unauthorized')
+        self.assertEqual(next(tracking), {ADBClientTest.SERIAL: 'device', 'fake-1': 'unauthorized'})
+        self._server.remove_device(ADBClientTest.SERIAL)
+        self.assertEqual(next(tracking), {'fake-1': 'unauthorized'})
+        tracking.close()
+
+        with self.assertRaises(TimeoutError):
+            self._client.wait_for_device('fake-2', timeout_sec=0.5)
+
+    def test_unknown_device(self) -> None:
+        with self.assertRaises(RuntimeError):
+            self._client.shell('true', 'unknown')
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, 'rb') as file_object:
+            return file_object.read()
+
+    @staticmethod
+    def _write(path: str, content: bytes) -> str:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file_object:
+            file_object.write(content)
+        return path
+
+
+if __name__ == '__main__':
+    unittest.main()
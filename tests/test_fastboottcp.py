@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import hashlib
+import os
+import socket
+import tempfile
+import threading
+import unittest
+import zipfile
+
+from fastboot import FastbootAdapter
+from fastboottcp import FastbootTCPClient
+from fastboottcpserver import FastbootTCPServer
+from imagearchive import ImageArchive
+
+
+class FastbootTCPClientTest(unittest.TestCase):
+    """
+    Drive a :class:`fastboottcp.FastbootTCPClient` against a :class:`fastboottcpserver.FastbootTCPServer`.
+    """
+
+    MAX_DOWNLOAD_SIZE = 1024 * 1024
+
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self._server = FastbootTCPServer(max_download_size=FastbootTCPClientTest.MAX_DOWNLOAD_SIZE)
+        self._server.start()
+        self._serial = 'tcp:{}:{}'.format(*self._server.address())
+        self._client = FastbootTCPClient(*self._server.address())
+
+    def tearDown(self) -> None:
+        self._client.close()
+        FastbootTCPClient.drop_session(self._serial)
+        self._server.shutdown()
+        self._directory.cleanup()
+
+    def test_address(self) -> None:
+        self.assertEqual(FastbootTCPClient.address('tcp:192.168.1.2'), ('192.168.1.2', FastbootTCPClient.DEFAULT_PORT))
+        self.assertEqual(FastbootTCPClient.address('tcp:192.168.1.2:1234'), ('192.168.1.2', 1234))
+        self.assertTrue(FastbootTCPClient.is_tcp_serial('tcp:192.168.1.2'))
+        self.assertFalse(FastbootTCPClient.is_tcp_serial('0123456789ABCDEF'))
+
+    def test_commands_wait_forever(self) -> None:
+        # Flashing or erasing a large partition takes longer than the handshake timeout.
+        self.assertIsNone(self._client._socket.gettimeout())
+
+    def test_erase(self) -> None:
+        self._client.erase('userdata')
+        self.assertEqual(self._server.partitions(), {'userdata': ''})
+
+    def test_failure(self) -> None:
+        with self.assertRaises(RuntimeError):
+            self._client.command('oem unknown')
+        # The session can still be used after a failure.
+        self.assertEqual(self._client.getvar('product'), 'stand-in')
+
+    def test_flash(self) -> None:
+        data = os.urandom(FastbootTCPClientTest.MAX_DOWNLOAD_SIZE - 1)
+        self._client.flash('system', self._write('system.img', data))
+        self._client.flash('vbmeta', self._write('vbmeta.img', data[:1000]))
+        self.assertEqual(self._server.partitions(), {'system': hashlib.sha256(data).hexdigest(),
+                                                     'vbmeta': hashlib.sha256(data[:1000]).hexdigest()})
+
+    def test_flash_archive_image(self) -> None:
+        # Stored and deflated entries are streamed out of the archive.
+        data = os.urandom(100000) + bytes(100000)
+        archive_path = os.path.join(self._directory.name, 'images.zip')
+        with zipfile.ZipFile(archive_path, 'w') as archive:
+            archive.writestr('boot.img', data, zipfile.ZIP_STORED)
+            archive.writestr('system.img', data, zipfile.ZIP_DEFLATED)
+        for partition, image in sorted(ImageArchive(archive_path).images().items()):
+            self._client.flash_stream(partition, str(image), image.size(), image.chunks())
+        self.assertEqual(self._server.partitions(), {'boot': hashlib.sha256(data).hexdigest(),
+                                                     'system': hashlib.sha256(data).hexdigest()})
+
+    def test_flash_stream_wrong_size(self) -> None:
+        with self.assertRaises(ConnectionError):
+            self._client.flash_stream('system', 'system.img', 1000, [bytes(500)])
+
+    def test_flash_too_large(self) -> None:
+        with self.assertRaises(ValueError):
+            self._client.flash('system', self._write('system.img', bytes(FastbootTCPClientTest.MAX_DOWNLOAD_SIZE + 1)))
+        self.assertEqual(self._server.partitions(), dict())
+
+    def test_getvar(self) -> None:
+        self.assertEqual(self._client.getvar('product'), 'stand-in')
+        self.assertEqual(self._client.getvar('unknown'), '')
+        self.assertEqual(self._client.max_download_size(), FastbootTCPClientTest.MAX_DOWNLOAD_SIZE)
+
+    def test_getvars(self) -> None:
+        variables = self._client.getvars()
+        self.assertEqual(variables['current-slot'], 'a')
+        self.assertEqual(variables['product'], 'stand-in')
+        self.assertEqual(int(variables['max-download-size'], 0), FastbootTCPClientTest.MAX_DOWNLOAD_SIZE)
+
+    def test_invalid_handshake(self) -> None:
+        with socket.socket() as listening_socket:
+            listening_socket.bind(('127.0.0.1', 0))
+            listening_socket.listen(1)
+
+            def answer() -> None:
+                connection, _ = listening_socket.accept()
+                with connection:
+                    connection.recv(4)
+                    connection.sendall(b'XX01')
+
+            thread = threading.Thread(target=answer)
+            thread.start()
+            with self.assertRaises(ConnectionError):
+                FastbootTCPClient(*listening_socket.getsockname())
+            thread.join()
+
+    def test_session(self) -> None:
+        session = FastbootTCPClient.session(self._serial)
+        self.assertIs(FastbootTCPClient.session(self._serial), session)
+        session.erase('cache')
+        FastbootTCPClient.drop_session(self._serial)
+        self.assertIsNot(FastbootTCPClient.session(self._serial), session)
+
+    def test_wipe_userdata(self) -> None:
+        # The stand-in has no cache partition.
+        FastbootAdapter.wipe_userdata(self._serial)
+        self.assertEqual(self._server.partitions(), {'metadata': '', 'userdata': ''})
+
+    def _write(self, name: str, data: bytes) -> str:
+        path = os.path.join(self._directory.name, name)
+        with open(path, 'wb') as image_file:
+            image_file.write(data)
+        return path
+
+
+if __name__ == '__main__':
+    unittest.main()
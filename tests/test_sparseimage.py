@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import os
+import random
+import struct
+import tempfile
+import unittest
+
+from sparseimage import SparseImage
+from typing import List
+
+
+class SparseImageTest(unittest.TestCase):
+    """
+    Split synthetic raw images into sparse images then unsparse them back, for several sizes of sparse images.
+    """
+
+    BLOCK_SIZE = 4096
+
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self._random = random.Random(0)
+
+    def tearDown(self) -> None:
+        self._directory.cleanup()
+
+    def test_chunks(self) -> None:
+        image = self._raw_blocks(2) + bytes(3 * self.BLOCK_SIZE) + b'\xab\xcd\xef\x01' * (self.BLOCK_SIZE // 2) + \
+            self._raw_blocks(1)[:100]
+        self.assertEqual(SparseImage(self._write('image', image)).chunks(), [
+            (SparseImage.CHUNK_TYPE_RAW, 0, 2, b''),
+            (SparseImage.CHUNK_TYPE_FILL, 2, 3, bytes(4)),
+            (SparseImage.CHUNK_TYPE_FILL, 5, 2, b'\xab\xcd\xef\x01'),
+            (SparseImage.CHUNK_TYPE_RAW, 7, 1, b'')
+        ])
+
+    def test_round_trip(self) -> None:
+        images = {
+            'empty': b'',
+            'raw': self._raw_blocks(9),
+            'fill': bytes(5 * self.BLOCK_SIZE) + b'\x01\x02\x03\x04' * (4 * self.BLOCK_SIZE // 4),
+            'mixed': self._raw_blocks(3) + bytes(6 * self.BLOCK_SIZE) + self._raw_blocks(4) +
+            b'\xff' * (2 * self.BLOCK_SIZE) + self._raw_blocks(1),
+            'odd_size': self._raw_blocks(2) + bytes(self.BLOCK_SIZE) + self._raw_blocks(1)[:1234],
+            'tiny': b'\x42' * 3
+        }
+        max_sizes = [3 * self.BLOCK_SIZE, 4 * self.BLOCK_SIZE + 512, 16 * self.BLOCK_SIZE, 1024 * 1024 * 1024]
+        for name, image in sorted(images.items()):
+            for max_size in max_sizes:
+                with self.subTest(image=name, max_size=max_size):
+                    sparse_image = SparseImage(self._write(name, image))
+                    part_paths = sparse_image.split(os.path.join(self._directory.name, '{}-{}'.format(name, max_size)),
+                                                    max_size)
+                    for part_path in part_paths:
+                        self.assertTrue(SparseImage.is_sparse(part_path))
+                        self.assertLessEqual(os.path.getsize(part_path), max_size)
+                    if max_size >= 16 * self.BLOCK_SIZE and len(image) <= 8 * self.BLOCK_SIZE:
+                        self.assertEqual(len(part_paths), 1)
+                    self.assertEqual(self._unsparse(part_paths), self._padded(image))
+
+    def test_dont_care_and_crc32_chunks(self) -> None:
+        # Blocks left as "don't care" by every sparse image are zeros in the raw image, CRC32 chunks are skipped.
+        raw_block = self._raw_blocks(1)
+        chunks = [
+            struct.pack('<HHII', SparseImage.CHUNK_TYPE_DONT_CARE, 0, 2, 12),
+            struct.pack('<HHII', SparseImage.CHUNK_TYPE_RAW, 0, 1, 12 + self.BLOCK_SIZE) + raw_block,
+            struct.pack('<HHII', SparseImage.CHUNK_TYPE_CRC32, 0, 0, 16) + b'\x00' * 4,
+            struct.pack('<HHII', SparseImage.CHUNK_TYPE_FILL, 0, 1, 16) + b'\x07' * 4
+        ]
+        sparse_path = self._write('handmade', struct.pack('<IHHHHIIII', SparseImage.MAGIC, 1, 0, 28, 12,
+                                                          self.BLOCK_SIZE, 4, len(chunks), 0) + b''.join(chunks))
+        self.assertEqual(self._unsparse([sparse_path]),
+                         bytes(2 * self.BLOCK_SIZE) + raw_block + b'\x07' * self.BLOCK_SIZE)
+
+    def test_max_size_too_small(self) -> None:
+        sparse_image = SparseImage(self._write('image', self._raw_blocks(2)))
+        with self.assertRaises(ValueError):
+            sparse_image.split(os.path.join(self._directory.name, 'image'), self.BLOCK_SIZE)
+
+    def _padded(self, image: bytes) -> bytes:
+        # Sparse images cover whole blocks, the last one is padded with zeros.
+        return image + bytes(-len(image) % self.BLOCK_SIZE)
+
+    def _raw_blocks(self, num_blocks: int) -> bytes:
+        return bytes(self._random.getrandbits(8) for _ in range(num_blocks * self.BLOCK_SIZE))
+
+    def _unsparse(self, sparse_paths: List[str]) -> bytes:
+        output_path = os.path.join(self._directory.name, 'unsparsed')
+        SparseImage.unsparse(sparse_paths, output_path)
+        with open(output_path, 'rb') as output_file:
+            return output_file.read()
+
+    def _write(self, name: str, data: bytes) -> str:
+        path = os.path.join(self._directory.name, '{}.img'.format(name))
+        with open(path, 'wb') as image_file:
+            image_file.write(data)
+        return path
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding:utf8  -*-
+
+#
+# MIT License
+#
+# Copyright (c) 2018-2021 Jean-Marie BARAN (jeanmarie.baran@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+import base64
+import contexts
+import functools
+import hashlib
+import io
+import json
+import os
+import re
+import struct
+import time
+import zipfile
+
+from avb import VBMetaImage
+from payload import Payload
+from tasks import TaskGraph
+from typing import Dict, List
+
+
+class Verifier(object):
+    """
+    Verify the files generated by a :class:`sign.Signer` before they are released:
+
+    - every entry of the signed zips is read back, which checks its CRC, and its SHA-256 is recorded
+    - every APK of the signed target file embeds the certificate it is expected to be signed with (see
+      ``META/apkcerts.txt``), and this certificate is one of the release keys
+    - every vbmeta image of the signed image file is signed, and its hash is valid
+    - the payload of every A/B OTA file can be read, and updates partitions (see :class:`payload.Payload`)
+
+    The checks run concurrently and must all be done before a deadline. The result is written to a JSON record.
+    """
+
+    _BUFFER_SIZE = 1024 * 1024
+
+    _APK_CERTIFICATES_PATH = 'META/apkcerts.txt'
+    _APK_CERTIFICATES_PATTERN = re.compile(r'name="([^"]+)"\s+certificate="([^"]*)"')
+    _APK_SIGNING_BLOCK_MAGIC = b'APK Sig Block 42'
+    _END_OF_CENTRAL_DIRECTORY_MAGIC = b'PK\x05\x06'
+    _PEM_PATTERN = re.compile(rb'-----BEGIN CERTIFICATE-----(.+?)-----END CERTIFICATE-----', re.DOTALL)
+    _SIGNATURE_FILE_PATTERN = re.compile(r'^META-INF/[^/]+\.(RSA|DSA|EC)$')
+
+    # Certificates which are not files: APKs signed outside of the build, or by the signer script itself.
+    _UNCHECKED_CERTIFICATES = ['', 'EXTERNAL', 'PRESIGNED']
+
+    def __init__(self, key_path: str, timeout_sec: int) -> None:
+        self._deadline = 0
+        self._key_path = os.path.realpath(key_path)
+        self._timeout_sec = timeout_sec
+
+    def verify(self, signed_target_file_path: str, signed_file_paths: List[str], record_path: str) -> None:
+        """
+        :param signed_target_file_path: path to the signed target file, whose APKs are checked.
+        :param signed_file_paths: paths to all the signed zips, including the signed target file. vbmeta images are
+                                  looked for in all of them except the signed target file.
+        :param record_path: where to write the record of the verification.
+        :raise ValueError: if a check fails.
+        :raise TimeoutError: if the checks take longer than the timeout.
+        """
+        self._deadline = time.time() + self._timeout_sec
+        record = {'digests': dict(), 'payloads': dict(), 'problems': list(), 'vbmeta': dict()}
+
+        task_graph = TaskGraph()
+        for file_path in signed_file_paths:
+            task_graph.add('digests-{}'.format(os.path.basename(file_path)),
+                           functools.partial(self._check_digests, file_path, record))
+            if file_path != signed_target_file_path:
+                task_graph.add('vbmeta-{}'.format(os.path.basename(file_path)),
+                               functools.partial(self._check_vbmeta, file_path, record))
+                task_graph.add('payload-{}'.format(os.path.basename(file_path)),
+                               functools.partial(self._check_payload, file_path, record))
+
+        # The APKs are split between several tasks, as decompressing them is the most expensive check.
+        apk_certificates = self._apk_certificates(signed_target_file_path, record)
+        num_tasks = min(os.cpu_count(), len(apk_certificates))
+        for task_number in range(num_tasks):
+            task_graph.add('apk_certificates-{}'.format(task_number),
+                           functools.partial(self._check_apks, signed_target_file_path,
+                                             apk_certificates[task_number::num_tasks], record))
+
+        timings = task_graph.run()
+        record['timings'] = timings
+        with open(record_path, 'w') as record_file:
+            json.dump(record, record_file, indent=2, sort_keys=True)
+        print(TaskGraph.description(timings))
+
+        if record['problems']:
+            raise ValueError('Verification failed:\n{}'.format('\n'.join(sorted(record['problems']))))
+
+    def _apk_certificates(self, signed_target_file_path: str, record: Dict[str, object]) -> List[List[str]]:
+        # The entries of the APKs and the DER certificates they must embed, out of ``META/apkcerts.txt``. APKs are
+        # identified by their file name, which is unique in a target file. The paths of the certificates are relative to
+        # the root of the tree, which is the working directory of the signer's context.
+        with zipfile.ZipFile(signed_target_file_path) as signed_target_file:
+            apk_entries = dict()
+            for name in signed_target_file.namelist():
+                if name.endswith('.apk'):
+                    apk_entries[os.path.basename(name)] = name
+            apk_certificates_lines = signed_target_file.read(Verifier._APK_CERTIFICATES_PATH).decode().splitlines()
+
+        certificates = dict()
+        apk_certificates = list()
+        for line in apk_certificates_lines:
+            match = Verifier._APK_CERTIFICATES_PATTERN.search(line)
+            if not match or match.group(2) in Verifier._UNCHECKED_CERTIFICATES or match.group(1) not in apk_entries:
+                continue
+            apk_name, certificate_path = match.groups()
+            certificate_file_path = os.path.realpath(contexts.current().path(certificate_path))
+            if os.path.commonpath([certificate_file_path, self._key_path]) != self._key_path:
+                record['problems'].append('{} is signed with {}, which is not a release key'.format(
+                    apk_name, certificate_path))
+                continue
+            if certificate_path not in certificates:
+                with open(certificate_file_path, 'rb') as certificate_file:
+                    certificates[certificate_path] = base64.b64decode(
+                        Verifier._PEM_PATTERN.search(certificate_file.read()).group(1))
+            apk_certificates.append([apk_entries[apk_name], certificate_path, certificates[certificate_path]])
+        return apk_certificates
+
+    def _check_apks(self, signed_target_file_path: str, apk_certificates: List[List[str]],
+                    record: Dict[str, object]) -> None:
+        # Each task opens the zip on its own, as reading a zip is not thread-safe.
+        with zipfile.ZipFile(signed_target_file_path) as signed_target_file:
+            for apk_entry, certificate_path, certificate in apk_certificates:
+                self._check_deadline()
+                apk = signed_target_file.read(apk_entry)
+                if not any(certificate in signature for signature in Verifier._apk_signatures(apk)):
+                    record['problems'].append('{} is not signed with {}'.format(apk_entry, certificate_path))
+
+    def _check_deadline(self) -> None:
+        if time.time() > self._deadline:
+            raise TimeoutError('Verification took longer than {}s'.format(self._timeout_sec))
+
+    def _check_digests(self, file_path: str, record: Dict[str, object]) -> None:
+        digests = dict()
+        try:
+            with zipfile.ZipFile(file_path) as zip_file:
+                for name in zip_file.namelist():
+                    digest = hashlib.sha256()
+                    with zip_file.open(name) as entry:
+                        for buffer in iter(lambda: entry.read(Verifier._BUFFER_SIZE), b''):
+                            self._check_deadline()
+                            digest.update(buffer)
+                    digests[name] = digest.hexdigest()
+        except zipfile.BadZipFile as exception:
+            record['problems'].append('{}: {}'.format(os.path.basename(file_path), exception))
+        record['digests'][os.path.basename(file_path)] = digests
+
+    def _check_payload(self, file_path: str, record: Dict[str, object]) -> None:
+        with zipfile.ZipFile(file_path) as zip_file:
+            if Payload.NAME not in zip_file.namelist():
+                return
+        try:
+            payload = Payload(file_path)
+        except (ValueError, IndexError, struct.error) as exception:
+            record['problems'].append('{}: invalid {}: {}'.format(os.path.basename(file_path), Payload.NAME,
+                                                                  exception))
+            return
+        record['payloads'][os.path.basename(file_path)] = payload.to_dict()
+        if not payload.partitions():
+            record['problems'].append('{}: {} updates no partition'.format(os.path.basename(file_path), Payload.NAME))
+
+    def _check_vbmeta(self, file_path: str, record: Dict[str, object]) -> None:
+        with zipfile.ZipFile(file_path) as zip_file:
+            for name in zip_file.namelist():
+                if not re.match(r'^(IMAGES/)?vbmeta[^/]*\.img$', name):
+                    continue
+                self._check_deadline()
+                try:
+                    vbmeta_image = VBMetaImage(zip_file.read(name))
+                except ValueError as exception:
+                    record['problems'].append('{}: {}'.format(name, exception))
+                    continue
+                record['vbmeta']['{}:{}'.format(os.path.basename(file_path), name)] = vbmeta_image.to_dict()
+                if not vbmeta_image.is_hash_valid():
+                    record['problems'].append('{} is not signed, or its hash is invalid ({})'.format(
+                        name, vbmeta_image.algorithm()))
+
+    @staticmethod
+    def _apk_signatures(apk: bytes) -> List[bytes]:
+        # The certificates are embedded as is in the APK Signing Block (v2 and later signature schemes), which is right
+        # before the central directory, and in the PKCS #7 signature files (v1 signature scheme).
+        signatures = list()
+        end_of_central_directory_offset = apk.rfind(Verifier._END_OF_CENTRAL_DIRECTORY_MAGIC,
+                                                    max(0, len(apk) - 65557))
+        if end_of_central_directory_offset >= 0:
+            central_directory_offset = struct.unpack_from('<I', apk, end_of_central_directory_offset + 16)[0]
+            if apk[central_directory_offset - 16:central_directory_offset] == Verifier._APK_SIGNING_BLOCK_MAGIC:
+                block_size = struct.unpack_from('<Q', apk, central_directory_offset - 24)[0]
+                signatures.append(apk[central_directory_offset - block_size - 8:central_directory_offset])
+
+        with zipfile.ZipFile(io.BytesIO(apk)) as apk_file:
+            for name in apk_file.namelist():
+                if Verifier._SIGNATURE_FILE_PATTERN.match(name):
+                    signatures.append(apk_file.read(name))
+        return signatures